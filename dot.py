@@ -10,9 +10,10 @@ import argparse
 import collections
 import errno
 import functools
-import glob
 import json
 import os
+import re
+import stat
 import sys
 
 # Python 2/3 compatibility
@@ -20,17 +21,51 @@ try:
     input = raw_input  # type: ignore[name-defined]  # Python 2
 except NameError:
     pass  # Python 3
-
-# Optional YAML config support. PyYAML must never be a hard requirement:
-# dot.py is zero-dependency and JSON always works.
 try:
-    import yaml  # type: ignore[import-untyped]
-except ImportError:
-    yaml = None  # type: ignore[assignment]
+    string_types = (basestring,)  # type: ignore[name-defined]  # Python 2
+except NameError:
+    string_types = (str,)  # Python 3
+
+# dot runs from shell startup and editor hooks, so anything a plain JSON
+# `dot link` does not need (PyYAML, glob, hashlib, threading, ...) is
+# imported on first use rather than here.
+_NOT_LOADED = object()
+
+
+def _yaml():
+    """PyYAML, imported on first use; None when it is not installed.
+
+    PyYAML must never be a hard requirement: dot.py is zero-dependency and
+    JSON always works.
+    """
+    module = globals().get("yaml", _NOT_LOADED)
+    if module is _NOT_LOADED:
+        try:
+            import yaml as module  # type: ignore[import-untyped,no-redef]
+        except ImportError:
+            module = None
+        globals()["yaml"] = module
+    return module
+
+
+def __getattr__(name):
+    # PEP 562: keep `dot.yaml` working without importing it at load time
+    if name == "yaml":
+        return _yaml()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
 
 VERSION = "1.1.0"
 DEFAULT_CONFIG = "dotfiles.json"
 DEBUG = False
+STATE_FORMAT = 1
+JOURNAL_FORMAT = 1
+COPIES_FORMAT = 1
+ADOPTED_FORMAT = 1
+CONFIG_CACHE_FORMAT = 2
+MEMO_SIZE = 1 << 16  # entries per memo of expanded paths, realpaths, globs
+APPLY_CHUNK = 1024  # entries handed to the --jobs thread pool at once
+DIR_FDS = 32  # target directories each applying thread keeps open
 
 
 # ANSI color codes
@@ -105,6 +140,431 @@ def confirm(prompt, default=False):
 _errcho = print_error
 
 
+class DotError(Exception):
+    """A bad manifest entry or filesystem state that stops a run.
+
+    The CLI reports it like print_error; callers that isolate failures
+    (manifest layers) catch it instead.
+    """
+
+
+class ManifestError(DotError):
+    """A manifest that cannot be loaded, or an entry dot cannot use."""
+
+
+class SourceError(DotError):
+    """A link source that does not resolve to anything dot can link."""
+
+
+class ConflictError(DotError):
+    """A target dot cannot link: claimed twice, or occupied by something
+    dot will not replace."""
+
+
+class FilesystemError(DotError):
+    """A filesystem call failed while linking: a parent dir that cannot be
+    created (e.g. a file is in the way), permission denied, ..."""
+
+
+# One manifest in a layered run; later layers win on a shared target.
+Layer = collections.namedtuple("Layer", "name path config base_dir")
+
+
+class _Stats(object):
+    """Per-phase wall time and filesystem call counts for --stats.
+
+    install() wraps the os functions dot reaches (directly or through
+    os.path) plus its own _glob, counting each call against the current
+    phase; uninstall() puts them back. Nothing is wrapped unless --stats
+    is given, so a normal run pays only for the _phase() lookups.
+    """
+
+    PHASES = ("config", "state", "resolve", "plan", "apply")
+    CALLS = (
+        ("lstat", os, "lstat"),
+        ("stat", os, "stat"),
+        ("readlink", os, "readlink"),
+        ("realpath", os.path, "realpath"),
+        ("glob", None, "_glob"),
+        ("scandir", os, "scandir"),
+        ("mkdir", os, "mkdir"),
+        ("symlink", os, "symlink"),
+        ("rename", os, "rename"),
+        ("unlink", os, "unlink"),
+        ("open", os, "open"),
+    )
+
+    def __init__(self):
+        import threading
+        import time
+
+        self._clock = time.time if sys.version_info[0] < 3 else time.perf_counter
+        self._lock = threading.Lock()
+        self._saved = []
+        self._stack = ["other"]
+        self._started = {}
+        self._t0 = self._clock()
+        self.wall = collections.defaultdict(float)
+        self.counts = collections.defaultdict(collections.Counter)
+        self.memos = []  # every _Memo made while installed
+
+    def install(self):
+        module = sys.modules[__name__]
+        for name, owner, attr in self.CALLS:
+            owner = owner or module
+            func = getattr(owner, attr, None)
+            if func is None:  # e.g. os.scandir on Python 2
+                continue
+            self._saved.append((owner, attr, func))
+            setattr(owner, attr, self._counted(name, func))
+        return self
+
+    def uninstall(self):
+        while self._saved:
+            owner, attr, func = self._saved.pop()
+            setattr(owner, attr, func)
+
+    def _counted(self, name, func):
+        def counted(*args, **kwargs):
+            with self._lock:
+                self.counts[self._stack[-1]][name] += 1
+            return func(*args, **kwargs)
+
+        return counted
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        name = self._stack.pop()
+        self.wall[name] += self._clock() - self._started.pop(name)
+
+    def phase(self, name):
+        self._stack.append(name)
+        self._started[name] = self._clock()
+        return self
+
+    def totals(self):
+        """Call counts summed over every phase."""
+        total = collections.Counter(dict((name, 0) for name, _, _ in self.CALLS))
+        for counts in self.counts.values():
+            total.update(counts)
+        return dict(total)
+
+    def memo_totals(self):
+        """{memo name: {"hits", "misses", "entries"}} summed over memos."""
+        totals = collections.OrderedDict()
+        for memo in self.memos:
+            total = totals.setdefault(
+                memo.name, {"hits": 0, "misses": 0, "entries": 0, "size": memo.size}
+            )
+            total["hits"] += memo.hits
+            total["misses"] += memo.misses
+            total["entries"] += len(memo)
+        return totals
+
+    def report(self):
+        """The --stats table: one row per phase that ran, then the total,
+        then the hit rate of each memo."""
+        names = [name for name, _, _ in self.CALLS]
+        phases = [
+            p for p in self.PHASES + ("other",) if p in self.wall or p in self.counts
+        ]
+        rows = [["phase", "ms"] + names]
+        total = collections.Counter()
+        for phase in phases:
+            total.update(self.counts[phase])
+            rows.append(
+                [phase, "{:.1f}".format(self.wall[phase] * 1000)]
+                + [str(self.counts[phase][n]) for n in names]
+            )
+        rows.append(
+            ["total", "{:.1f}".format((self._clock() - self._t0) * 1000)]
+            + [str(total[n]) for n in names]
+        )
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = [
+            "  ".join(
+                cell.ljust(width) if i == 0 else cell.rjust(width)
+                for i, (cell, width) in enumerate(zip(row, widths))
+            )
+            for row in rows
+        ]
+        for name, total in self.memo_totals().items():
+            lookups = total["hits"] + total["misses"]
+            lines.append(
+                "memo {}: {}/{} hits ({:.1f}%), {} entries (max {})".format(
+                    name,
+                    total["hits"],
+                    lookups,
+                    100.0 * total["hits"] / lookups if lookups else 0.0,
+                    total["entries"],
+                    total["size"],
+                )
+            )
+        return "\n".join(lines)
+
+
+class _NoPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+_STATS = None  # the active _Stats while --stats is on
+
+
+def _phase(name):
+    """Context manager timing a --stats phase (a shared no-op otherwise)."""
+    return _NO_PHASE if _STATS is None else _STATS.phase(name)
+
+
+class _Memo(object):
+    """A bounded memo for one kind of per-run result, counting its hits.
+
+    Behaves like the plain dicts _FsCache keeps (KeyError on a miss), but
+    drops its oldest entries beyond size, so a huge manifest cannot grow it
+    without limit. Memos made while --stats is on are reported by it.
+    """
+
+    def __init__(self, name, size=None):
+        self.name = name
+        self.size = size or MEMO_SIZE
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        if _STATS is not None:
+            _STATS.memos.append(self)
+
+    def __getitem__(self, key):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+
+class _StatInfo(object):
+    """The fields of a stat result dot looks at, and nothing else.
+
+    An os.stat_result is a tuple of some twenty separately allocated
+    numbers; _FsCache keeps one per path it looked at (200k+ for a 100k
+    link manifest), so it keeps these instead.
+    """
+
+    __slots__ = ("st_mode", "st_size", "st_mtime_ns")
+
+    def __init__(self, info):
+        self.st_mode = info.st_mode
+        self.st_size = info.st_size
+        # what _mtime() reads: st_mtime_ns, or the float st_mtime on Python 2
+        self.st_mtime_ns = _mtime(info)
+
+
+def _stat_info(func, path):
+    """func(path) (os.stat or os.lstat) as a _StatInfo, or None."""
+    try:
+        return _StatInfo(func(path))
+    except OSError:
+        return None
+
+
+class _ListedEntry(object):
+    """A directory entry as os.scandir yields it, for Python 2 (which has
+    only os.listdir): is_dir and is_symlink stat through fs if given."""
+
+    __slots__ = ("name", "path", "_fs")
+
+    def __init__(self, parent, name, fs=None):
+        self.name = name
+        self.path = os.path.join(parent, name)
+        self._fs = fs
+
+    def is_symlink(self):
+        if self._fs is not None:
+            return self._fs.islink(self.path)
+        info = _stat_info(os.lstat, self.path)
+        return info is not None and stat.S_ISLNK(info.st_mode)
+
+    def is_dir(self):
+        if self._fs is not None:
+            return self._fs.isdir(self.path)
+        info = _stat_info(os.stat, self.path)
+        return info is not None and stat.S_ISDIR(info.st_mode)
+
+
+def _scandir(path, fs=None):
+    """os.scandir(path), or the same entries built from os.listdir where
+    there is no scandir (Python 2), statted through fs (an _FsCache)."""
+    scandir = getattr(os, "scandir", None)
+    if scandir is not None:
+        return scandir(path)
+    return [_ListedEntry(path, name, fs) for name in os.listdir(path)]
+
+
+# every call _DirFds makes with dir_fd= (Python 3.3+ on most POSIX systems)
+_DIR_FD_SUPPORTED = hasattr(os, "O_DIRECTORY") and set(
+    (os.stat, os.readlink, os.symlink, os.rename, os.unlink, os.mkdir, os.rmdir)
+) <= set(getattr(os, "supports_dir_fd", ()))
+_SCANDIR_FD = _DIR_FD_SUPPORTED and getattr(os, "scandir", None) in os.supports_fd
+_DIR_OPEN_FLAGS = (
+    os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0)
+)
+
+
+class _DirFds(object):
+    """Target directories held open while links are applied or removed.
+
+    Inside ``with dirs:`` each lstat, readlink, symlink, rename, unlink,
+    mkdir and rmdir names one component relative to its parent (dir_fd=)
+    instead of a full path the kernel walks again, which adds up for deep
+    targets on network filesystems; and once a parent is open, swapping
+    it for a symlink cannot redirect the write. Links are applied
+    parent-first, so siblings share one open. Each thread keeps its
+    DIR_FDS most recently used directories. Outside ``with``, where the
+    platform has no dir_fd, or when a parent cannot be opened, the full
+    path is used as before.
+    """
+
+    def __init__(self, size=None):
+        import threading
+
+        self.size = size or DIR_FDS
+        self._depth = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._maps = []  # every thread's {dir: fd}, oldest first
+
+    def __enter__(self):
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if not self._depth:
+            with self._lock:
+                for fds in self._maps:
+                    while fds:
+                        os.close(fds.popitem()[1])
+
+    def _split(self, path):
+        """(parent fd, name) for path, or (None, path) to use the path."""
+        parent, name = os.path.split(path)
+        fd = self._open(parent) if name else None
+        return (None, path) if fd is None else (fd, name)
+
+    def _open(self, path):
+        """This thread's open fd for directory path, or None."""
+        if not (self._depth and _DIR_FD_SUPPORTED and path):
+            return None
+        fds = getattr(self._local, "fds", None)
+        if fds is None:
+            fds = self._local.fds = collections.OrderedDict()
+            with self._lock:
+                self._maps.append(fds)
+        with self._lock:
+            fd = fds.pop(path, None)
+            if fd is not None:
+                fds[path] = fd  # most recently used goes last
+                return fd
+        try:
+            fd = os.open(path, _DIR_OPEN_FLAGS)
+        except OSError:
+            return None
+        with self._lock:
+            fds[path] = fd
+            while len(fds) > self.size:
+                os.close(fds.popitem(last=False)[1])
+        return fd
+
+    def scandir(self, path):
+        """The entries of directory path (read through its fd if open)."""
+        fd = self._open(path) if _SCANDIR_FD else None
+        return _scandir(path) if fd is None else os.scandir(fd)
+
+    def forget(self, path):
+        """Close what is open at or below path: dot just removed or
+        replaced it (creating something where nothing was needs none).
+
+        Another thread's directory is only closed when dot changes it,
+        and the --jobs waves never run a link and one inside it at once.
+        """
+        if not self._maps:
+            return
+        prefix = path.rstrip(os.path.sep) + os.path.sep
+        with self._lock:
+            for fds in self._maps:
+                for parent in [p for p in fds if p == path or p.startswith(prefix)]:
+                    os.close(fds.pop(parent))
+
+    def lstat(self, path):
+        fd, name = self._split(path)
+        if fd is None:
+            return os.lstat(path)
+        return os.lstat(name, dir_fd=fd)
+
+    def readlink(self, path):
+        fd, name = self._split(path)
+        if fd is None:
+            return os.readlink(path)
+        return os.readlink(name, dir_fd=fd)
+
+    def symlink(self, source, path):
+        fd, name = self._split(path)
+        if fd is None:
+            os.symlink(source, path)
+        else:
+            os.symlink(source, name, dir_fd=fd)
+
+    def rename(self, src, dst):
+        src_fd, src_name = self._split(src)
+        dst_fd, dst_name = self._split(dst)
+        if src_fd is None or dst_fd is None:
+            os.rename(src, dst)
+        else:
+            os.rename(src_name, dst_name, src_dir_fd=src_fd, dst_dir_fd=dst_fd)
+        self.forget(dst)
+
+    def unlink(self, path):
+        fd, name = self._split(path)
+        if fd is None:
+            os.unlink(path)
+        else:
+            os.unlink(name, dir_fd=fd)
+        self.forget(path)
+
+    def mkdir(self, path):
+        fd, name = self._split(path)
+        if fd is None:
+            os.mkdir(path)
+        else:
+            os.mkdir(name, dir_fd=fd)
+
+    def rmdir(self, path):
+        fd, name = self._split(path)
+        if fd is None:
+            os.rmdir(path)
+        else:
+            os.rmdir(name, dir_fd=fd)
+        self.forget(path)
+
+
 def _normalize_path(path, globbing=False, resolve=True):
     funcs = [
         os.path.expandvars,
@@ -112,21 +572,249 @@ def _normalize_path(path, globbing=False, resolve=True):
         os.path.realpath if resolve else os.path.abspath,
     ]
     if globbing:
+        import glob
+
         funcs.append(glob.glob)
     return functools.reduce(lambda x, y: y(x), funcs, path)
 
 
-def _filetype(path):
+class _FsCache(object):
+    """Per-run cache of lstat/stat/readlink/realpath results.
+
+    One lstat answers "is it there, is it a symlink, is it a directory",
+    so each path costs one syscall per run instead of one per question.
+    Stat results are kept as _StatInfo (mode, size and mtime only). While
+    ``with fs.dirs:`` is active, lstat and readlink go through its open
+    target directories, and so should everything apply mutates.
+    Anything dot mutates must be invalidate()d; that also drops every
+    cached path beneath it (e.g. the children of a repointed dir link).
+    Expanded sources, realpaths and glob results are bounded _Memos.
+    """
+
+    def __init__(self):
+        self._lstat = {}
+        self._stat = {}
+        self._readlink = {}
+        self._realpath = _Memo("realpath")
+        self._listdir = {}
+        self._expand = _Memo("expand")
+        self._glob = _Memo("glob")
+        # glob root -> memoized patterns listing it or directories below it
+        self._glob_roots = collections.defaultdict(set)
+        # parent -> cached children, so invalidation can drop a subtree
+        self._children = collections.defaultdict(set)
+        import threading
+
+        self._lock = threading.Lock()
+        self.dirs = _DirFds()
+        # directories whose listing decided a glob -> mtime when first seen
+        self.glob_dirs = {}
+        # (op, path[, source]) for each link and directory this run created
+        self.journal = []
+
+    def _remember(self, cache, path, value):
+        with self._lock:
+            cache[path] = value
+            self._track(path)
+        return value
+
+    def _track(self, path):
+        """Record path in the tree invalidate() walks (lock held)."""
+        child, parent = path, os.path.dirname(path)
+        while parent != child:
+            siblings = self._children[parent]
+            if child in siblings:
+                break
+            siblings.add(child)
+            child, parent = parent, os.path.dirname(parent)
+
+    def lstat(self, path):
+        """os.lstat(path), or None if it does not exist."""
+        try:
+            return self._lstat[path]
+        except KeyError:
+            pass
+        return self._remember(self._lstat, path, _stat_info(self.dirs.lstat, path))
+
+    def stat(self, path):
+        """os.stat(path) (follows symlinks), or None if it does not resolve."""
+        try:
+            return self._stat[path]
+        except KeyError:
+            pass
+        value = self.lstat(path)
+        # lstat and stat only differ when the last component is a symlink
+        if value is not None and stat.S_ISLNK(value.st_mode):
+            value = _stat_info(os.stat, path)
+        return self._remember(self._stat, path, value)
+
+    def readlink(self, path):
+        """os.readlink(path), or None if path is not a symlink."""
+        try:
+            return self._readlink[path]
+        except KeyError:
+            pass
+        try:
+            value = self.dirs.readlink(path)
+        except OSError:
+            value = None
+        return self._remember(self._readlink, path, value)
+
+    def realpath(self, path):
+        """os.path.realpath(path), resolving each parent directory once.
+
+        Sources in one directory share its resolution, so each costs one
+        lstat of its own; only a symlinked component is handed to realpath.
+        """
+        try:
+            return self._realpath[path]
+        except KeyError:
+            pass
+        parent, name = os.path.split(path)
+        if not name or not os.path.isabs(path) or os.path.normpath(path) != path:
+            value = os.path.realpath(path)
+        else:
+            value = os.path.join(self.realpath(parent), name)
+            if self.islink(value):
+                value = os.path.realpath(value)
+        return self._remember(self._realpath, path, value)
+
+    def expand(self, source, base_dir):
+        """A manifest source with ~ and $VARS expanded, made absolute
+        (relative to base_dir). Patterns are kept as they are."""
+        key = (source, base_dir)
+        try:
+            return self._expand[key]
+        except KeyError:
+            pass
+        expanded = os.path.expandvars(os.path.expanduser(source))
+        if base_dir and not os.path.isabs(expanded):
+            expanded = os.path.join(base_dir, expanded)
+        value = self._expand[key] = os.path.abspath(expanded)
+        return value
+
+    def glob(self, pattern):
+        """_glob(pattern), once per pattern until something under its
+        literal root is invalidated."""
+        root, segments = _split_pattern(pattern)
+        if not segments:
+            return _glob(pattern, self)  # one cached lstat already
+        try:
+            return list(self._glob[pattern])
+        except KeyError:
+            pass
+        value = _glob(pattern, self)
+        with self._lock:
+            self._glob[pattern] = tuple(value)
+            self._glob_roots[root].add(pattern)
+            self._track(root)
+        return value
+
+    def listdir(self, path):
+        """(name, is_dir, is_link) for each entry of directory path.
+
+        One scandir per directory per run, however many patterns list it;
+        is_dir follows symlinks (like glob), is_link is free from d_type.
+        Listed directories are recorded in glob_dirs for the state index.
+        """
+        try:
+            return self._listdir[path]
+        except KeyError:
+            pass
+        self.note_glob_dir(path)
+        try:
+            value = tuple(
+                (entry.name, entry.is_dir(), entry.is_symlink())
+                for entry in _scandir(path, self)
+            )
+        except OSError:
+            value = ()
+        return self._remember(self._listdir, path, value)
+
+    def lexists(self, path):
+        return self.lstat(path) is not None
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def islink(self, path):
+        value = self.lstat(path)
+        return value is not None and stat.S_ISLNK(value.st_mode)
+
+    def isdir(self, path):
+        value = self.stat(path)
+        return value is not None and stat.S_ISDIR(value.st_mode)
+
+    def points_to(self, path, source):
+        """True if the symlink at path resolves to source (a realpath)."""
+        value = self.readlink(path)
+        if value is None:
+            return False
+        # dot writes the resolved source verbatim, so one readlink settles
+        # the common case; anything else (relative, chained) needs realpath
+        return value == source or self.realpath(path) == source
+
+    def note_glob_dir(self, path):
+        """Remember a directory a glob listed, with its mtime at first use."""
+        if path not in self.glob_dirs:
+            self.glob_dirs[path] = _mtime(self.stat(path))
+
+    def invalidate(self, path):
+        """Forget path and everything cached beneath it."""
+        with self._lock:
+            pending = [path]
+            while pending:
+                current = pending.pop()
+                for cache in (
+                    self._lstat,
+                    self._stat,
+                    self._readlink,
+                    self._realpath,
+                    self._listdir,
+                ):
+                    cache.pop(current, None)
+                for pattern in self._glob_roots.pop(current, ()):
+                    self._glob.pop(pattern)
+                pending.extend(self._children.pop(current, ()))
+            # creating or removing path changes its parent's listing, and
+            # the result of any glob rooted above it
+            self._listdir.pop(os.path.dirname(path), None)
+            parent = os.path.dirname(path)
+            while self._glob_roots:
+                for pattern in self._glob_roots.pop(parent, ()):
+                    self._glob.pop(pattern)
+                if parent == os.path.dirname(parent):
+                    break
+                parent = os.path.dirname(parent)
+
+
+def _mtime(info):
+    """Best-resolution mtime of a stat result (None if missing)."""
+    if info is None:
+        return None
+    mtime = getattr(info, "st_mtime_ns", None)
+    return info.st_mtime if mtime is None else mtime
+
+
+def _filetype(path, fs=None):
     path = _normalize_path(path, resolve=False)
-    return filter(
-        None,
-        [
-            os.path.islink(path) and "link",
-            os.path.isdir(path) and "dir",
-            os.path.isfile(path) and "file",
-            os.path.ismount(path) and "mount",
-        ],
-    )
+    fs = fs or _FsCache()
+    info = fs.lstat(path)
+    if info is None:
+        return []
+    types = []
+    if stat.S_ISLNK(info.st_mode):
+        types.append("link")
+        info = fs.stat(path)
+        if info is None:
+            return types
+    if stat.S_ISDIR(info.st_mode):
+        types.append("dir")
+        if "link" not in types and os.path.ismount(path):
+            types.append("mount")
+    elif stat.S_ISREG(info.st_mode):
+        types.append("file")
+    return types
 
 
 def load_config(config_path):
@@ -134,27 +822,126 @@ def load_config(config_path):
 
     YAML configs require PyYAML; JSON configs always work.
     """
-    load_errors = (
-        (IOError, ValueError) if yaml is None else (IOError, ValueError, yaml.YAMLError)
-    )
     try:
-        with open(config_path, "r") as f:
-            if config_path.endswith((".yaml", ".yml")):
-                if yaml is None:
-                    print_error(
-                        "{} is a YAML config but PyYAML is not installed. "
-                        "Install it (pip install PyYAML) or use a JSON config.".format(
-                            config_path
-                        )
-                    )
-                    return {}
-                return yaml.safe_load(f) or {}
-            return json.load(f)
-    except load_errors as e:
-        print_error("Failed to load config file {}: {}".format(config_path, e))
+        return _load_config(config_path)
+    except DotError as e:
+        print_error(str(e))
         return {}
 
 
+def _load_config(config_path):
+    """load_config, raising DotError instead of exiting.
+
+    YAML manifests go through the compiled config cache; JSON ones are
+    parsed directly (the C json parser is as fast as reading the cache).
+    """
+    try:
+        with open(config_path, "rb") as f:
+            data = f.read()
+            info = os.fstat(f.fileno())
+    except (IOError, OSError) as e:
+        raise ManifestError("Failed to load config file {}: {}".format(config_path, e))
+    if config_path.endswith((".yaml", ".yml")):
+        config = _load_yaml_config(config_path, data, info)
+    else:
+        try:
+            config = json.loads(data.decode("utf-8"))
+        except ValueError as e:
+            raise ManifestError(
+                "Failed to load config file {}: {}".format(config_path, e)
+            )
+    _validate_config(config, config_path)
+    return config
+
+
+def _load_yaml_config(config_path, data, info):
+    """Parse a YAML manifest, or reuse its compiled copy in the state dir.
+
+    The cache is keyed on path, size, mtime and content hash, so a hit
+    skips PyYAML entirely; anything unreadable or stale is re-parsed.
+    """
+    import hashlib
+
+    key = {
+        "path": os.path.realpath(config_path),
+        "size": info.st_size,
+        "mtime": _mtime(info),
+        "sha256": hashlib.sha256(data).hexdigest(),
+    }
+    cache_path = os.path.join(
+        _state_dir(),
+        "config-cache",
+        "{}.json".format(hashlib.sha1(key["path"].encode("utf-8")).hexdigest()[:16]),
+    )
+    try:
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        if cached["key"] == key and cached["dot_config_cache"] == CONFIG_CACHE_FORMAT:
+            return cached["config"]
+    except (IOError, ValueError, KeyError, TypeError):
+        pass  # missing, corrupt or foreign: parse for real
+
+    yaml = _yaml()
+    if yaml is None:
+        raise ManifestError(
+            "{} is a YAML config but PyYAML is not installed. "
+            "Install it (pip install PyYAML) or use a JSON config.".format(config_path)
+        )
+    # libyaml's C loader when PyYAML was built with it: same result, ~10x faster
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    try:
+        config = yaml.load(data, Loader=loader) or {}
+    except yaml.YAMLError as e:
+        raise ManifestError("Failed to load config file {}: {}".format(config_path, e))
+    _validate_config(config, config_path)
+    if not all(isinstance(t, string_types) for t in config.get("links") or {}):
+        # JSON would turn a null target (`~: tmux/*`, link into home) into
+        # the string "null"; such manifests are parsed on every run
+        return config
+    try:
+        _write_json_atomic(
+            cache_path,
+            {"dot_config_cache": CONFIG_CACHE_FORMAT, "key": key, "config": config},
+        )
+    except (IOError, OSError, TypeError, ValueError) as e:
+        # best effort: a read-only state dir or a non-JSON value only
+        # costs the next run a real parse
+        if DEBUG:
+            print_info("Not caching {}: {}".format(config_path, e))
+    return config
+
+
+def _validate_config(config, config_path):
+    """Reject manifests whose shape dot cannot use, before any resolution."""
+    if not isinstance(config, dict):
+        raise ManifestError(
+            "{}: expected a mapping at the top level".format(config_path)
+        )
+    for key in ("home", "dotfiles"):
+        if config.get(key) is not None and not isinstance(config[key], string_types):
+            raise ManifestError("{}: `{}` must be a string".format(config_path, key))
+    links = config.get("links")
+    if links is None:
+        return
+    if not isinstance(links, dict):
+        raise ManifestError("{}: `links` must be a mapping".format(config_path))
+    for target, source in links.items():
+        if target is not None and not isinstance(target, string_types):
+            raise ManifestError(
+                "{}: link target {!r} must be a string".format(config_path, target)
+            )
+        if isinstance(source, list) and all(
+            isinstance(p, string_types) for p in source
+        ):
+            continue
+        if source is not None and not isinstance(source, string_types):
+            raise ManifestError(
+                "{}: source of {} must be a string, not {!r}".format(
+                    config_path, target, source
+                )
+            )
+
+
 def _config_base_dir(config, config_path):
     """Directory that relative link sources resolve against.
 
@@ -169,94 +956,2315 @@ def _config_base_dir(config, config_path):
     return os.getcwd()
 
 
+# One applied link, as returned by Manifest.apply(): outcome is one of
+# LINK_*, messages the (level, text) pairs the CLI would have printed.
+LinkResult = collections.namedtuple("LinkResult", "target source outcome messages")
+
+
+class Manifest(object):
+    """A loaded manifest, for driving dot from Python.
+
+    The steps behind `dot plan` and `dot link --yes`, without the CLI's
+    side channels: nothing here prints, prompts or exits. Problems raise
+    ManifestError, SourceError, ConflictError or FilesystemError (all
+    DotErrors), results come back as values, and one Manifest can be
+    resolved, planned and applied any number of times (each call looks at
+    the filesystem anew).
+
+        manifest = dot.Manifest.load("dotfiles.json")
+        failed = [r for r in manifest.apply() if r.outcome == dot.LINK_FAILED]
+    """
+
+    def __init__(self, config, base_dir=None, path=None):
+        _validate_config(config, path or "<manifest>")
+        self.config = dict(config)
+        if not self.config.get("home"):
+            self.config["home"] = _normalize_path("~/", globbing=False)
+        self.base_dir = base_dir or _config_base_dir(self.config, path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path, home=None):
+        """Load a JSON or YAML manifest; home applies if it sets none."""
+        config = _load_config(path)
+        if home and not config.get("home"):
+            config["home"] = home
+        return cls(config, path=path)
+
+    def resolve(self, fs=None):
+        """{target: source} for every link, parent-first."""
+        links = self.config.get("links") or {}
+        return _resolve_all_links(links, self.config, self.base_dir, fs)
+
+    def plan(self, fs=None):
+        """The `dot plan` entries: each link classified, nothing changed."""
+        fs = fs or _FsCache()
+        return [entry.as_json() for entry in _plan_links(self.resolve(fs), fs)]
+
+    def apply(self, force_relink=False, keep_going=False):
+        """Create every link (and missing parent dir); a LinkResult each.
+
+        A target that cannot be linked raises ConflictError (or
+        FilesystemError when a syscall fails), after the links before it
+        were made, unless keep_going: then it is returned as a LINK_FAILED
+        result and the rest still apply. Like the CLI, what was created is
+        journaled so `dot unlink` can remove it.
+        """
+        fs = _FsCache()
+        options = argparse.Namespace(
+            yes=True, no_confirm=True, force_relink=force_relink, jobs=1
+        )
+        messages = {}  # target -> [(level, text)]
+
+        def emit_for(target):
+            collected = messages.setdefault(target, [])
+
+            def emit(printer, msg):
+                if printer is _errcho and not keep_going:
+                    raise ConflictError(msg)
+                collected.append((_MESSAGE_LEVELS[printer], msg))
+
+            return emit
+
+        try:
+            entries = _plan_links(self.resolve(fs), fs)
+            outcomes = _link_entries(entries, options, fs, keep_going, emit_for)
+        finally:
+            if self.path and os.path.isfile(self.path):
+                key = _state_key([self.path], [self.config["home"]])
+                _append_journal(_journal_path(None, key), fs.journal)
+        return [
+            LinkResult(e.target, e.source, outcome, messages.get(e.target, []))
+            for e, outcome in zip(entries, outcomes)
+        ]
+
+
+_MESSAGE_LEVELS = {
+    print_info: "info",
+    print_success: "success",
+    print_warning: "warning",
+    _errcho: "error",
+}
+
+
 # what happens if --source uses a glob?
 
 
+def _extension_manifests(extensions_dir):
+    """Manifests of the extensions in extensions_dir, in lexical order.
+
+    Mirrors dot_list_extensions/dot_extension_manifest in
+    lib/dot-extensions.sh: dotfiles.json preferred, extensions without a
+    manifest are skipped, broken entries are warned about.
+    """
+    manifests = []
+    try:
+        names = sorted(os.listdir(extensions_dir))
+    except OSError:
+        return manifests
+    for name in names:
+        entry = os.path.join(extensions_dir, name)
+        if not os.path.isdir(entry):  # follows symlinks
+            print_warning("Skipping non-directory or broken extension: " + entry)
+            continue
+        for manifest in ("dotfiles.json", "dotfiles.yaml"):
+            if os.path.isfile(os.path.join(entry, manifest)):
+                manifests.append(os.path.join(entry, manifest))
+                break
+    return manifests
+
+
+def _layer_name(config_path, extensions_dir=None):
+    """Extensions are named by their directory, other manifests by path."""
+    if extensions_dir and os.path.dirname(os.path.dirname(config_path)) == (
+        extensions_dir.rstrip(os.path.sep)
+    ):
+        return os.path.basename(os.path.dirname(config_path))
+    return config_path
+
+
+def _resolve_layers(args, config, fs, errors=None, live=True):
+    """Resolve the requested links of every manifest layer into one map.
+
+    Returns (links, origins, failed). With several layers the last writer
+    wins on a shared target, so an overridden link is never created; origins
+    maps each target to the layer that won it, and failed lists layers that
+    could not be resolved (reported, never fatal to the other layers). A
+    single manifest resolves exactly as before, raising DotError (or, given
+    errors, recording each bad entry there). live is as for _iter_links.
+    """
+    layers = getattr(args, "layers", None) or []
+    if not getattr(args, "layered", False) or args.skip_config:
+        links = _requested_links(args, config)
+        resolved = _resolve_all_links(links, config, args.base_dir, fs, errors, live)
+        return resolved, {}, []
+    merged = {}
+    origins = {}
+    failed = list(getattr(args, "failed_layers", []))
+    requested = [
+        (layer.name, layer.config.get("links", {}) or {}, layer) for layer in layers
+    ]
+    if args.target or args.source:
+        requested.append(("command line", {args.target: args.source}, layers[-1]))
+    for name, links, layer in requested:
+        try:
+            resolved = _resolve_all_links(
+                links, layer.config, layer.base_dir, fs, errors, live
+            )
+        except DotError as e:
+            print_error("Layer {}: {}".format(name, e), abort=False)
+            failed.append(name)
+            continue
+        for target, source in resolved.items():
+            merged[target] = source
+            origins[target] = name
+    return collections.OrderedDict(sorted(merged.items())), origins, failed
+
+
+def _requested_links(args, config):
+    """The raw target -> source map a command works on: the manifest's
+    links plus any single -s/-t pair from the command line."""
+    links = (config.get("links", {}) or {}) if not args.skip_config else {}
+    if args.target or args.source:
+        links[args.target] = args.source
+    return links
+
+
 def cmd_link(args, config):
     """Create symlinks."""
-    use_config = not args.skip_config
-    do_confirm = not args.no_confirm
-    yes = args.yes
-    source = args.source
-    target = args.target
-    force_relink = args.force_relink
+    if getattr(args, "homes", None):
+        return _link_fleet(args, config)
+    # copies go stale with their sources' contents, which the index ignores
+    materialize = getattr(args, "materialize", False)
+    index_path = _state_index_path(args)
+    if materialize:
+        # and an index of the links the copies replace must not be trusted
+        if index_path and os.path.exists(index_path):
+            os.unlink(index_path)
+        index_path = None
+    if index_path and not getattr(args, "verify", False):
+        with _phase("state"):
+            index = _read_state_index(index_path)
+            fresh = (
+                index
+                and _state_index_fresh(index, _manifest_fingerprint(args))
+                # a link removed or replaced by hand changes its parent dir
+                and "parents" in index
+                and not _changed_parents(index)
+            )
+        if fresh:
+            if DEBUG:
+                print_info("State index {} is current.".format(index_path))
+            print_info(
+                _link_summary([LINK_UNCHANGED] * len(index["links"]))
+                + " (nothing changed; --verify to re-check targets)"
+            )
+            return
 
-    links = (config.get("links", {}) or {}) if use_config else {}
-    if target or source:
-        links[target] = source
-    links = _resolve_all_links(links, config, args.base_dir)
+    fs = _FsCache()
+    # --keep-going: report every bad entry at the end instead of stopping
+    failures = _Failures() if getattr(args, "keep_going", False) else None
+    try:
+        if materialize:
+            links, outcomes, failed = _link_materialize(args, config, fs, failures)
+        elif _can_stream(args):
+            links, outcomes, failed = _link_streaming(args, config, fs)
+        else:
+            links, outcomes, failed = _link_batch(args, config, fs, failures)
+    finally:
+        # even when a conflict aborts the run midway
+        _append_journal(_journal_path(args), fs.journal)
+    print_info(_link_summary(outcomes))
+    if failures:
+        failures.report()
+    if failed:
+        print_error("failed layer(s): {}".format(" ".join(failed)))
+    # only a fully converged run may short-circuit the next one
+    if index_path and all(o in LINK_CONVERGED for o in outcomes):
+        with _phase("state"):
+            _write_json_atomic(
+                index_path,
+                {
+                    "dot_state": STATE_FORMAT,
+                    "version": VERSION,
+                    "manifest_hash": _manifest_fingerprint(args),
+                    "globs": fs.glob_dirs,
+                    "links": links,
+                    "parents": _parent_mtimes(target for target, _ in links),
+                },
+            )
+
+
+def _can_stream(args):
+    """Whether link can apply entries as they resolve: one manifest, no
+    prompts, serial, and no --debug dump of the whole link map first.
+    --keep-going validates the whole manifest before changing anything."""
+    if getattr(args, "layered", False) and not args.skip_config:
+        return False
+    if getattr(args, "keep_going", False):
+        return False
+    if not (args.yes or args.no_confirm) or DEBUG:
+        return False
+    return (getattr(args, "jobs", 1) or 1) == 1
+
+
+def _link_streaming(args, config, fs):
+    """Resolve, plan and apply one link at a time, in parent-first order.
+
+    Only the (target, source) pairs the state index needs and a count of
+    outcomes are kept; the first symlink is created before the remaining
+    sources are even globbed. Returns (links, outcomes, failed layers).
+    """
+    links = []
+    outcomes = collections.Counter()
+    parents = _ParentDirs(fs)
+    requested = _requested_links(args, config)
+    with _phase("apply"), fs.dirs:  # resolve, plan and apply interleave here
+        for target, source in _iter_links(requested, config, args.base_dir, fs):
+            links.append((target, source))
+            missing = parents.missing(target)
+            _create_parents(missing, args, fs)
+            parents.created(missing)
+            parents.targets.add(target)
+            outcome = _link_one(target, source, args, _emit_now, fs)
+            outcomes[outcome] += 1
+            if outcome == LINK_UNCHANGED:
+                # links an older dot made (or a lost journal) are adopted too
+                fs.journal.append(("link", target, source))
+    return links, outcomes, []
+
+
+def _link_batch(args, config, fs, failures=None):
+    """Resolve every layer, plan, then apply (prompts, --jobs, layers).
+
+    Given failures (--keep-going), every entry that cannot resolve and
+    every target that is in the way is recorded there before anything is
+    changed; the remaining links are then applied.
+    """
+    with _phase("resolve"):
+        links, origins, failed = _resolve_layers(args, config, fs, failures)
     if DEBUG:
         print_info("Symlinks to create:")
         print_info(json.dumps(links, indent=2, sort_keys=True))
 
-    for _target, _source in links.items():
-        assert os.path.exists(_source)
-        target_parent_dir = os.path.dirname(_target)
-        # os.symlink will not create intermediate dirs
-        if not os.path.isdir(target_parent_dir):
-            if do_confirm and not yes:
-                if not confirm(
-                    "\n\nCreate target parent dir(s) [ {} ] for symlink [ {} ] ?".format(
-                        target_parent_dir, _target
-                    )
-                ):
+    with _phase("plan"):
+        entries = _plan_links(links, fs, origins)
+    blocked = []
+    if failures is not None:
+        blocked = [e for e in entries if e.action == PLAN_CONFLICT]
+        for entry in blocked:
+            failures.add(
+                failures.key_of(entry.target),
+                "Target [ {} ] already exists and is not a symlink.".format(
+                    entry.target
+                ),
+            )
+        if failures:
+            print_warning(
+                "{} manifest entr{} cannot be linked (listed at the end); "
+                "linking the rest.".format(
+                    len(failures), "y" if len(failures) == 1 else "ies"
+                )
+            )
+    # layers are isolated: a conflict fails its own layer, not the run
+    keep_going = bool(origins) or failures is not None
+    emit_for = failures.emit_for if failures is not None else None
+    # the entries carry all of it from here on
+    links = origins = None
+    with _phase("apply"):
+        healthy = entries
+        if blocked:
+            healthy = [e for e in entries if e.action != PLAN_CONFLICT]
+        outcomes = _link_entries(healthy, args, fs, keep_going, emit_for)
+    if blocked:
+        outcomes = iter(outcomes)
+        outcomes = [
+            LINK_FAILED if e.action == PLAN_CONFLICT else next(outcomes)
+            for e in entries
+        ]
+    for entry, outcome in zip(entries, outcomes):
+        if outcome == LINK_FAILED and entry.layer not in failed:
+            failed.append(entry.layer)
+    return [(e.target, e.source) for e in entries], outcomes, failed
+
+
+def _link_materialize(args, config, fs, failures=None):
+    """Place copies of the sources at the targets (link --materialize).
+
+    A directory source is copied file by file. Each copy is recorded with
+    its source's size and mtime (which the copy keeps), and with
+    --checksum its SHA-256, so the next run copies only what changed and
+    never overwrites a copy that was edited in place (without
+    --force-relink). Failures are recorded as in _link_batch. Returns
+    (links, outcomes, failed layers).
+    """
+    with _phase("resolve"):
+        links, origins, failed = _resolve_layers(args, config, fs, failures)
+        pairs = list(_copy_pairs(links))
+    record_path = _record_path(args, "copies")
+    record = _read_copies(record_path)
+    # layers are isolated: a conflict fails its own layer, not the run
+    emit = _emit_keep_going if origins else _emit_now
+    outcomes = []
+    try:
+        with _phase("apply"):
+            # links dot made for directory sources: each is only replaced
+            # once confirmed, right before the files below it are copied
+            replaced = collections.OrderedDict()
+            for target, source in links.items():
+                if fs.isdir(source) and fs.islink(target):
+                    _check_dir_link(target, source, fs)
+                    replaced[target] = source
+            parents = _ParentDirs(fs)
+            missing = set()
+            for target, _ in pairs:
+                if not _under(target, replaced):
+                    missing.update(parents.missing(target))
+            declined = set(_create_parents(sorted(missing), args, fs))
+            answers = {}  # replaced dir link -> options to copy below it, or None
+            for target, source in pairs:
+                options = args
+                link = _under(target, replaced)
+                if link:
+                    if link not in answers:
+                        answers[link] = _replace_dir_link(
+                            link, replaced[link], args, fs
+                        )
+                    options = answers[link]
+                    if options is None:
+                        outcomes.append(LINK_SKIPPED)
+                        continue
+                    _create_parents(_missing_below(target, link, fs), options, fs)
+                elif _under(target, declined):
+                    outcomes.append(LINK_SKIPPED)
                     continue
-            _mkdir_p(target_parent_dir)
-        # create symlinks
-        msg = "{} --> {}".format(_target, _source)
-        if do_confirm and not yes:
-            if not confirm("Create symlink {} ?".format(msg)):
-                continue
+                if failures is not None:
+                    emit = failures.emit_for(target)
+                outcome = _copy_one(target, source, record, options, emit, fs)
+                outcomes.append(outcome)
+                if outcome == LINK_FAILED and origins:
+                    failed.append(origins[_copy_origin(target, links)])
+    finally:
+        if record_path:
+            _write_json_atomic(
+                record_path, {"dot_copies": COPIES_FORMAT, "copies": record}
+            )
+    return list(links.items()), outcomes, sorted(set(failed))
+
+
+def _copy_pairs(links):
+    """(target, source file) for every file a materialized link places:
+    the source itself, or each file below a directory source (sorted;
+    symlinked directories inside it are not followed)."""
+    for target, source in links.items():
+        if not os.path.isdir(source):
+            yield target, source
+            continue
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            rel = os.path.relpath(dirpath, source)
+            base = target if rel == os.curdir else os.path.join(target, rel)
+            for name in sorted(filenames):
+                yield os.path.join(base, name), os.path.join(dirpath, name)
+
+
+def _check_dir_link(target, source, fs):
+    """Raise ConflictError unless target is the link dot made for the
+    directory source (which --materialize replaces with a copy)."""
+    if not fs.points_to(target, source):
+        raise ConflictError(
+            "Target [ {} ] is a symlink to {}, not a directory.".format(
+                target, fs.realpath(target)
+            )
+        )
+
+
+def _replace_dir_link(target, source, args, fs):
+    """Swap the link dot made for a directory source for a real directory,
+    so its copy does not write through it into the source. Asks first
+    (unless --yes/--no-confirm); a yes covers every file below it.
+    Returns the options to copy those files with, or None if declined."""
+    if not args.no_confirm and not args.yes:
+        if not confirm("Replace symlink {} with a copy of {} ?".format(target, source)):
+            return None
+        args = argparse.Namespace(**dict(vars(args), yes=True))
+    print_info("Replacing symlink {} with a copy of {}".format(target, source))
+    fs.dirs.unlink(target)
+    fs.invalidate(target)
+    fs.journal.append(("unlink", target))
+    _create_parents([target], args, fs)
+    return args
+
+
+def _missing_below(target, top, fs):
+    """The missing dirs between top and target, outermost first."""
+    missing = []
+    path = os.path.dirname(target)
+    while path != top and not fs.lexists(path):
+        missing.append(path)
+        path = os.path.dirname(path)
+    return missing[::-1]
+
+
+def _copy_origin(target, links):
+    """The link (a key of links) that placed target."""
+    while target not in links:
+        target = os.path.dirname(target)
+    return target
+
+
+def _copy_one(target, source, record, args, emit, fs):
+    """Copy source to target unless the copy there is current; returns
+    the outcome (one of LINK_*) and keeps record up to date. Output goes
+    through emit(printer, msg), as for _link_one."""
+    info = os.stat(source)
+    current = fs.lstat(target)
+    copied = record.get(target)
+    ours = (
+        copied is not None
+        and current is not None
+        and stat.S_ISREG(current.st_mode)
+        and (current.st_size, _mtime(current)) == (copied["size"], copied["mtime"])
+    )
+    if current is None:
+        outcome = LINK_CREATED
+    elif ours:
+        if copied["source"] == source and (info.st_size, _mtime(info)) == (
+            copied["size"],
+            copied["mtime"],
+        ):
+            return LINK_UNCHANGED
+        if (
+            args.checksum
+            and copied["source"] == source
+            and copied.get("sha256")
+            and info.st_size == copied["size"]
+            and _file_sha256(source) == copied["sha256"]
+        ):
+            # touched, not changed: restamp the copy instead of rewriting it
+            _set_mtime(target, info)
+            fs.invalidate(target)
+            record[target] = dict(copied, mtime=_mtime(info))
+            return LINK_UNCHANGED
+        outcome = LINK_UPDATED
+    elif stat.S_ISLNK(current.st_mode) and fs.points_to(target, source):
+        outcome = LINK_UPDATED  # a link dot made becomes a copy
+    elif copied is not None and stat.S_ISREG(current.st_mode) and args.force_relink:
+        emit(
+            print_warning, "Overwriting {}, changed since dot copied it".format(target)
+        )
+        outcome = LINK_UPDATED
+    elif copied is not None and stat.S_ISREG(current.st_mode):
+        emit(
+            print_warning,
+            "{} changed since dot copied it. Skipping "
+            "(use --force-relink to overwrite).".format(target),
+        )
+        return LINK_SKIPPED
+    else:
+        emit(
+            _errcho,
+            "Target [ {} ] already exists and is not a copy dot made.".format(target),
+        )
+        return LINK_FAILED
+    if not args.no_confirm and not args.yes:
+        if not confirm("Copy {} --> {} ?".format(source, target)):
+            return LINK_SKIPPED
+    method = _copy_file(source, target, info)
+    if current is not None and stat.S_ISLNK(current.st_mode):
+        fs.journal.append(("unlink", target))
+    fs.invalidate(target)
+    record[target] = {"source": source, "size": info.st_size, "mtime": _mtime(info)}
+    if args.checksum:
+        record[target]["sha256"] = _file_sha256(target)
+    emit(print_success, "Copied ({}): {} --> {}".format(method, source, target))
+    return outcome
+
+
+def _record_path(args, kind):
+    """Where a command keeps its <kind>-<key>.json record (copies made by
+    link --materialize, files moved by adopt), or None (as for the
+    journal: only runs with a manifest on disk keep one)."""
+    journal_path = _journal_path(args)
+    if not journal_path:
+        return None
+    key = os.path.basename(journal_path)[len("journal-") : -len(".jsonl")]
+    return os.path.join(_state_dir(), "{}-{}.json".format(kind, key))
+
+
+def _read_copies(path):
+    """{target: {"source", "size", "mtime"[, "sha256"]}} from a copies
+    record ({} when there is none or it is unreadable)."""
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (IOError, TypeError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("dot_copies") != COPIES_FORMAT:
+        return {}
+    return data.get("copies") or {}
+
+
+def _file_sha256(path):
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _set_mtime(path, info):
+    """Give path the atime and mtime of a stat result, at full resolution."""
+    if hasattr(info, "st_mtime_ns"):
+        os.utime(path, ns=(info.st_atime_ns, info.st_mtime_ns))
+    else:
+        os.utime(path, (info.st_atime, info.st_mtime))
+
+
+# errnos meaning "this copy mechanism does not work for these two files"
+_COPY_UNSUPPORTED = set(
+    getattr(errno, name)
+    for name in (
+        "EXDEV",
+        "EINVAL",
+        "ENOSYS",
+        "EOPNOTSUPP",
+        "ENOTSUP",
+        "ENOTTY",
+        "EBADF",
+    )
+    if hasattr(errno, name)
+)
+_COPY_SKIP = {}  # type: dict  # (source dev, target dev) -> methods that failed
+
+
+def _copy_file(source, target, info):
+    """Copy source over target atomically (temp file + rename), keeping
+    its mode and mtime. Returns the copy method that worked."""
+    tmp = os.path.join(
+        os.path.dirname(target), ".{}.dot-copy-tmp".format(os.path.basename(target))
+    )
+    try:
+        with open(source, "rb") as src, open(tmp, "wb") as dst:
+            devices = (info.st_dev, os.fstat(dst.fileno()).st_dev)
+            method = _copy_data(src, dst, _COPY_SKIP.setdefault(devices, set()))
+        os.chmod(tmp, stat.S_IMODE(info.st_mode))
+        _set_mtime(tmp, info)
+        os.rename(tmp, target)
+    finally:
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+    return method
+
+
+def _copy_data(src, dst, skip):
+    """Copy src's bytes into dst with the first method that works for
+    them: a reflink (shared extents, Linux FICLONE), copy_file_range
+    (in-kernel, server-side on NFS), sendfile, then a buffered copy.
+    Methods that fail as unsupported are added to skip, so later files
+    between the same filesystems go straight to the next one."""
+    for method in ("reflink", "copy_file_range", "sendfile"):
+        if method in skip:
+            continue
         try:
-            os.symlink(_source, _target)
-        except OSError as err:
-            # target already exists (probably a symlink)
-            if err.errno != errno.EEXIST:
+            if _COPY_METHODS[method](src.fileno(), dst.fileno()):
+                return method
+        except EnvironmentError as e:  # fcntl.ioctl raises IOError on 2.7
+            if e.errno not in _COPY_UNSUPPORTED:
                 raise
-            target_types = _filetype(_target)
-            if "link" not in target_types:
-                # Raise the OSError if target is not a symlink
-                # In this case, I'm not sure what the user expects
-                # Maybe --force could overwrite?
-                _errcho(
-                    "Target [ {} ] already exists and is not a symlink.".format(_target)
+        skip.add(method)
+        # start over from a clean slate after a partial attempt
+        src.seek(0)
+        dst.seek(0)
+        dst.truncate()
+    import shutil
+
+    shutil.copyfileobj(src, dst, 1 << 20)
+    return "buffered"
+
+
+def _reflink(src_fd, dst_fd):
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+
+    ficlone = 0x40049409  # _IOW(0x94, 9, int)
+    fcntl.ioctl(dst_fd, ficlone, src_fd)
+    return True
+
+
+def _copy_file_range(src_fd, dst_fd):
+    if not hasattr(os, "copy_file_range"):
+        return False
+    while os.copy_file_range(src_fd, dst_fd, 1 << 30):
+        pass
+    return True
+
+
+def _sendfile(src_fd, dst_fd):
+    if not hasattr(os, "sendfile") or not sys.platform.startswith("linux"):
+        return False  # elsewhere sendfile only writes to sockets
+    offset = 0
+    while True:
+        sent = os.sendfile(dst_fd, src_fd, offset, 1 << 30)
+        if not sent:
+            return True
+        offset += sent
+
+
+_COPY_METHODS = {
+    "reflink": _reflink,
+    "copy_file_range": _copy_file_range,
+    "sendfile": _sendfile,
+}
+
+
+def _unlink_copies(args, ask):
+    """Remove the copies link --materialize recorded, if still as copied."""
+    path = _record_path(args, "copies")
+    record = _read_copies(path) if path else {}
+    kept = {}
+    for target in sorted(record, reverse=True):
+        copied = record[target]
+        try:
+            info = os.lstat(target)
+        except OSError:
+            continue  # already gone
+        if not stat.S_ISREG(info.st_mode) or (info.st_size, _mtime(info)) != (
+            copied["size"],
+            copied["mtime"],
+        ):
+            print_warning("[ {} ] changed since dot copied it, skipping".format(target))
+            continue
+        if ask and not confirm("Remove copy {} ?".format(target)):
+            kept[target] = copied
+            continue
+        print_success("Removing copy: {}".format(target))
+        os.unlink(target)
+    if kept:
+        _write_json_atomic(path, {"dot_copies": COPIES_FORMAT, "copies": kept})
+    elif path and os.path.exists(path):
+        os.unlink(path)
+
+
+def cmd_adopt(args, config):
+    """Move real files that block links into the repo, then link them.
+
+    A target that is a regular file or directory (where link stops with
+    "already exists and is not a symlink") is moved to its manifest source
+    and linked right away; a source that already exists is only taken
+    over when it is a file with the same contents (the target is then
+    just replaced). Everything else in the manifest is linked as by
+    `link --yes`. Each move is recorded, so `adopt --undo` puts the files
+    back, and --dry-run only reports what would happen.
+    """
+    if args.undo:
+        return _undo_adopt(args)
+    if getattr(args, "layered", False) and not args.skip_config:
+        print_error("adopt moves files into one repo: pass a single --config")
+    fs = _FsCache()
+    with _phase("resolve"):
+        links = collections.OrderedDict(
+            _iter_links(
+                _requested_links(args, config),
+                config,
+                args.base_dir,
+                fs,
+                missing_ok=True,
+            )
+        )
+    with _phase("plan"):
+        moves = _adoptions(links, fs)
+        arriving = set(source for source, _ in moves.values())
+        rest = collections.OrderedDict()
+        for target, source in links.items():
+            info = fs.lstat(target)
+            if target in moves or (info and not stat.S_ISLNK(info.st_mode)):
+                continue  # adopted, or skipped above
+            if fs.lexists(source) or source in arriving or _under(source, arriving):
+                rest[target] = source
+            else:
+                print_warning(
+                    "Source {} does not exist and there is nothing at [ {} ] "
+                    "to adopt. Skipping.".format(source, target)
                 )
-            if _source == _normalize_path(_target, globbing=False, resolve=True):
-                if DEBUG:
-                    print_info(
-                        "Skipping [ {} ]. Symlink exists and points "
-                        "to matching source [ {} ]. Skipping.".format(_target, _source)
+    if args.dry_run:
+        for target, (source, how) in moves.items():
+            if how == ADOPT_SAME:
+                print_info(
+                    "Would replace {} with a link to {} (same contents)".format(
+                        target, source
                     )
-                continue
+                )
             else:
-                old_source = _normalize_path(_target, globbing=False, resolve=True)
-                if force_relink:
-                    print_warning(
-                        "Repointing {}: was -> {}, now -> {}".format(
-                            _target, old_source, _source
-                        )
-                    )
-                    # Repoint atomically: build the new link under a temp
-                    # name and rename over the target, so an interrupt never
-                    # leaves the target missing.
-                    _tmp_link = "{}.dot-relink-tmp".format(_target)
-                    if os.path.lexists(_tmp_link):
-                        os.unlink(_tmp_link)
-                    os.symlink(_source, _tmp_link)
-                    os.rename(_tmp_link, _target)
-                    print_success(
-                        "Repointed symlink: {} --> {}".format(_target, _source)
+                print_info(
+                    "Would move {} --> {} ({}) and link it".format(
+                        target, source, _move_method(target, source)
                     )
+                )
+        print_info(
+            "Dry run: {} to adopt, {} other link(s); nothing changed.".format(
+                len(moves), len(rest)
+            )
+        )
+        return
+    if moves and not args.no_confirm and not args.yes:
+        if not confirm(
+            "Move {} existing target(s) into the repo and link them?\n  {}\n".format(
+                len(moves), "\n  ".join(moves)
+            )
+        ):
+            return
+    options = argparse.Namespace(yes=True, no_confirm=True, force_relink=False)
+    record_path = _record_path(args, "adopted")
+    record = _read_adopted(record_path)
+    outcomes = []
+    try:
+        with _phase("apply"), fs.dirs:
+            for target, (source, how) in moves.items():
+                _mkdir_p(os.path.dirname(source))
+                if how == ADOPT_SAME:
+                    os.unlink(target)
                 else:
-                    print_warning(
-                        "Symlink {} exists but points to {}, not {}. "
-                        "Skipping (use --force-relink to repoint).".format(
-                            _target, old_source, _source
-                        )
-                    )
-                continue
+                    how = _move(target, source)
+                fs.dirs.forget(target)
+                fs.invalidate(target)
+                fs.invalidate(source)
+                record.append({"target": target, "source": source, "how": how})
+                print_success("Adopted {} --> {} ({})".format(target, source, how))
+                outcomes.append(_link_one(target, source, options, _emit_now, fs))
+            outcomes.extend(
+                _link_entries(_plan_links(rest, fs), options, fs, keep_going=True)
+            )
+    finally:
+        _append_journal(_journal_path(args), fs.journal)
+        if record_path and record:
+            _write_json_atomic(
+                record_path, {"dot_adopted": ADOPTED_FORMAT, "adopted": record}
+            )
+    print_info("Adopted {}. {}".format(len(moves), _link_summary(outcomes)))
+
+
+ADOPT_MOVE = "move"  # the source does not exist yet: the target becomes it
+ADOPT_SAME = "same"  # the source is a file with the target's contents
+
+
+def _adoptions(links, fs):
+    """{target: (source, ADOPT_*)} for the targets adopt takes over, in
+    link order. Targets it cannot take over are reported and left out."""
+    moves = collections.OrderedDict()
+    for target, source in links.items():
+        info = fs.lstat(target)
+        if info is None or stat.S_ISLNK(info.st_mode):
+            continue  # nothing in the way
+        if not (stat.S_ISREG(info.st_mode) or stat.S_ISDIR(info.st_mode)):
+            print_warning("[ {} ] is not a file or directory. Skipping.".format(target))
+        elif _under(target, moves):
+            print_warning(
+                "[ {} ] moves with its parent directory. Skipping.".format(target)
+            )
+        elif not fs.lexists(source):
+            moves[target] = (source, ADOPT_MOVE)
+        elif stat.S_ISREG(info.st_mode) and _same_contents(target, source, fs):
+            moves[target] = (source, ADOPT_SAME)
         else:
-            print_success("Created symlink: {} --> {}".format(_target, _source))
+            print_warning(
+                "[ {} ] and its source {} both exist and differ. " "Skipping.".format(
+                    target, source
+                )
+            )
+    return moves
+
+
+def _same_contents(path, other, fs):
+    """True if other is a regular file with path's contents."""
+    info, other_info = fs.stat(path), fs.stat(other)
+    if other_info is None or not stat.S_ISREG(other_info.st_mode):
+        return False
+    if info.st_size != other_info.st_size:
+        return False
+    import filecmp
+
+    return filecmp.cmp(path, other, shallow=False)
+
+
+def _move_method(path, dest):
+    """How _move would move path to dest: "rename" if dest's directory is
+    on the same filesystem, else "copy"."""
+    parent = os.path.dirname(dest)
+    while not os.path.exists(parent):
+        parent = os.path.dirname(parent)
+    same = os.lstat(path).st_dev == os.stat(parent).st_dev
+    return "rename" if same else "copy"
+
+
+def _move(path, dest):
+    """Move a file or directory; returns how it went.
+
+    Within one filesystem that is a single rename. Across filesystems
+    each file is copied by _copy_file (a reflink or an in-kernel copy
+    where the pair allows it, keeping mode and mtime) and the original
+    removed once everything is across; symlinks inside are recreated.
+    """
+    try:
+        os.rename(path, dest)
+        return "rename"
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        method = _copy_file(path, dest, info)
+        os.unlink(path)
+        return method
+    methods = set()
+    for dirpath, dirnames, filenames in os.walk(path):
+        rel = os.path.relpath(dirpath, path)
+        base = dest if rel == os.curdir else os.path.join(dest, rel)
+        os.mkdir(base, stat.S_IMODE(os.stat(dirpath).st_mode))
+        for name in dirnames + filenames:
+            entry = os.path.join(dirpath, name)
+            entry_info = os.lstat(entry)
+            if stat.S_ISLNK(entry_info.st_mode):
+                os.symlink(os.readlink(entry), os.path.join(base, name))
+            elif stat.S_ISREG(entry_info.st_mode):
+                methods.add(_copy_file(entry, os.path.join(base, name), entry_info))
+    import shutil
+
+    shutil.rmtree(path)
+    return "+".join(sorted(methods)) or "copy"
+
+
+def _read_adopted(path):
+    """The moves adopt recorded, oldest first ([] when there are none)."""
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (IOError, TypeError, ValueError):
+        return []
+    if not isinstance(data, dict) or data.get("dot_adopted") != ADOPTED_FORMAT:
+        return []
+    return data.get("adopted") or []
+
+
+def _undo_adopt(args):
+    """Put adopted files back where adopt found them, newest first.
+
+    Only targets that are still the link adopt made are restored: the
+    link is removed and the source moved back (or, for a source that was
+    already in the repo, copied back).
+    """
+    path = _record_path(args, "adopted")
+    record = _read_adopted(path) if path else []
+    if not record:
+        print_info("Nothing to undo.")
+        return
+    if not args.dry_run and not args.no_confirm and not args.yes:
+        if not confirm("Move {} adopted file(s) back?".format(len(record))):
+            return
+    kept = []
+    journal = []
+    for entry in reversed(record):
+        target, source = entry["target"], entry["source"]
+        try:
+            current = os.readlink(target)
+        except OSError:
+            current = None
+        if current != source:
+            print_warning(
+                "[ {} ] is no longer the link adopt made. Skipping.".format(target)
+            )
+            kept.append(entry)
+            continue
+        if args.dry_run:
+            print_info("Would move {} back to {}".format(source, target))
+            continue
+        os.unlink(target)
+        journal.append(("unlink", target))
+        if entry["how"] == ADOPT_SAME:
+            _copy_file(source, target, os.stat(source))
+        else:
+            _move(source, target)
+        print_success("Restored {} from {}".format(target, source))
+    if args.dry_run:
+        return
+    _append_journal(_journal_path(args), journal)
+    if kept:
+        kept.reverse()
+        _write_json_atomic(path, {"dot_adopted": ADOPTED_FORMAT, "adopted": kept})
+    else:
+        os.unlink(path)
+
+
+_FLEET = None  # (links relative to the home, options) in a fleet worker
+
+
+def _link_fleet(args, config):
+    """Link one resolution into every home of args.homes.
+
+    Sources are resolved once, against the manifest's own home; each home
+    then gets those links rebased onto it, planned and applied by a
+    worker process. A home that fails is reported, never fatal to the
+    others. Fleet runs keep no journal or state index (both are per home
+    of the user running dot).
+    """
+    if not (args.yes or args.no_confirm):
+        print_error("Linking several homes needs --yes or --no-confirm.")
+    fs = _FsCache()
+    with _phase("resolve"):
+        links, _, failed = _resolve_layers(args, config, fs)
+    if failed:
+        print_error("failed layer(s): {}".format(" ".join(failed)))
+    root = _normalize_path(config["home"], globbing=False, resolve=False)
+    # the default home is resolved, but ~/ targets are only made absolute:
+    # with a symlinked $HOME they are under its unresolved spelling
+    roots = [root]
+    user_home = _normalize_path("~", globbing=False, resolve=False)
+    if user_home != root and os.path.realpath(user_home) == root:
+        roots.append(user_home)
+    rebased = []  # (target relative to the home, source)
+    outside = []
+    for target, source in links.items():
+        for home in roots:
+            if target == home or target.startswith(home + os.path.sep):
+                rebased.append((target[len(home) :], source))
+                break
+        else:
+            outside.append(target)
+    if outside:
+        raise ManifestError(
+            "Links outside the home ( {} ) cannot be applied per home: {}".format(
+                root, ", ".join(outside)
+            )
+        )
+    options = {"force_relink": args.force_relink, "jobs": args.jobs}
+    failed_homes = []
+    with _phase("apply"):
+        for home, outcomes, output, error in _map_homes(
+            args.homes, (rebased, options), args.workers
+        ):
+            if error or LINK_FAILED in outcomes:
+                failed_homes.append(home)
+            if DEBUG or error or LINK_FAILED in outcomes:
+                sys.stdout.write(output)
+            print_info("{}: {}".format(home, error or _link_summary(outcomes)))
+    print_info(
+        "Fleet: {} home(s) linked, {} failed".format(
+            len(args.homes) - len(failed_homes), len(failed_homes)
+        )
+    )
+    if failed_homes:
+        print_error("failed home(s): {}".format(" ".join(failed_homes)))
+
+
+def _map_homes(homes, job, workers):
+    """(home, outcomes, output, error) for each home, in order, from a
+    process pool (or this process with one worker)."""
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+
+        # os.cpu_count is Python 3 only (2.7 may have the futures backport)
+        cpus = getattr(os, "cpu_count", lambda: None)()
+        workers = min(workers or cpus or 1, len(homes))
+    except ImportError:  # Python 2 without the futures backport
+        workers = 1
+    if workers <= 1:
+        _fleet_init(*job)
+        return map(_link_home, homes)
+    pool = ProcessPoolExecutor(workers, initializer=_fleet_init, initargs=job)
+    with pool:
+        # the links are sent once per worker, not once per home
+        return list(pool.map(_link_home, homes))
+
+
+def _fleet_init(links, options):
+    global _FLEET
+    _FLEET = (links, options)
+
+
+def _link_home(home):
+    """Fleet worker: apply the resolved links rebased onto home."""
+    import io
+
+    links, options = _FLEET
+    args = argparse.Namespace(yes=True, no_confirm=True, **options)
+    # print() writes str, which is bytes on Python 2
+    output = io.StringIO() if sys.version_info[0] >= 3 else io.BytesIO()
+    outcomes = []
+    error = None
+    # contextlib.redirect_stdout is Python 3 only
+    saved = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = output
+    try:
+        rebased = collections.OrderedDict(
+            (home + relative, source) for relative, source in links
+        )
+        fs = _FsCache()
+        entries = _plan_links(rebased, fs)
+        outcomes = _apply_plan(entries, args, fs, strict=False, keep_going=True)
+    except (DotError, EnvironmentError) as e:
+        error = "failed: {}".format(e)
+    except SystemExit:
+        error = "failed"
+    finally:
+        sys.stdout, sys.stderr = saved
+    return home, outcomes, output.getvalue(), error
+
+
+def cmd_plan(args, config):
+    """Classify every resolved link without touching the filesystem."""
+    fs = _FsCache()
+    with _phase("resolve"):
+        links, origins, failed = _resolve_layers(args, config, fs)
+    with _phase("plan"):
+        plan = {
+            "dot_plan": PLAN_FORMAT,
+            "version": VERSION,
+            "entries": [e.as_json() for e in _plan_links(links, fs, origins)],
+            # lets `apply` journal what it creates for these manifests
+            "state_key": _journal_path(args)
+            and _state_key(args.config_paths, _layer_homes(args)),
+        }
+    shadowed = _shadowing_links(links)
+    for entry in plan["entries"]:
+        if entry["target"] in shadowed:
+            entry["inside"] = shadowed[entry["target"]]
+    if args.output in (None, "-"):
+        json.dump(plan, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(plan, f, indent=2, sort_keys=True)
+        counts = collections.Counter(entry["action"] for entry in plan["entries"])
+        print_info(
+            "Plan written to {}: {}".format(
+                args.output,
+                ", ".join("{} {}".format(counts[a], a) for a in PLAN_ACTIONS),
+            )
+        )
+    if failed:
+        print_error("failed layer(s): {}".format(" ".join(failed)))
+
+
+def cmd_apply(args, config):
+    """Execute a saved plan, verifying each target is as the plan saw it."""
+    with _phase("plan"):
+        plan = _load_plan(args.plan)
+        entries = [_PlanEntry.from_json(entry) for entry in plan["entries"]]
+    fs = _FsCache()
+    journal_path = plan.get("state_key") and _journal_path(args, plan["state_key"])
+    with _phase("apply"):
+        try:
+            outcomes = _apply_plan(entries, args, fs, strict=True)
+        finally:
+            _append_journal(journal_path, fs.journal)
+    print_info(_link_summary(outcomes))
+    stale = outcomes.count(LINK_STALE)
+    if stale:
+        print_error(
+            "{} target(s) changed since the plan was made; re-run `dot plan`.".format(
+                stale
+            )
+        )
+
+
+def cmd_status(args, config):
+    """Report whether every resolved link is in place, without changing
+    anything; the exit code says whether `dot link` has work to do."""
+    links = checked = None
+    if args.quick:
+        links, checked = _quick_status_links(args)
+    if links is None:
+        with _phase("resolve"):
+            links, _, failed = _resolve_layers(args, config, _FsCache())
+        if failed:
+            print_error("failed layer(s): {}".format(" ".join(failed)))
+        checked = links
+    with _phase("plan"):
+        found = _check_links(checked, args.jobs)
+    statuses = [found.get(target, STATUS_CORRECT) for target in links]
+    counts = collections.Counter(statuses)
+    if args.json:
+        json.dump(
+            {
+                "dot_status": STATUS_FORMAT,
+                "quick": checked is not links,
+                "counts": dict((s, counts[s]) for s in STATUS_ALL),
+                "entries": [
+                    {"target": target, "source": source, "status": status}
+                    for (target, source), status in zip(links.items(), statuses)
+                ],
+            },
+            sys.stdout,
+            indent=2,
+            sort_keys=True,
+        )
+        print()
+    else:
+        for (target, source), status in zip(links.items(), statuses):
+            if status != STATUS_CORRECT:
+                print_info("{:<15} {} -> {}".format(status, target, source))
+        print_info(
+            "Status: "
+            + ", ".join("{} {}".format(counts[s], s) for s in STATUS_ALL)
+            + (" (quick)" if checked is not links else "")
+        )
+    if counts[STATUS_BLOCKED]:
+        sys.exit(STATUS_EXIT_BLOCKED)
+    if len(links) != counts[STATUS_CORRECT]:
+        sys.exit(STATUS_EXIT_DRIFT)
+
+
+def _quick_status_links(args):
+    """(links, links to check) from a fresh state index, or (None, None).
+
+    The index already says every link was correct when it was written;
+    only links whose parent dir has a new mtime need looking at.
+    """
+    index_path = _state_index_path(args)
+    if not index_path:
+        return None, None
+    with _phase("state"):
+        index = _read_state_index(index_path)
+        if not index or "parents" not in index:
+            return None, None
+        if not _state_index_fresh(index, _manifest_fingerprint(args)):
+            return None, None
+        changed = _changed_parents(index)
+    links = collections.OrderedDict((t, s) for t, s in index["links"])
+    checked = collections.OrderedDict(
+        (t, s) for t, s in links.items() if os.path.dirname(t) in changed
+    )
+    return links, checked
+
+
+def _changed_parents(index):
+    """The recorded parent dirs whose mtime differs now (one stat each)."""
+    return set(
+        parent
+        for parent, mtime in index["parents"].items()
+        if _mtime(_stat_or_none(parent)) != mtime
+    )
+
+
+def _stat_or_none(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _check_links(links, jobs):
+    """{target: status} for every link that is not correct.
+
+    Targets are grouped by parent dir and each dir is read with a single
+    scandir, so absent and blocked targets cost no per-path syscall; only
+    symlinks need a readlink. Dirs are scanned on up to `jobs` threads.
+    """
+    by_parent = collections.OrderedDict()
+    for target, source in links.items():
+        by_parent.setdefault(os.path.dirname(target), []).append((target, source))
+    groups = list(by_parent.items())
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError:  # Python 2 without the futures backport
+        jobs = 1
+    if jobs > 1 and len(groups) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(lambda group: _check_parent(*group), groups))
+    else:
+        results = [_check_parent(parent, items) for parent, items in groups]
+    found = {}
+    for result in results:
+        found.update(result)
+    return found
+
+
+def _check_parent(parent, items):
+    try:
+        entries = dict((entry.name, entry) for entry in _scandir(parent))
+    except OSError:
+        entries = {}  # a missing parent means every target in it is missing
+    found = {}
+    for target, source in items:
+        status = _link_status(entries.get(os.path.basename(target)), target, source)
+        if status != STATUS_CORRECT:
+            found[target] = status
+    return found
+
+
+def _link_status(entry, target, source):
+    if entry is None:
+        return STATUS_MISSING
+    if not entry.is_symlink():
+        return STATUS_BLOCKED
+    try:
+        if os.readlink(target) == source:
+            return STATUS_CORRECT
+    except OSError:
+        return STATUS_MISSING  # removed since the scan
+    if os.path.realpath(target) == source:
+        return STATUS_CORRECT
+    if not os.path.exists(target):
+        return STATUS_DANGLING
+    return STATUS_WRONG_TARGET
+
+
+def cmd_watch(args, config):
+    """Keep links in sync with the directories behind glob sources.
+
+    Polls with a stat per watched directory: the interval starts at
+    --interval, backs off by half again on every idle poll up to
+    --max-interval, and drops back as soon as something changed.
+    """
+    import time
+
+    watcher = _Watcher(args)
+    watcher.reload()
+    watched = len(watcher.watched())
+    print_info(
+        "Watching {} glob director{}; Ctrl-C to stop.".format(
+            watched, "y" if watched == 1 else "ies"
+        )
+    )
+    interval = args.interval
+    polls = 0
+    try:
+        while args.polls is None or polls < args.polls:
+            time.sleep(interval)
+            polls += 1
+            if watcher.step():
+                interval = args.interval
+            else:
+                interval = min(interval * 1.5, args.max_interval)
+    except KeyboardInterrupt:
+        print_info("Stopped watching.")
+
+
+class _Watcher(object):
+    """State of `dot watch`: each manifest entry with the links it resolved
+    to and the mtimes of the directories its glob listed.
+
+    step() re-resolves only entries whose directories changed and applies
+    the difference (new links created, vanished ones removed); an edited
+    manifest reloads everything.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.manifests = {}
+        self.entries = []
+        self.links = collections.OrderedDict()
+
+    def watched(self):
+        return set(path for entry in self.entries for path in entry["dirs"])
+
+    def reload(self):
+        args = self.args
+        try:
+            args.layers, args.failed_layers = _load_layers(
+                args.config_paths, args.home_dir, args.extensions_path
+            )
+        except SystemExit:
+            if not self.entries:
+                raise
+            # a half-saved manifest: keep the last good state, retry on save
+            self.manifests = dict(
+                (path, _mtime(_stat_or_none(path))) for path in self.manifests
+            )
+            return False
+        self.manifests = dict(
+            (layer.path, _mtime(_stat_or_none(layer.path)))
+            for layer in args.layers
+            if layer.path
+        )
+        self.entries = []
+        for layer in args.layers:
+            for target, source in (layer.config.get("links") or {}).items():
+                entry = {"layer": layer, "target": target, "source": source}
+                self.entries.append(self._resolve(entry))
+        return self._sync()
+
+    def _resolve(self, entry):
+        layer = entry["layer"]
+        fs = _FsCache()
+        try:
+            entry["links"] = _resolve_all_links(
+                {entry["target"]: entry["source"]}, layer.config, layer.base_dir, fs
+            )
+        except DotError as e:
+            # e.g. a glob with no matches yet: keep watching its directory
+            print_warning("Layer {}: {}".format(layer.name, e))
+            entry["links"] = {}
+        entry["dirs"] = dict(fs.glob_dirs)
+        return entry
+
+    def step(self):
+        """Poll once; True if any link was created or removed."""
+        for path, mtime in self.manifests.items():
+            if _mtime(_stat_or_none(path)) != mtime:
+                print_info("{} changed, reloading.".format(path))
+                return self.reload()
+        changed = False
+        for entry in self.entries:
+            for path, mtime in entry["dirs"].items():
+                if _mtime(_stat_or_none(path)) != mtime:
+                    self._resolve(entry)
+                    changed = True
+                    break
+        return changed and self._sync()
+
+    def _sync(self):
+        merged = {}
+        for entry in self.entries:  # in layer order: last writer wins
+            merged.update(entry["links"])
+        merged = collections.OrderedDict(sorted(merged.items()))
+        added = collections.OrderedDict(
+            (t, s) for t, s in merged.items() if self.links.get(t) != s
+        )
+        removed = [t for t in self.links if t not in merged]
+        fs = _FsCache()
+        with fs.dirs:
+            for target in sorted(removed, reverse=True):
+                # only a link dot made and nobody has touched since
+                if fs.readlink(target) == self.links[target]:
+                    fs.dirs.unlink(target)
+                    fs.journal.append(("unlink", target))
+                    print_success("Removed symlink: {}".format(target))
+        try:
+            if added:
+                entries = _plan_links(added, fs)
+                outcomes = _apply_plan(
+                    entries, self.args, fs, strict=False, keep_going=True
+                )
+                print_info(_link_summary(outcomes))
+        finally:
+            _append_journal(_journal_path(self.args), fs.journal)
+        self.links = merged
+        return bool(added or removed)
+
+
+def cmd_export(args, config):
+    """Write the resolved links as a tar stream, without touching home.
+
+    Members are symlinks to the sources (or, with --dereference, copies of
+    them), named by target: paths under the manifest's home are placed
+    under --home-prefix, anything else at its own path. Links are written
+    as they resolve, each file is copied through in blocks, and every
+    member gets the same owner, mode bits and mtime, so the same manifest
+    and sources always produce the same bytes.
+    """
+    import tarfile
+
+    home = _normalize_path(config["home"], globbing=False, resolve=False)
+    prefix = (
+        args.home_prefix if args.home_prefix is not None else home.lstrip(os.path.sep)
+    ).strip("/")
+    fs = _FsCache()
+    failed = []
+    if getattr(args, "layered", False):
+        # nothing is linked here, so what is at the targets is irrelevant
+        links, _, failed = _resolve_layers(args, config, fs, live=False)
+        links = links.items()
+    else:
+        requested = _requested_links(args, config)
+        links = _iter_links(requested, config, args.base_dir, fs, live=False)
+    if args.output in (None, "-"):
+        if sys.stdout.isatty():
+            print_error("Refusing to write a tar stream to a terminal (use -o).")
+        out = getattr(sys.stdout, "buffer", sys.stdout)
+    else:
+        out = open(args.output, "wb")
+    mtime = int(os.environ.get("SOURCE_DATE_EPOCH", 0))
+    dirs = set()  # member directories already written
+    try:
+        # "w|" writes each block as it fills: nothing is seeked or buffered
+        tar = tarfile.open(fileobj=out, mode="w|", format=tarfile.PAX_FORMAT)
+        with tar:
+            with _phase("apply"):
+                for target, source in links:
+                    if target == home or target.startswith(home + os.path.sep):
+                        name = os.path.join(prefix, os.path.relpath(target, home))
+                        top = prefix
+                    else:
+                        name, top = target.lstrip(os.path.sep), ""
+                    for parent in _member_parents(name, top):
+                        if parent not in dirs:
+                            dirs.add(parent)
+                            tar.addfile(
+                                _tar_member(tarfile, parent, tarfile.DIRTYPE, mtime)
+                            )
+                    if args.dereference:
+                        _add_tree(tar, tarfile, name, source, mtime, dirs)
+                    else:
+                        member = _tar_member(tarfile, name, tarfile.SYMTYPE, mtime)
+                        member.linkname = source
+                        tar.addfile(member)
+    finally:
+        if out is not getattr(sys.stdout, "buffer", sys.stdout):
+            out.close()
+        else:
+            out.flush()
+    if failed:
+        # the tar lacks those layers: an image built from it must not pass
+        print_error("failed layer(s): {}".format(" ".join(failed)))
+
+
+def _member_parents(name, top):
+    """The directories above member name, outermost first, below top."""
+    parents = []
+    parent = os.path.dirname(name)
+    while parent and parent != top:
+        parents.append(parent)
+        parent = os.path.dirname(parent)
+    return parents[::-1]
+
+
+def _tar_member(tarfile, name, kind, mtime, size=0, executable=False):
+    """A TarInfo with nothing of the build host in it but name and size."""
+    member = tarfile.TarInfo(name)
+    member.type = kind
+    member.mtime = mtime
+    member.uid = member.gid = 0
+    member.uname = member.gname = ""
+    member.size = size
+    if kind == tarfile.SYMTYPE:
+        member.mode = 0o777
+    elif kind == tarfile.DIRTYPE or executable:
+        member.mode = 0o755
+    else:
+        member.mode = 0o644
+    return member
+
+
+def _add_tree(tar, tarfile, name, source, mtime, dirs):
+    """Add source (following it if it is a symlink) as member name: a
+    file's contents, or a directory and everything below it in sorted
+    order. Symlinks below a directory stay symlinks."""
+    info = os.stat(source)
+    if not stat.S_ISDIR(info.st_mode):
+        _add_file(tar, tarfile, name, source, info, mtime)
+        return
+    tar.addfile(_tar_member(tarfile, name, tarfile.DIRTYPE, mtime))
+    dirs.add(name)
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames.sort()
+        rel = os.path.relpath(dirpath, source)
+        base = name if rel == os.curdir else os.path.join(name, rel)
+        for entry in sorted(dirnames + filenames):
+            path = os.path.join(dirpath, entry)
+            member_name = os.path.join(base, entry)
+            info = os.lstat(path)
+            if stat.S_ISLNK(info.st_mode):
+                member = _tar_member(tarfile, member_name, tarfile.SYMTYPE, mtime)
+                member.linkname = os.readlink(path)
+                tar.addfile(member)
+            elif stat.S_ISDIR(info.st_mode):
+                tar.addfile(_tar_member(tarfile, member_name, tarfile.DIRTYPE, mtime))
+                dirs.add(member_name)
+            elif stat.S_ISREG(info.st_mode):
+                _add_file(tar, tarfile, member_name, path, info, mtime)
+        # os.walk does not descend into symlinked dirs: they were added above
+
+
+def _add_file(tar, tarfile, name, path, info, mtime):
+    member = _tar_member(
+        tarfile,
+        name,
+        tarfile.REGTYPE,
+        mtime,
+        size=info.st_size,
+        executable=bool(info.st_mode & stat.S_IXUSR),
+    )
+    with open(path, "rb") as f:
+        tar.addfile(member, f)
+
+
+LINK_CREATED = "created"
+LINK_UNCHANGED = "unchanged"
+LINK_REPOINTED = "repointed"
+LINK_SKIPPED = "skipped"
+LINK_UPDATED = "updated"  # a materialized copy rewritten from its source
+LINK_STALE = "stale"
+LINK_FAILED = "failed"
+LINK_CONVERGED = (LINK_CREATED, LINK_UNCHANGED, LINK_REPOINTED, LINK_UPDATED)
+
+# Plan actions, one per resolved link. "missing-parent" is a create whose
+# target parent directory does not exist yet.
+PLAN_FORMAT = 1
+PLAN_CREATE = "create"
+PLAN_CORRECT = "already-correct"
+PLAN_REPOINT = "repoint"
+PLAN_CONFLICT = "conflict"
+PLAN_MISSING_PARENT = "missing-parent"
+PLAN_ACTIONS = (
+    PLAN_CREATE,
+    PLAN_CORRECT,
+    PLAN_REPOINT,
+    PLAN_CONFLICT,
+    PLAN_MISSING_PARENT,
+)
+
+# Link states reported by `dot status`, one per resolved link.
+STATUS_FORMAT = 1
+STATUS_CORRECT = "correct"
+STATUS_MISSING = "missing"
+STATUS_WRONG_TARGET = "wrong-target"
+STATUS_DANGLING = "dangling"
+STATUS_BLOCKED = "blocked-by-file"
+STATUS_ALL = (
+    STATUS_CORRECT,
+    STATUS_MISSING,
+    STATUS_WRONG_TARGET,
+    STATUS_DANGLING,
+    STATUS_BLOCKED,
+)
+# `dot status` exit codes (1 and 2 stay "error" and "usage")
+STATUS_EXIT_DRIFT = 3  # `dot link` would fix it
+STATUS_EXIT_BLOCKED = 4  # something that is not a symlink is in the way
+
+
+def _emit_now(printer, msg):
+    printer(msg)
+
+
+def _emit_keep_going(printer, msg):
+    """Like _emit_now, but an aborting error is reported and the run goes on."""
+    if printer is _errcho:
+        print_error(msg, abort=False)
+    else:
+        printer(msg)
+
+
+class _Failures(object):
+    """Every problem of a `link --keep-going` run, by manifest key.
+
+    Resolution records bad entries here instead of raising (see
+    _iter_links), the plan adds targets that are in the way, and the apply
+    phase adds the links it could not make; report() lists them all.
+    """
+
+    def __init__(self):
+        self.items = []  # (manifest key, message), in the order found
+        self.keys = {}  # normalized target -> manifest key
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, key, error):
+        self.items.append((key, str(error)))
+
+    def key_of(self, target):
+        """The manifest key that produced target (a glob's own key for
+        each of its matches)."""
+        path = target
+        while path not in self.keys and path != os.path.dirname(path):
+            path = os.path.dirname(path)
+        return self.keys.get(path, target)
+
+    def emit_for(self, target):
+        """An emit for target's output that records its errors and goes on."""
+
+        def emit(printer, msg):
+            if printer is _errcho:
+                self.add(self.key_of(target), msg)
+            _emit_keep_going(printer, msg)
+
+        return emit
+
+    def report(self):
+        """Print every problem and exit nonzero (if there were any)."""
+        if not self.items:
+            return
+        for key, msg in self.items:
+            print_error('"{}": {}'.format(key, msg), abort=False)
+        print_error(
+            "{} manifest entr{} failed.".format(
+                len(self.items), "y" if len(self.items) == 1 else "ies"
+            )
+        )
+
+
+# one shared (never modified) state for every target of these types
+_TARGET_STATES = dict(
+    (kind, {"type": kind}) for kind in ("absent", "dir", "file", "other")
+)
+
+
+def _target_state(target, fs):
+    """What is at target now, as recorded in a plan entry."""
+    info = fs.lstat(target)
+    if info is None:
+        return _TARGET_STATES["absent"]
+    if stat.S_ISLNK(info.st_mode):
+        return {"type": "link", "link": fs.readlink(target)}
+    if stat.S_ISDIR(info.st_mode):
+        return _TARGET_STATES["dir"]
+    if stat.S_ISREG(info.st_mode):
+        return _TARGET_STATES["file"]
+    return _TARGET_STATES["other"]
+
+
+class _PlanEntry(object):
+    """One resolved link on its way from plan to apply.
+
+    Carries the target and source, the layer (manifest) it came from, the
+    plan's action and the target state the plan saw. A big plan holds one
+    per link, so entries have __slots__ and share their strings with the
+    resolver; saved plans are the JSON dicts of as_json()/from_json().
+    """
+
+    __slots__ = ("target", "source", "action", "state", "layer")
+
+    def __init__(self, target, source, action, state, layer=None):
+        self.target = target
+        self.source = source
+        self.action = action
+        self.state = state
+        self.layer = layer
+
+    def as_json(self):
+        entry = {
+            "target": self.target,
+            "source": self.source,
+            "action": self.action,
+            "state": dict(self.state),
+        }
+        if self.layer is not None:
+            entry["layer"] = self.layer
+        return entry
+
+    @classmethod
+    def from_json(cls, entry):
+        return cls(
+            entry["target"],
+            entry["source"],
+            entry["action"],
+            entry["state"],
+            entry.get("layer"),
+        )
+
+
+def _plan_links(links, fs, origins=None):
+    """Classify each resolved link (one of PLAN_ACTIONS), in link order.
+
+    Returns a _PlanEntry per link; origins maps targets to their layer.
+    """
+    origins = origins or {}
+    entries = []
+    for target, source in links.items():
+        state = _target_state(target, fs)
+        if state["type"] == "absent":
+            if fs.isdir(os.path.dirname(target)):
+                action = PLAN_CREATE
+            else:
+                action = PLAN_MISSING_PARENT
+        elif state["type"] != "link":
+            action = PLAN_CONFLICT
+        elif fs.points_to(target, source):
+            action = PLAN_CORRECT
+        else:
+            action = PLAN_REPOINT
+        entries.append(_PlanEntry(target, source, action, state, origins.get(target)))
+    return entries
+
+
+def _load_plan(path):
+    """Read a plan written by `dot plan` ("-" for stdin)."""
+    try:
+        if path == "-":
+            plan = json.load(sys.stdin)
+        else:
+            with open(path, "r") as f:
+                plan = json.load(f)
+    except (IOError, ValueError) as e:
+        print_error("Failed to load plan {}: {}".format(path, e))
+        return {"entries": []}
+    if not isinstance(plan, dict) or plan.get("dot_plan") != PLAN_FORMAT:
+        print_error(
+            "{} is not a dot plan (expected format {})".format(path, PLAN_FORMAT)
+        )
+    return plan
+
+
+def _apply_entry(entry, args, emit, fs, strict, keep_going=False):
+    """Apply one plan entry and return its outcome (one of LINK_*).
+
+    With strict (a saved plan), already-correct entries are trusted without
+    a stat and every other target must still be in the state the plan saw.
+    Otherwise (plan made moments ago by `link`) the live state decides.
+    With keep_going a failing syscall fails the entry, not the run.
+    """
+    target, source = entry.target, entry.source
+    if strict:
+        if entry.action == PLAN_CORRECT:
+            return LINK_UNCHANGED
+        if _target_state(target, fs) != entry.state:
+            if fs.islink(target) and fs.points_to(target, source):
+                return LINK_UNCHANGED
+            emit(
+                print_warning,
+                "Target [ {} ] changed since the plan was made. Skipping.".format(
+                    target
+                ),
+            )
+            return LINK_STALE
+    try:
+        return _link_one(target, source, args, emit, fs)
+    except OSError as e:
+        msg = "Cannot link [ {} ]: {}".format(target, e.strerror or e)
+        if not keep_going:
+            raise FilesystemError(msg)
+        emit(_errcho, msg)
+        return LINK_FAILED
+
+
+def _link_one(_target, _source, args, emit, fs):
+    """Create one symlink and return its outcome (one of LINK_*).
+
+    All output goes through ``emit(printer, msg)`` so the parallel engine
+    can buffer it and replay it in manifest order. Filesystem state is read
+    through ``fs``: an already-correct link costs one lstat and one readlink.
+    """
+    do_confirm = not args.no_confirm
+    yes = args.yes
+    force_relink = args.force_relink
+
+    # _source exists: resolution only returns paths it found on disk, and
+    # _apply_plan created every missing parent dir up front
+    # create symlinks
+    msg = "{} --> {}".format(_target, _source)
+    if do_confirm and not yes:
+        if not confirm("Create symlink {} ?".format(msg)):
+            return LINK_SKIPPED
+    info = fs.lstat(_target)
+    if info is None:
+        try:
+            fs.dirs.symlink(_source, _target)
+        except OSError as err:
+            if err.errno == errno.ENOENT:
+                # its parent was declined, or is a managed link that failed
+                emit(
+                    _errcho,
+                    "Target parent dir [ {} ] does not exist.".format(
+                        os.path.dirname(_target)
+                    ),
+                )
+                return LINK_FAILED
+            # something created the target since we looked
+            if err.errno != errno.EEXIST:
+                raise
+            fs.invalidate(_target)
+            info = fs.lstat(_target)
+            if info is None:
+                raise
+        else:
+            fs.invalidate(_target)
+            fs.journal.append(("link", _target, _source))
+            emit(print_success, "Created symlink: {} --> {}".format(_target, _source))
+            return LINK_CREATED
+    # target already exists (probably a symlink)
+    if not stat.S_ISLNK(info.st_mode):
+        # Raise the OSError if target is not a symlink
+        # In this case, I'm not sure what the user expects
+        # Maybe --force could overwrite?
+        emit(
+            _errcho,
+            "Target [ {} ] already exists and is not a symlink.".format(_target),
+        )
+        return LINK_FAILED
+    if fs.points_to(_target, _source):
+        if DEBUG:
+            emit(
+                print_info,
+                "Skipping [ {} ]. Symlink exists and points "
+                "to matching source [ {} ]. Skipping.".format(_target, _source),
+            )
+        return LINK_UNCHANGED
+    old_source = fs.realpath(_target)
+    if not force_relink:
+        emit(
+            print_warning,
+            "Symlink {} exists but points to {}, not {}. "
+            "Skipping (use --force-relink to repoint).".format(
+                _target, old_source, _source
+            ),
+        )
+        return LINK_SKIPPED
+    emit(
+        print_warning,
+        "Repointing {}: was -> {}, now -> {}".format(_target, old_source, _source),
+    )
+    # Repoint atomically: build the new link under a temp
+    # name and rename over the target, so an interrupt never
+    # leaves the target missing.
+    _tmp_link = "{}.dot-relink-tmp".format(_target)
+    if fs.lexists(_tmp_link):
+        fs.dirs.unlink(_tmp_link)
+    fs.dirs.symlink(_source, _tmp_link)
+    fs.dirs.rename(_tmp_link, _target)
+    fs.invalidate(_tmp_link)
+    fs.invalidate(_target)
+    fs.journal.append(("link", _target, _source))
+    emit(print_success, "Repointed symlink: {} --> {}".format(_target, _source))
+    return LINK_REPOINTED
+
+
+def _link_waves(targets):
+    """Split parent-first ordered targets into dependency waves.
+
+    A target lands one wave after its nearest managed ancestor (e.g.
+    ``/this/1`` after ``/this``), so a link created inside a symlinked
+    directory still lands in the right place. Targets within one wave are
+    independent of each other.
+    """
+    level_of = {}
+    waves = []
+    for target in targets:
+        level = 0
+        parent = os.path.dirname(target)
+        while parent and parent != os.path.dirname(parent):
+            if parent in level_of:
+                level = level_of[parent] + 1
+                break
+            parent = os.path.dirname(parent)
+        level_of[target] = level
+        if level == len(waves):
+            waves.append([])
+        waves[level].append(target)
+    return waves
+
+
+def _apply_plan(entries, args, fs, strict, keep_going=False, emit_for=None):
+    """Apply plan entries in order, or on a thread pool with --jobs.
+
+    An entry that fails aborts the run, unless keep_going: then it is
+    reported, counted as LINK_FAILED and the remaining entries still run.
+    emit_for(target) is where target's output goes (default: printed).
+    Target directories are held open (fs.dirs) for the whole apply.
+    """
+    if emit_for is None:
+        emit = _emit_keep_going if keep_going else _emit_now
+
+        def emit_for(target):
+            return emit
+
+    jobs = getattr(args, "jobs", 1) or 1
+    if jobs > 1 and not args.no_confirm and not args.yes:
+        print_warning(
+            "--jobs needs --yes or --no-confirm (prompts are serial); "
+            "running serially."
+        )
+        jobs = 1
+    requested = entries
+    failed = {} if keep_going else None  # parent dir -> why it is missing
+    with fs.dirs:
+        missing = _missing_parents(entries, fs, strict)
+        declined = set(_create_parents(missing, args, fs, failed))
+        if failed:
+            for entry in entries:
+                parent = _under(entry.target, failed)
+                if parent:
+                    emit_for(entry.target)(_errcho, failed[parent])
+            declined.update(failed)
+        if declined:
+            entries = [e for e in entries if not _under(e.target, declined)]
+        if jobs > 1:
+            outcomes = _apply_parallel(
+                entries, args, jobs, fs, strict, emit_for, keep_going
+            )
+        else:
+            outcomes = [
+                _apply_entry(e, args, emit_for(e.target), fs, strict, keep_going)
+                for e in entries
+            ]
+    if not declined:
+        return outcomes
+    by_target = dict(zip([e.target for e in entries], outcomes))
+    return [
+        by_target.get(
+            e.target,
+            LINK_FAILED if failed and _under(e.target, failed) else LINK_SKIPPED,
+        )
+        for e in requested
+    ]
+
+
+def _link_entries(entries, args, fs, keep_going=False, emit_for=None):
+    """Apply freshly planned link entries and journal them: the loop
+    behind `dot link` and Manifest.apply. Links that were already correct
+    are journaled too (made by an older dot, or a lost journal), so
+    `unlink` still removes them. Returns the outcomes, in entry order."""
+    outcomes = _apply_plan(entries, args, fs, False, keep_going, emit_for)
+    fs.journal.extend(
+        ("link", e.target, e.source)
+        for e, outcome in zip(entries, outcomes)
+        if outcome == LINK_UNCHANGED
+    )
+    return outcomes
+
+
+class _ParentDirs(object):
+    """Which target parent dirs are missing, looking at each dir once.
+
+    The climb from a target's parent stops at the first directory whose
+    existence is already known. Parents at or under a managed target
+    (one in ``targets``) are never missing: that link provides them.
+    """
+
+    def __init__(self, fs):
+        self.fs = fs
+        self.known = {}  # dir -> exists
+        self.targets = set()
+
+    def missing(self, target):
+        """The missing parents of target, outermost first."""
+        if _under(target, self.targets):
+            return []
+        missing = []
+        path = os.path.dirname(target)
+        while path not in self.known:
+            self.known[path] = self.fs.isdir(path)
+            if self.known[path] or path == os.path.dirname(path):
+                break
+            missing.append(path)
+            path = os.path.dirname(path)
+        return missing[::-1]
+
+    def created(self, paths):
+        self.known.update((path, True) for path in paths)
+
+
+def _missing_parents(entries, fs, strict):
+    """Parent dirs the entries need that do not exist yet, outermost first."""
+    parents = _ParentDirs(fs)
+    parents.targets.update(entry.target for entry in entries)
+    missing = set()
+    for entry in entries:
+        if not (strict and entry.action == PLAN_CORRECT):
+            missing.update(parents.missing(entry.target))
+    # a prefix sorts before its extensions, so parents come first
+    return sorted(missing)
+
+
+def _create_parents(missing, args, fs, failed=None):
+    """Create the missing parent dirs top-down, one mkdir each, after one
+    batched confirmation. Returns the dirs the user declined (else []).
+
+    A dir that cannot be created raises FilesystemError, unless failed (a
+    dict) is given: then it is recorded there with the reason, and the
+    dirs below it are not attempted.
+    """
+    if not missing:
+        return []
+    if not args.no_confirm and not args.yes:
+        if not confirm(
+            "Create {} missing parent dir(s)?\n  {}\n".format(
+                len(missing), "\n  ".join(missing)
+            )
+        ):
+            return missing
+    for path in missing:
+        if failed and _under(path, failed):
+            continue
+        try:
+            fs.dirs.mkdir(path)
+        except OSError as e:
+            if e.errno == errno.EEXIST and os.path.isdir(path):
+                continue  # raced with someone else: not ours to journal
+            msg = "Cannot create parent dir [ {} ]: {}".format(path, e.strerror or e)
+            if failed is None:
+                raise FilesystemError(msg)
+            failed[path] = msg
+            continue
+        fs.invalidate(path)
+        fs.journal.append(("mkdir", path))
+    return []
+
+
+def _under(path, dirs):
+    """The nearest of dirs that path is inside (truthy), else None."""
+    path = os.path.dirname(path)
+    while path != os.path.dirname(path):
+        if path in dirs:
+            return path
+        path = os.path.dirname(path)
+    return None
+
+
+def _apply_parallel(entries, args, jobs, fs, strict, emit_for, keep_going):
+    """Apply entries on a thread pool, one dependency wave at a time.
+
+    Each entry's output is buffered and replayed in manifest order as soon
+    as every entry before it has run, so the output matches the serial
+    path. A wave goes to the pool APPLY_CHUNK entries at a time, which
+    bounds the futures and buffered output alive at once. An aborting
+    error stops before the next chunk; entries already applied in its own
+    chunk are reported first. emit_for(target) is where target's output
+    is replayed.
+    """
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError:  # Python 2 without the futures backport
+        return [
+            _apply_entry(e, args, emit_for(e.target), fs, strict, keep_going)
+            for e in entries
+        ]
+
+    by_target = {entry.target: entry for entry in entries}
+
+    def run(target):
+        buffered = []
+        outcome = _apply_entry(
+            by_target[target],
+            args,
+            lambda p, m: buffered.append((p, m)),
+            fs,
+            strict,
+            keep_going,
+        )
+        return outcome, buffered
+
+    order = [entry.target for entry in entries]
+    done = {}
+    state = {"next": 0}
+
+    def replay(upto_end):
+        while state["next"] < len(order):
+            target = order[state["next"]]
+            if target not in done:
+                if not upto_end:
+                    return
+            else:
+                emit = emit_for(target)
+                for printer, msg in done[target][1]:
+                    emit(printer, msg)
+                done[target] = (done[target][0], ())
+            state["next"] += 1
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for wave in _link_waves(order):
+            for start in range(0, len(wave), APPLY_CHUNK):
+                chunk = wave[start : start + APPLY_CHUNK]
+                failed = False
+                for target, result in zip(chunk, pool.map(run, chunk)):
+                    done[target] = result
+                    failed = failed or (
+                        not keep_going and any(p is _errcho for p, _ in result[1])
+                    )
+                # on failure, flush everything that ran; replaying the error exits
+                replay(upto_end=failed)
+    replay(upto_end=True)
+    return [done[target][0] for target in order]
+
+
+def _link_summary(outcomes):
+    counts = collections.Counter(outcomes)
+    summary = "Summary: {} created, {} unchanged, {} repointed, {} skipped".format(
+        counts[LINK_CREATED],
+        counts[LINK_UNCHANGED],
+        counts[LINK_REPOINTED],
+        counts[LINK_SKIPPED],
+    )
+    for extra in (LINK_UPDATED, LINK_STALE, LINK_FAILED):
+        if counts[extra]:
+            summary += ", {} {}".format(counts[extra], extra)
+    return summary
+
+
+def _state_dir():
+    """Per-machine dot state, shared with run_if_changed (00-dotfiles.sh)."""
+    return os.environ.get("DOTFILES_STATE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".dot", "state"
+    )
+
+
+def _state_index_path(args):
+    """State index for these manifests and $HOME, or None when the run is
+    not a plain manifest run (no config file, --skip-config, -s/-t, or a
+    layer that failed to load)."""
+    layers = getattr(args, "layers", None) or []
+    paths = [layer.path for layer in layers]
+    if not paths or None in paths or getattr(args, "failed_layers", None):
+        return None
+    if args.skip_config or args.source or args.target:
+        return None
+    key = _state_key(paths, _layer_homes(args))
+    return os.path.join(_state_dir(), "link-{}.json".format(key))
+
+
+def _layer_homes(args):
+    """The home each loaded manifest links into."""
+    return [
+        layer.config["home"]
+        for layer in getattr(args, "layers", None) or []
+        if layer.config.get("home")
+    ]
+
+
+def _state_key(paths, homes=()):
+    """Short digest naming the state files of a set of manifests + $HOME,
+    plus every home they link into other than $HOME (--home-dir, a
+    manifest's `home`), so runs into different homes never share state."""
+    default = _normalize_path("~", globbing=False)
+    others = sorted(
+        set(_normalize_path(h, globbing=False) for h in homes) - set([default])
+    )
+    key = "\0".join(
+        [os.path.realpath(p) for p in paths] + [os.path.expanduser("~")] + others
+    )
+    import hashlib
+
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _journal_path(args, key=None):
+    """Append-only record of what dot created for these manifests, or None
+    for runs without a manifest on disk (--skip-config, no config file)."""
+    if key is None:
+        paths = getattr(args, "config_paths", None) or []
+        if getattr(args, "skip_config", False):
+            return None
+        if not any(os.path.isfile(p) for p in paths):
+            return None
+        key = _state_key(paths, _layer_homes(args))
+    return os.path.join(_state_dir(), "journal-{}.jsonl".format(key))
+
+
+def _read_journal(path):
+    """Replay a journal into (links {target: source}, dirs dot created),
+    or None if there is no journal. Torn or unknown lines are skipped."""
+    links = collections.OrderedDict()
+    dirs = collections.OrderedDict()
+    try:
+        with open(path, "r") as f:
+            lines = f.readlines()
+    except IOError:
+        return None
+    for line in lines:
+        try:
+            record = json.loads(line)
+            op = record.get("op")
+            if op == "link":
+                links[record["target"]] = record["source"]
+            elif op == "unlink":
+                links.pop(record["target"], None)
+            elif op == "mkdir":
+                dirs[record["path"]] = True
+            elif op == "rmdir":
+                dirs.pop(record["path"], None)
+        except (ValueError, KeyError, AttributeError, TypeError):
+            continue
+    return links, list(dirs)
+
+
+def _journal_record(record):
+    if record[0] == "link":
+        return {"op": "link", "target": record[1], "source": record[2]}
+    if record[0] == "unlink":
+        return {"op": "unlink", "target": record[1]}
+    return {"op": record[0], "path": record[1]}
+
+
+def _append_journal(path, records):
+    """Append records not already reflected in the journal (one write)."""
+    if not path or not records:
+        return
+    live = _read_journal(path)
+    if live is not None:
+        links, dirs = live
+        dirs = set(dirs)
+        records = [
+            r
+            for r in records
+            if not (r[0] == "link" and links.get(r[1]) == r[2])
+            and not (r[0] == "mkdir" and r[1] in dirs)
+        ]
+        if not records:
+            return
+    lines = [] if live is not None else [{"dot_journal": JOURNAL_FORMAT}]
+    lines.extend(_journal_record(r) for r in records)
+    text = "".join(json.dumps(line, sort_keys=True) + "\n" for line in lines)
+    _mkdir_p(os.path.dirname(path))
+    with open(path, "a+") as f:
+        # never glue a record onto a line torn by a crashed run
+        end = f.seek(0, os.SEEK_END)
+        if end:
+            f.seek(end - 1)
+            if f.read(1) != "\n":
+                text = "\n" + text
+        f.write(text)
+
+
+def _manifest_fingerprint(args):
+    """Hash of everything that decides the resolved link set, except the
+    contents of globbed directories (tracked separately by mtime)."""
+    payload = json.dumps(
+        {
+            "version": VERSION,
+            "layers": [[layer.config, layer.base_dir] for layer in args.layers],
+            "home": os.path.expanduser("~"),
+        },
+        sort_keys=True,
+    )
+    import hashlib
+
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _read_state_index(path):
+    try:
+        with open(path, "r") as f:
+            index = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(index, dict) or index.get("dot_state") != STATE_FORMAT:
+        return None
+    return index
+
+
+def _state_index_fresh(index, fingerprint):
+    """True if neither the manifest nor any globbed directory changed."""
+    if index.get("manifest_hash") != fingerprint:
+        return False
+    for path, mtime in index.get("globs", {}).items():
+        try:
+            current = _mtime(os.stat(path))
+        except OSError:
+            current = None
+        if current != mtime:
+            return False
+    return True
+
+
+def _parent_mtimes(links):
+    """mtime of every target's parent dir: adding, removing or replacing a
+    link changes it, which is what `status --quick` relies on."""
+    mtimes = {}
+    for target in links:
+        parent = os.path.dirname(target)
+        if parent not in mtimes:
+            try:
+                mtimes[parent] = _mtime(os.stat(parent))
+            except OSError:
+                mtimes[parent] = None
+    return mtimes
+
+
+def _write_json_atomic(path, data):
+    """Write JSON via a temp file + rename, so a crashed run never leaves
+    a half-written state file behind."""
+    _mkdir_p(os.path.dirname(path))
+    tmp_path = "{}.tmp.{}".format(path, os.getpid())
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, sort_keys=True)
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
 
 
 def cmd_unlink(args, config):
@@ -266,92 +3274,486 @@ def cmd_unlink(args, config):
     yes = args.yes
     target = args.target
 
+    journal_path = None if target else _journal_path(args)
+    journal = journal_path and _read_journal(journal_path)
+    # the next `link` must not trust an index of links we are removing
+    index_path = _state_index_path(args)
+    if index_path and os.path.exists(index_path):
+        os.unlink(index_path)
+    if not target:
+        # copies first, so the directories dot made for them can be pruned
+        _unlink_copies(args, do_confirm and not yes)
+    if journal:
+        _unlink_journaled(journal_path, journal, do_confirm and not yes)
+        return
+
     links = (config.get("links", {}) or {}) if use_config else {}
     if target:
         source = _normalize_path(target, globbing=False)
         target = _normalize_path(target, resolve=False, globbing=False)
         links[target] = source
-    links = _resolve_all_links(links, config, args.base_dir)
-    links = sorted([_l for _l in links.keys() if os.path.exists(_l)], reverse=True)
+    fs = _FsCache()
+    with _phase("resolve"):
+        if getattr(args, "layered", False):
+            links, _, failed = _resolve_layers(args, config, fs)
+            if failed:
+                print_error("failed layer(s): {}".format(" ".join(failed)))
+        else:
+            links = _resolve_all_links(links, config, args.base_dir, fs)
+    with _phase("plan"):
+        links = sorted([_l for _l in links.keys() if fs.exists(_l)], reverse=True)
     if DEBUG:
         print_info("Links found to remove:")
         print_info(json.dumps(links, indent=2, sort_keys=True))
+    with _phase("apply"), fs.dirs:
+        _unlink_all(links, do_confirm, yes, fs)
+
+
+def _unlink_journaled(journal_path, journal, ask):
+    """Remove the links the journal says dot made, without resolving the
+    manifest: one scandir per directory, a readlink per journaled link.
+
+    Only links still pointing where dot left them are removed; directories
+    dot created are pruned once empty. The journal is then compacted to
+    what is left (or deleted when nothing is). Each directory is opened
+    once and read, checked and pruned through that fd (see _DirFds).
+    """
+    links, dirs = journal
+    by_parent = collections.OrderedDict()
+    for target in sorted(links, reverse=True):
+        by_parent.setdefault(os.path.dirname(target), []).append(target)
+    with _DirFds() as fds:
+        with _phase("plan"):
+            removable = []
+            for parent, targets in by_parent.items():
+                try:
+                    entries = dict((e.name, e) for e in fds.scandir(parent))
+                except OSError:
+                    entries = {}
+                for target in targets:
+                    entry = entries.get(os.path.basename(target))
+                    if entry is None:
+                        links.pop(target)  # already gone
+                    elif (
+                        not entry.is_symlink() or fds.readlink(target) != links[target]
+                    ):
+                        print_warning(
+                            "[ {} ] is no longer the symlink dot made, skipping".format(
+                                target
+                            )
+                        )
+                        links.pop(target)  # not ours any more
+                    else:
+                        removable.append(target)
+            # a link inside a managed dir link goes before that link
+            removable.sort(reverse=True)
+        with _phase("apply"):
+            for target in removable:
+                if ask and not confirm(
+                    "Remove {} (points to {} )?".format(target, links[target])
+                ):
+                    continue
+                print_success("Removing symlink: {}".format(target))
+                fds.unlink(target)
+                links.pop(target)
+            for path in sorted(dirs, key=lambda d: d.count(os.path.sep), reverse=True):
+                try:
+                    fds.rmdir(path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        continue  # not empty (or not ours to judge): keep it
+                else:
+                    print_info("Removed empty directory: {}".format(path))
+                dirs.remove(path)
+    if links or dirs:
+        with open(journal_path + ".tmp", "w") as f:
+            f.write(json.dumps({"dot_journal": JOURNAL_FORMAT}) + "\n")
+            for record in [("link", t, s) for t, s in links.items()] + [
+                ("mkdir", d) for d in dirs
+            ]:
+                f.write(json.dumps(_journal_record(record), sort_keys=True) + "\n")
+        os.rename(journal_path + ".tmp", journal_path)
+    else:
+        os.unlink(journal_path)
+
+
+def _unlink_all(links, do_confirm, yes, fs):
     for _target in links:
         # remove symlinks
-        if not os.path.islink(_target):
+        if not fs.islink(_target):
             print_warning("[ {} ] is not a symlink, skipping".format(_target))
             continue
-        msg = "{} (points to {} )".format(_target, _normalize_path(_target))
         if do_confirm and not yes:
+            msg = "{} (points to {} )".format(_target, fs.realpath(_target))
             if not confirm("Remove {} ?".format(msg)):
                 continue
         print_success("Removing symlink: {}".format(_target))
-        os.unlink(_target)
+        fs.dirs.unlink(_target)
+        fs.invalidate(_target)
 
 
-def _resolve_all_links(links, config, base_dir):
-    links_expanded = {}
-    for target, source in links.items():
+def _resolve_all_links(links, config, base_dir, fs=None, errors=None, live=True):
+    """Resolve a manifest's links into {target: source}, parent-first."""
+    return collections.OrderedDict(
+        _iter_links(links, config, base_dir, fs, live=live, errors=errors)
+    )
+
+
+def _iter_links(
+    links, config, base_dir, fs=None, live=True, missing_ok=False, errors=None
+):
+    """Yield a manifest's resolved (target, source) pairs, parent-first.
+
+    Manifest targets are arranged in a tree of path components (cheap: no
+    filesystem access) that is walked depth-first, sorting each directory's
+    children as it is reached. An entry's source is only resolved when the
+    walk gets to it, so the first link can be applied long before the last
+    glob is expanded, and no more than one entry's matches are held at once.
+    Parent-first means a link like /this comes before /this/1, so the '1'
+    file ends up in the symlinked dir. With live=False targets are never
+    looked at (for links that are not going to this filesystem), and with
+    missing_ok plain sources need not exist yet (adopt creates them). Given
+    errors (a _Failures), a bad entry is recorded there and left out
+    instead of raising DotError, so every bad entry is found in one pass.
+    """
+    fs = fs or _FsCache()
+    root = _target_tree(links, config, errors)
+    return _walk_target_tree(
+        root,
+        os.path.sep,
+        base_dir,
+        fs,
+        live=live,
+        missing_ok=missing_ok,
+        errors=errors,
+    )
+
+
+def _target_tree(links, config, errors=None):
+    """{"entries": [(source, into_dir, key)], "children": {name: node}} for
+    the normalized targets of a manifest's links (key: the manifest's own
+    spelling of the target)."""
+    root = {"entries": [], "children": {}}
+    for key, source in links.items():
+        target = key
         if target and not source:
-            _errcho("You specified a target {} but no source".format(target))
-        if source:
-            source = _resolve_source(source, base_dir)
-        if target:
-            target = _normalize_path(target, globbing=False, resolve=False).rstrip(
-                os.path.sep
+            error = ManifestError(
+                "You specified a target {} but no source".format(target)
             )
-        else:
-            target = _normalize_path(
-                config["home"], globbing=False, resolve=False
-            ).rstrip(os.path.sep)
+            if errors is None:
+                raise error
+            errors.add(key, error)
+            continue
+        if not source:
+            continue
+        into_dir = not target
+        if not target:
             # special case:
             # we want to write _into_ the home dir, not overwrite it
-            source = source if isinstance(source, list) else [source]
-        # now we have a single target which might be a dir
-        # and one or more sources, which might be a combination of
-        # both files and directories
-        # all are normalized and absolute
-        if isinstance(source, list):
-            # write sources into target dir
-            # isdir() will resolve a symlink dir; a target that doesn't
-            # exist yet is fine here (cmd_link creates it), only a target
-            # that exists as a non-directory (e.g. a plain file or dangling symlink) is an error
-            if os.path.lexists(target) and not os.path.isdir(target):
-                # consider moving this check to the link() or unlink() funcs
-                _errcho(
-                    "target ( {} ) already exists and is not a directory. "
-                    "Cannot write multiple symlinks from the following "
-                    "sources into this target: {}".format(target, source)
-                )
-            for _s in source:
-                _, tail = os.path.split(_s)
-                # is this right?
-                links_expanded[os.path.join(target, tail)] = _s
+            target = config["home"]
+        target = _normalize_path(target, globbing=False, resolve=False).rstrip(
+            os.path.sep
+        )
+        node = root
+        for name in target.split(os.path.sep)[1:]:
+            node = node["children"].setdefault(name, {"entries": [], "children": {}})
+        node["entries"].append((source, into_dir, key))
+        if errors is not None:
+            errors.keys[target] = key
+    return root
+
+
+def _walk_target_tree(
+    node, target, base_dir, fs, claim=None, live=True, missing_ok=False, errors=None
+):
+    """Resolve one node's entries and yield its links, then its children's.
+
+    A target may be claimed once: by an entry of its own node or by a glob
+    of its parent's (passed down as claim). A second claim with a different
+    source raises DotError naming both; an identical one is dropped. The
+    matches of a node's globs are merged with its children by name, so the
+    whole directory is visited in one sorted pass. With errors, an entry
+    that raises is recorded under its manifest key and skipped.
+    """
+    into = {}  # name -> source, for the links written into this target
+    for source, into_dir, key in node["entries"]:
+        try:
+            claim, matches = _resolve_entry(
+                target, source, into_dir, base_dir, fs, claim, into, live, missing_ok
+            )
+        except DotError as e:
+            if errors is None:
+                raise
+            errors.add(key, e)
+            continue
+        into.update(matches)
+    if claim is not None:
+        yield target, claim
+    children = node["children"]
+    for name in sorted(set(into) | set(children)):
+        child = os.path.join(target, name)
+        if name not in children:
+            yield child, into[name]
+            continue
+        for link in _walk_target_tree(
+            children[name],
+            child,
+            base_dir,
+            fs,
+            into.get(name),
+            live,
+            missing_ok,
+            errors,
+        ):
+            yield link
+
+
+def _resolve_entry(target, source, into_dir, base_dir, fs, claim, into, live, ok):
+    """Resolve one manifest entry at target: (its claim on target, the
+    {name: source} it writes into target). Raises DotError, changing
+    nothing, when the entry cannot be linked."""
+    source = _resolve_source(source, base_dir, fs, ok)
+    if into_dir and not isinstance(source, list):
+        source = [source]
+    # now we have a single target which might be a dir
+    # and one or more sources, which might be a combination of
+    # both files and directories
+    # all are normalized and absolute
+    if not isinstance(source, list):
+        return _claim(target, claim, source), {}
+    # write sources into target dir
+    # isdir() will resolve a symlink dir; a target that doesn't
+    # exist yet is fine here (cmd_link creates it), only a target
+    # that exists as a non-directory (e.g. a plain file or dangling symlink) is an error
+    if live and fs.lexists(target) and not fs.isdir(target):
+        # consider moving this check to the link() or unlink() funcs
+        raise ConflictError(
+            "target ( {} ) already exists and is not a directory. "
+            "Cannot write multiple symlinks from the following "
+            "sources into this target: {}".format(target, source)
+        )
+    matches = {}
+    for _s in source:
+        name = os.path.basename(_s)
+        matches[name] = _claim(
+            os.path.join(target, name), matches.get(name, into.get(name)), _s
+        )
+    return claim, matches
+
+
+def _claim(target, claimed, source):
+    """The source of target once source claims it too (see above)."""
+    if claimed is not None and claimed != source:
+        raise ConflictError(
+            "Target {} is claimed by both {} and {}".format(target, claimed, source)
+        )
+    return source
+
+
+def _shadowing_links(links):
+    """{target: the managed link it sits inside} for every link that will be
+    created inside a directory that is itself one of the links (so its file
+    lands in that link's source). Each target climbs its own parents only.
+    """
+    shadowed = {}
+    for target in links:
+        path = os.path.dirname(target)
+        while path != os.path.dirname(path):
+            if path in links:
+                shadowed[target] = path
+                break
+            path = os.path.dirname(path)
+    return shadowed
+
+
+_GLOB_MAGIC = re.compile(r"[*?[]")
+_SEGMENT_MATCHERS = {}  # type: dict
+
+
+def _segment_matcher(segment):
+    """Compiled fnmatch regex for one path segment, shared across the run."""
+    try:
+        return _SEGMENT_MATCHERS[segment]
+    except KeyError:
+        import fnmatch
+
+        matcher = re.compile(fnmatch.translate(segment)).match
+        return _SEGMENT_MATCHERS.setdefault(segment, matcher)
+
+
+def _split_pattern(pattern):
+    """Split an absolute pattern into its literal root dir and the segments
+    below it, e.g. /a/b/*/c -> ("/a/b", ["*", "c"])."""
+    parts = pattern.split(os.path.sep)
+    for i, part in enumerate(parts):
+        if _GLOB_MAGIC.search(part):
+            return os.path.sep.join(parts[:i]) or os.path.sep, parts[i:]
+    return pattern, []
+
+
+def _segments_match(names, segments):
+    """fnmatch a list of path names against pattern segments ("**" matches
+    any number of names, hidden ones only if spelled with a leading dot)."""
+    if not segments:
+        return not names
+    segment, rest = segments[0], segments[1:]
+    if segment == "**":
+        if _segments_match(names, rest):
+            return True
+        if not names or names[0].startswith("."):
+            return False
+        return _segments_match(names[1:], segments)
+    if not names or not _visible(names[0], segment):
+        return False
+    return bool(_segment_matcher(segment)(names[0])) and _segments_match(
+        names[1:], rest
+    )
+
+
+def _visible(name, segment):
+    """glob's rule: a wildcard only matches dotfiles if it starts with a dot."""
+    return not name.startswith(".") or segment.startswith(".")
+
+
+class _Excludes(object):
+    """The "!pattern" entries of a list source.
+
+    A pattern without a slash is matched against every name (so it also
+    prunes whole directories during a "**" walk); one with a slash is an
+    absolute pattern matched against the full path.
+    """
+
+    def __init__(self, patterns):
+        self.names = []
+        self.paths = []
+        for pattern in patterns:
+            if os.path.sep in pattern:
+                self.paths.append(pattern.split(os.path.sep))
+            else:
+                self.names.append(pattern)
+
+    def __call__(self, path):
+        name = os.path.basename(path)
+        for pattern in self.names:
+            if _visible(name, pattern) and _segment_matcher(pattern)(name):
+                return True
+        parts = path.split(os.path.sep)
+        return any(_segments_match(parts, pattern) for pattern in self.paths)
+
+
+def _glob(pattern, fs, excluded=None):
+    """Expand an absolute pattern with the run's cached directory listings.
+
+    Supports glob.glob's "*", "?" and "[...]" per segment plus "**" for
+    zero or more directories. "**" does not descend into hidden or
+    symlinked directories, and a trailing "**" matches files only, so a
+    directory and its contents are never both linked. Results are sorted.
+    """
+    root, segments = _split_pattern(pattern)
+    if not segments:
+        return [pattern] if fs.lexists(pattern) else []
+    excluded = excluded or (lambda path: False)
+    matches = set()
+
+    def expand(dirname, segments):
+        segment, rest = segments[0], segments[1:]
+        if segment == "**":
+            if rest:
+                expand(dirname, rest)
+            for name, is_dir, is_link in fs.listdir(dirname):
+                path = os.path.join(dirname, name)
+                if name.startswith(".") or excluded(path):
+                    continue
+                if is_dir and not is_link:
+                    expand(path, segments)
+                elif not rest and not is_dir:
+                    matches.add(path)
+        elif not _GLOB_MAGIC.search(segment):
+            path = os.path.join(dirname, segment)
+            if excluded(path):
+                return
+            if rest:
+                if fs.isdir(path):
+                    expand(path, rest)
+            elif fs.lexists(path):
+                matches.add(path)
         else:
-            links_expanded[target] = source
-    # sort these so that symlinks closer to / get created first
-    # e.g. /this -> /source/this
-    #      /this/1 -> /source/numbers/1
-    #  so that the '1' file ends up in the symlinked dir
-    return collections.OrderedDict(sorted(links_expanded.items()))
-
-
-def _resolve_source(source, base_dir=None):
-    expanded = os.path.expandvars(os.path.expanduser(source))
-    if base_dir and not os.path.isabs(expanded):
-        source = os.path.join(base_dir, expanded)
-    abs_sources = _normalize_path(source, globbing=True)
-    # at this point we have 1 or more sources
-    # source may be a single dir, a single file, or a bunch of files like ones/in/here/*
+            match = _segment_matcher(segment)
+            for name, is_dir, _is_link in fs.listdir(dirname):
+                if not _visible(name, segment) or not match(name):
+                    continue
+                path = os.path.join(dirname, name)
+                if excluded(path):
+                    continue
+                if not rest:
+                    matches.add(path)
+                elif is_dir:
+                    expand(path, rest)
+
+    if fs.isdir(root):
+        expand(root, segments)
+    return sorted(matches)
+
+
+def _source_pattern(source, base_dir, fs):
+    """Absolute pattern for a manifest source (relative to base_dir)."""
+    # realpath keeps glob characters, so only the literal root is resolved
+    root, segments = _split_pattern(fs.expand(source, base_dir))
+    return os.path.join(fs.realpath(root), *segments)
+
+
+def _resolve_source(source, base_dir=None, fs=None, missing_ok=False):
+    """Expand a link source to an absolute path or a list of them.
+
+    A plain path comes back as a string (link exactly that); a glob, or a
+    list of patterns, comes back as a list (link each match into the
+    target dir). In a list, "!pattern" entries exclude matches. With
+    missing_ok a plain path that does not exist yet is returned too.
+    """
+    fs = fs or _FsCache()
+    if isinstance(source, list):
+        patterns = [p for p in source if not p.startswith("!")]
+        excludes = [p[1:] for p in source if p.startswith("!")]
+        if not patterns:
+            raise SourceError("Bad symlink source (only exclusions): {}".format(source))
+        excluded = _Excludes(
+            [
+                p if os.path.sep not in p else _source_pattern(p, base_dir, fs)
+                for p in excludes
+            ]
+        )
+        abs_sources = sorted(
+            set(
+                match
+                for pattern in patterns
+                for match in _glob(_source_pattern(pattern, base_dir, fs), fs, excluded)
+            )
+        )
+    else:
+        pattern = _source_pattern(source, base_dir, fs)
+        abs_sources = fs.glob(pattern)
+        # at this point we have 1 or more sources
+        # source may be a single dir, a single file, or a bunch of files like ones/in/here/*
+        if abs_sources == [pattern]:
+            # No globbing occurred, we want to write the source/target explicitly
+            # Return a string instead of a list in this case, to indicate this
+            return pattern
+        if missing_ok and not abs_sources and not _split_pattern(pattern)[1]:
+            return pattern
     if not abs_sources:
-        _errcho("Bad symlink source (nothing matched/found): {}".format(source))
-    if len(abs_sources) == 1:
-        # No globbing occurred, we want to write the source/target explicitly
-        # Return a string instead of a list in this case, to indicate this
-        if abs_sources[0] == _normalize_path(source, globbing=False):
-            return abs_sources[0]
+        raise SourceError(
+            "Bad symlink source (nothing matched/found): {}".format(source)
+        )
     # otherwise, globbing matches occurred, dump into target dir
-    return list(abs_sources)
+    tails = collections.Counter(os.path.basename(match) for match in abs_sources)
+    clashes = sorted(tail for tail, count in tails.items() if count > 1)
+    if clashes:
+        raise SourceError(
+            "Bad symlink source {}: several matches would link to {}".format(
+                source, ", ".join(clashes)
+            )
+        )
+    return abs_sources
 
 
 def _mkdir_p(path):
@@ -364,30 +3766,55 @@ def _mkdir_p(path):
             raise
 
 
-def main():
-    """Main entry point for dot CLI."""
-    parser = argparse.ArgumentParser(prog="dot", description="Dotfiles symlink manager")
-    parser.add_argument("--version", action="version", version="dot {}".format(VERSION))
-    parser.add_argument(
-        "--config",
-        "-c",
-        default=DEFAULT_CONFIG,
-        help="dotfiles config file, JSON or YAML (default: {}, "
-        "falling back to dotfiles.yaml; YAML requires PyYAML)".format(DEFAULT_CONFIG),
-    )
-    parser.add_argument(
-        "--debug", action="store_true", default=False, help="enable debug output"
-    )
-    parser.add_argument(
-        "--home-dir",
-        default=_normalize_path("~/", globbing=False),
-        help="home directory (default: ~)",
-    )
+def _positive_int(value):
+    """argparse type: an integer >= 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "expected a positive integer, got {!r}".format(value)
+        )
+    return number
+
+
+def _load_layers(config_paths, home_dir, extensions_dir=None):
+    """Load each manifest as a Layer; returns (layers, failed layer names).
+
+    A lone manifest keeps the historical behavior (a missing file is an
+    empty config, a broken one aborts); with several, a manifest that
+    cannot be loaded is reported and skipped.
+    """
+    layers = []
+    failed = []
+    default_home = []  # realpath("~/") only if some manifest lacks "home"
+    for config_path in config_paths:
+        name = _layer_name(config_path, extensions_dir)
+        config = {}
+        if len(config_paths) == 1:
+            if os.path.isfile(config_path):
+                config = load_config(config_path)
+        else:
+            try:
+                if not os.path.isfile(config_path):
+                    raise ManifestError("No such config file: {}".format(config_path))
+                config = _load_config(config_path)
+            except DotError as e:
+                print_error("Layer {}: {}".format(name, e), abort=False)
+                failed.append(name)
+                continue
+        # Set home directory in config if not already set
+        if not config.get("home"):
+            if not home_dir and not default_home:
+                default_home.append(_normalize_path("~/", globbing=False))
+            config["home"] = home_dir or default_home[0]
+        path = config_path if os.path.isfile(config_path) else None
+        layers.append(Layer(name, path, config, _config_base_dir(config, config_path)))
+    return layers, failed
 
-    subparsers = parser.add_subparsers(dest="command", help="available commands")
 
-    # link command
-    link_parser = subparsers.add_parser("link", help="Create symlinks")
+def _add_link_args(link_parser):
     link_parser.add_argument(
         "-s", "--source", help="Symlink source file/dir to link to"
     )
@@ -418,10 +3845,195 @@ def main():
         help="Repoint existing symlinks that point at a different source "
         "(default: warn and skip them)",
     )
+    link_parser.add_argument(
+        "--verify",
+        action="store_true",
+        default=False,
+        help="Re-check every target even if the state index says nothing "
+        "changed since the last successful run",
+    )
+    link_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=_positive_int,
+        default=1,
+        help="Apply links on N threads (needs --yes or --no-confirm; "
+        "parents are still linked before their children; default: 1)",
+    )
+    link_parser.add_argument(
+        "-k",
+        "--keep-going",
+        action="store_true",
+        default=False,
+        help="Check the whole manifest first, link every entry that can be "
+        "linked, then report each failing entry by key and exit 1",
+    )
+    link_parser.add_argument(
+        "--materialize",
+        action="store_true",
+        default=False,
+        help="place copies of the sources instead of symlinks (reflink or "
+        "in-kernel copy where possible); later runs only copy changed sources",
+    )
+    link_parser.add_argument(
+        "--checksum",
+        action="store_true",
+        default=False,
+        help="with --materialize, record each copy's SHA-256 so a source "
+        "whose mtime changed but contents did not is not copied again",
+    )
+    link_parser.add_argument(
+        "--workers",
+        type=_positive_int,
+        help="With several homes, link N homes at a time in worker "
+        "processes (default: one per CPU)",
+    )
+
+
+def _add_plan_args(plan_parser):
+    plan_parser.add_argument(
+        "-s", "--source", help="Symlink source file/dir to link to"
+    )
+    plan_parser.add_argument("-t", "--target", help="Symlink target file/dir")
+    plan_parser.add_argument(
+        "--skip-config",
+        action="store_true",
+        default=False,
+        help="Do not use config file",
+    )
+    plan_parser.add_argument(
+        "-o", "--output", help="Write the plan to this file (default: stdout)"
+    )
+
+
+def _add_apply_args(apply_parser):
+    apply_parser.add_argument("plan", help="Plan file (- for stdin)")
+    apply_parser.add_argument(
+        "--no-confirm",
+        action="store_true",
+        default=False,
+        help="Do not ask for confirmation",
+    )
+    apply_parser.add_argument(
+        "-y",
+        "--yes",
+        action="store_true",
+        default=False,
+        help="Answer yes to all prompts",
+    )
+    apply_parser.add_argument(
+        "--force-relink",
+        action="store_true",
+        default=False,
+        help="Repoint symlinks the plan marked as repoint "
+        "(default: warn and skip them)",
+    )
+    apply_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=_positive_int,
+        default=1,
+        help="Apply links on N threads (needs --yes or --no-confirm)",
+    )
+
+
+def _add_status_args(status_parser):
+    status_parser.add_argument(
+        "--quick",
+        action="store_true",
+        default=False,
+        help="trust the state index of the last converged `link` and only "
+        "re-check targets whose directory changed since (falls back to a "
+        "full check when there is no current index)",
+    )
+    status_parser.add_argument(
+        "--json", action="store_true", default=False, help="print every entry as JSON"
+    )
+    status_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=_positive_int,
+        default=8,
+        help="scan target directories on N threads (default: 8)",
+    )
+    status_parser.set_defaults(source=None, target=None, skip_config=False)
+
+
+def _add_export_args(export_parser):
+    export_parser.add_argument(
+        "--format",
+        choices=("tar",),
+        default="tar",
+        help="archive format (default: tar)",
+    )
+    export_parser.add_argument(
+        "--dereference",
+        action="store_true",
+        default=False,
+        help="store copies of the sources instead of symlinks to them",
+    )
+    export_parser.add_argument(
+        "--home-prefix",
+        metavar="PATH",
+        help="archive path for the manifest's home (default: the home "
+        "path itself, e.g. home/alice)",
+    )
+    export_parser.add_argument(
+        "-o", "--output", help="Write the archive to this file (default: stdout)"
+    )
+    export_parser.set_defaults(source=None, target=None, skip_config=False)
+
+
+def _add_adopt_args(adopt_parser):
+    adopt_parser.add_argument(
+        "-s", "--source", help="Repo path to move the target to and link"
+    )
+    _add_unlink_args(adopt_parser)
+    adopt_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="Report what would be moved and linked, change nothing",
+    )
+    adopt_parser.add_argument(
+        "--undo",
+        action="store_true",
+        default=False,
+        help="Move the files adopted before back out of the repo",
+    )
+
+
+def _add_watch_args(watch_parser):
+    watch_parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="seconds between polls while things change (default: 1)",
+    )
+    watch_parser.add_argument(
+        "--max-interval",
+        type=float,
+        default=30.0,
+        help="longest poll interval once idle (default: 30)",
+    )
+    watch_parser.add_argument(
+        "--polls", type=_positive_int, help="stop after N polls (default: run until ^C)"
+    )
+    # watch never prompts and never repoints a link it did not make
+    watch_parser.set_defaults(
+        source=None,
+        target=None,
+        skip_config=False,
+        no_confirm=True,
+        yes=True,
+        force_relink=False,
+        jobs=1,
+    )
+
 
-    # unlink command
-    unlink_parser = subparsers.add_parser("unlink", help="Remove symlinks")
+def _add_unlink_args(unlink_parser):
     unlink_parser.add_argument("-t", "--target", help="Symlink target file/dir")
+    unlink_parser.set_defaults(source=None)
     unlink_parser.add_argument(
         "--skip-config",
         action="store_true",
@@ -442,39 +4054,243 @@ def main():
         help="Answer yes to all prompts",
     )
 
-    args = parser.parse_args()
+
+# Subcommand -> (help, function adding its arguments)
+_COMMANDS = collections.OrderedDict(
+    [
+        ("link", ("Create symlinks", _add_link_args)),
+        ("plan", ("Show what link would do, as JSON (no changes)", _add_plan_args)),
+        ("apply", ("Execute a plan written by `dot plan`", _add_apply_args)),
+        ("status", ("Check every link (exit 3: drift, 4: blocked)", _add_status_args)),
+        ("watch", ("Relink as glob sources gain or lose files", _add_watch_args)),
+        ("export", ("Write the resolved links as a tar stream", _add_export_args)),
+        ("adopt", ("Move blocking files into the repo, link them", _add_adopt_args)),
+        ("unlink", ("Remove symlinks", _add_unlink_args)),
+    ]
+)
+
+
+def _add_global_args(parser):
+    parser.add_argument("--version", action="version", version="dot {}".format(VERSION))
+    parser.add_argument(
+        "--config",
+        "-c",
+        action="append",
+        help="dotfiles config file, JSON or YAML (default: {}, "
+        "falling back to dotfiles.yaml; YAML requires PyYAML). Repeat to "
+        "layer manifests; later ones win on a shared target".format(DEFAULT_CONFIG),
+    )
+    parser.add_argument(
+        "--extensions-dir",
+        help="also layer the manifest of every extension in DIR "
+        "(e.g. ~/.dot/extensions), in lexical order, after --config",
+    )
+    parser.add_argument(
+        "--debug", action="store_true", default=False, help="enable debug output"
+    )
+    parser.add_argument(
+        "--home-dir",
+        action="append",
+        help="home directory (default: ~); repeat it to `link` one "
+        "resolution into several homes",
+    )
+    parser.add_argument(
+        "--homes-from",
+        metavar="FILE",
+        help="`link` into every home listed in FILE, one path per line "
+        "(- for stdin; blank lines and # comments are ignored)",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        default=False,
+        help="print wall time and filesystem call counts per phase "
+        "(config, state, resolve, plan, apply) to stderr",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="write a cProfile dump of the run to FILE (read it with "
+        "`python -m pstats FILE`) and tracemalloc's top allocations to "
+        "FILE.tracemalloc (Python 3)",
+    )
+
+
+def _build_parser(argv):
+    """The dot argument parser, with arguments only for the subcommand
+    named in argv (every subcommand when none is, e.g. `dot --help`).
+
+    A throwaway pre-parse of the global options finds the subcommand, so a
+    plain `dot link` never builds the argument tree of the others.
+    """
+    pre = argparse.ArgumentParser(prog="dot", add_help=False)
+    _add_global_args(pre)
+    pre.add_argument("command", nargs="?")
+    command = pre.parse_known_args(argv)[0].command
+
+    parser = argparse.ArgumentParser(prog="dot", description="Dotfiles symlink manager")
+    _add_global_args(parser)
+    subparsers = parser.add_subparsers(dest="command", help="available commands")
+    for name, (help_text, add_args) in _COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        if command not in _COMMANDS or name == command:
+            add_args(subparser)
+    return parser
+
+
+def main(argv=None):
+    """Main entry point for dot CLI."""
+    parser = _build_parser(sys.argv[1:] if argv is None else argv)
+    args = parser.parse_args(argv)
 
     # Set global DEBUG
     if args.debug:
         global DEBUG
         DEBUG = True
 
-    # Load config if it exists
-    config = {}
-    config_path = args.config
-    if config_path == DEFAULT_CONFIG and not os.path.isfile(config_path):
-        # Fall back to a YAML config when the default JSON one is absent
-        for candidate in ("dotfiles.yaml", "dotfiles.yml"):
-            if os.path.isfile(candidate):
-                config_path = candidate
-                break
-    if os.path.isfile(config_path):
-        config = load_config(config_path)
+    global _STATS
+    stats = _Stats().install() if args.stats else None
+    if stats is not None:
+        _STATS = stats
+    profiler = _start_profile() if args.profile else None
+    try:
+        _run(parser, args)
+    finally:
+        if profiler is not None:
+            _write_profile(profiler, args.profile)
+        if stats is not None:
+            stats.uninstall()
+            _STATS = None
+            print(stats.report(), file=sys.stderr)
 
-    # Set home directory in config if not already set
-    if not config.get("home"):
-        config["home"] = args.home_dir
 
+def _run(parser, args):
+    # Load config if it exists
+    config_paths = list(args.config or [])
+    if not config_paths:
+        config_path = DEFAULT_CONFIG
+        if not os.path.isfile(config_path):
+            # Fall back to a YAML config when the default JSON one is absent
+            for candidate in ("dotfiles.yaml", "dotfiles.yml"):
+                if os.path.isfile(candidate):
+                    config_path = candidate
+                    break
+        config_paths.append(config_path)
+    extensions_dir = None
+    if args.extensions_dir:
+        extensions_dir = _normalize_path(args.extensions_dir, resolve=False)
+        if not args.config and not os.path.isfile(config_paths[0]):
+            config_paths = []  # extensions only; no host manifest here
+        config_paths.extend(_extension_manifests(extensions_dir))
+    args.config_paths = config_paths
+    args.extensions_path = extensions_dir
+    homes = list(args.home_dir or [])
+    if args.homes_from:
+        homes.extend(_read_homes(args.homes_from))
+    args.home_dir = None
+    args.homes = []
+    if len(homes) == 1 and not args.homes_from:
+        args.home_dir = homes[0]
+    elif homes or args.homes_from:
+        if args.command != "link":
+            print_error("Only `dot link` accepts several homes.")
+        if not homes:
+            print_error("No homes listed in {}.".format(args.homes_from))
+        args.homes = [_normalize_path(home, resolve=False) for home in homes]
+    args.layered = len(config_paths) > 1
+    with _phase("config"):
+        args.layers, args.failed_layers = _load_layers(
+            config_paths, args.home_dir, extensions_dir
+        )
+    if not args.layers:
+        print_error("No manifest could be loaded.")
+    config = args.layers[0].config
     # Resolve relative link sources against the manifest, not the cwd
-    args.base_dir = _config_base_dir(config, config_path)
+    args.base_dir = args.layers[0].base_dir
 
     if DEBUG:
         print_info("Config:")
         print_info(json.dumps(config, indent=2, sort_keys=True))
 
     # Dispatch to command
+    try:
+        _dispatch(parser, args, config)
+    except DotError as e:
+        print_error(str(e))
+
+
+def _read_homes(path):
+    """The home paths listed in path ("-" for stdin)."""
+    try:
+        if path == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(path, "r") as f:
+                lines = f.read().splitlines()
+    except IOError as e:
+        print_error("Failed to read homes from {}: {}".format(path, e))
+    return [
+        line.strip()
+        for line in lines
+        if line.strip() and not line.strip().startswith("#")
+    ]
+
+
+def _start_profile():
+    import cProfile
+
+    try:
+        import tracemalloc
+    except ImportError:  # Python 2: the cProfile dump only
+        pass
+    else:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _write_profile(profiler, path):
+    """Dump the cProfile stats to path and a tracemalloc summary beside it."""
+    profiler.disable()
+    profiler.dump_stats(path)
+    try:
+        import tracemalloc
+    except ImportError:
+        print(
+            "Profile written to {} (no .tracemalloc before Python 3.4)".format(path),
+            file=sys.stderr,
+        )
+        return
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    with open(path + ".tracemalloc", "w") as f:
+        f.write(
+            "current {:.1f} KiB, peak {:.1f} KiB\n\n".format(
+                current / 1024.0, peak / 1024.0
+            )
+        )
+        for stat_line in snapshot.statistics("lineno")[:25]:
+            f.write("{}\n".format(stat_line))
+    print("Profile written to {} (+ .tracemalloc)".format(path), file=sys.stderr)
+
+
+def _dispatch(parser, args, config):
     if args.command == "link":
         cmd_link(args, config)
+    elif args.command == "plan":
+        cmd_plan(args, config)
+    elif args.command == "apply":
+        cmd_apply(args, config)
+    elif args.command == "status":
+        cmd_status(args, config)
+    elif args.command == "watch":
+        cmd_watch(args, config)
+    elif args.command == "export":
+        cmd_export(args, config)
+    elif args.command == "adopt":
+        cmd_adopt(args, config)
     elif args.command == "unlink":
         cmd_unlink(args, config)
     else:
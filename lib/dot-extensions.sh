@@ -109,15 +109,20 @@ load_dotfiles_modules() {
   return 0
 }
 
-# Bootstrap every extension: run its install.sh, then link its manifest.
-# $1 = path to dot.py. --force-relink is the deliberate policy that
-# extension links may repoint host-owned symlinks (warned loudly).
-# Extensions are independent layers: one extension's failure is reported
-# loudly but never blocks the others (or the caller — always returns 0,
-# so install.sh's set -e completes the rest of the bootstrap).
+# Bootstrap every extension: run its install.sh, then link every healthy
+# extension's manifest in ONE dot.py run (layered in load order, last
+# writer wins, so a link a later extension overrides is never created and
+# then repointed). $1 = path to dot.py. --force-relink is the deliberate
+# policy that extension links may repoint host-owned symlinks (warned
+# loudly). Extensions are independent layers: one extension's failure is
+# reported loudly but never blocks the others — a failed install.sh drops
+# only that extension's manifest, and dot.py isolates per-layer link
+# failures itself. Always returns 0, so install.sh's set -e completes the
+# rest of the bootstrap.
 dot_bootstrap_extensions() {
   local dot_py="$1"
   local ext ext_name manifest failed_exts=""
+  local link_args=()
   while IFS= read -r ext; do
     if [[ -z "$ext" ]]; then
       continue
@@ -134,13 +139,17 @@ dot_bootstrap_extensions() {
     fi
     manifest="$(dot_extension_manifest "$ext")"
     if [[ -n "$manifest" ]]; then
-      echo "Linking ${ext_name} manifest..."
-      if ! python3 "$dot_py" --config "$manifest" link --yes --force-relink; then
-        echo "dot-extensions: linking ${ext_name} manifest failed" >&2
-        failed_exts="${failed_exts} ${ext_name}"
-      fi
+      link_args+=(--config "$manifest")
     fi
   done < <(dot_list_extensions)
+  # bash 3.2 + set -u: never expand an empty array
+  if [[ ${#link_args[@]} -gt 0 ]]; then
+    echo "Linking extension manifests..."
+    if ! python3 "$dot_py" "${link_args[@]}" link --yes --force-relink; then
+      echo "dot-extensions: linking extension manifests failed (see failed layer(s) above)" >&2
+      failed_exts="${failed_exts} (link)"
+    fi
+  fi
   if [[ -n "$failed_exts" ]]; then
     echo "dot-extensions: WARNING — failed extension(s):${failed_exts}" >&2
   fi
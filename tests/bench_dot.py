@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+"""
+Benchmarks for dot.py on synthetic dotfiles repos (not collected by pytest).
+
+    python tests/bench_dot.py run --scales 10000,100000 -o after.json
+    python tests/bench_dot.py compare before.json after.json
+
+Each shape is generated once per scale under a scratch directory, then every
+operation runs in a fresh interpreter (so peak RSS is per operation and no
+in-process cache leaks between them):
+
+    resolve      _resolve_all_links() on the loaded manifest
+    link-cold    `link --yes` into an empty home
+    link-warm    the same again (state index fast path)
+    link-verify  `link --yes --verify` (full target check, nothing to do)
+    relink       `link --yes --force-relink` after every link was pointed elsewhere
+    unlink       `unlink --yes`
+    link-jobs    `link --yes --jobs 4` into the emptied home (resolve, plan, apply)
+
+Filesystem calls, per-phase times and memo hit counts come from dot's own
+`--stats` counters (dot._Stats), which wrap the os functions dot and os.path
+call; stats done inside C (e.g. DirEntry.is_dir) are not seen. Everything is stdlib, offline
+and Linux/macOS only (resource.getrusage).
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SHAPES = ("flat", "nested", "glob", "symlinked")
+OPS = (
+    "resolve",
+    "link-cold",
+    "link-warm",
+    "link-verify",
+    "relink",
+    "unlink",
+    "link-jobs",
+)
+
+
+def _touch(path):
+    with open(path, "w"):
+        pass
+
+
+def _generate(shape, entries, workdir):
+    """Write src/ and dotfiles.json for one shape; return the manifest path."""
+    src = os.path.join(workdir, "src")
+    home = os.path.join(workdir, "home")
+    os.makedirs(src)
+    os.makedirs(home)
+    links = {}
+    if shape == "flat":
+        for i in range(entries):
+            _touch(os.path.join(src, "f{}".format(i)))
+            links[os.path.join(home, ".f{}".format(i))] = "src/f{}".format(i)
+    elif shape == "nested":
+        # ten files per directory, directories nested by the digits of i // 10
+        for i in range(entries):
+            rel = os.path.join(*(["d" + c for c in str(i // 10)] + ["f{}".format(i)]))
+            path = os.path.join(src, rel)
+            if i % 10 == 0:
+                os.makedirs(os.path.dirname(path))
+            _touch(path)
+            links[os.path.join(home, ".nested", rel)] = os.path.join("src", rel)
+    elif shape == "glob":
+        # a glob per 100 files
+        for d in range(max(1, entries // 100)):
+            os.makedirs(os.path.join(src, "g{}".format(d)))
+            for j in range(min(100, entries)):
+                _touch(os.path.join(src, "g{}".format(d), "f{}".format(j)))
+            links[os.path.join(home, ".g{}".format(d))] = "src/g{}/*".format(d)
+    elif shape == "symlinked":
+        # a linked directory per 100 entries, 99 targets created inside it
+        extra = os.path.join(src, "extra")
+        os.makedirs(extra)
+        for d in range(max(1, entries // 100)):
+            os.makedirs(os.path.join(src, "s{}".format(d)))
+            links[os.path.join(home, ".s{}".format(d))] = "src/s{}".format(d)
+            for j in range(min(99, entries - 1)):
+                name = "s{}_x{}".format(d, j)
+                _touch(os.path.join(extra, name))
+                target = os.path.join(home, ".s{}".format(d), "x{}".format(j))
+                links[target] = os.path.join("src", "extra", name)
+    else:
+        raise ValueError("unknown shape: {}".format(shape))
+    config_path = os.path.join(workdir, "dotfiles.json")
+    with open(config_path, "w") as f:
+        json.dump({"home": home, "links": links}, f)
+    return config_path
+
+
+def _detach_links(config_path):
+    """Point every symlink under home at a missing path, for the relink run."""
+    with open(config_path) as f:
+        home = json.load(f)["home"]
+    for dirpath, dirnames, filenames in os.walk(home):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                os.unlink(path)
+                os.symlink(path + ".moved", path)
+
+
+def _run_op(op, config_path, result_path):
+    """Child process: run one operation and write its measurements."""
+    import resource
+
+    sys.path.insert(0, ROOT)
+    import dot
+
+    argv = ["--config", config_path]
+    if op == "link-verify":
+        argv += ["link", "--yes", "--verify"]
+    elif op == "relink":
+        argv += ["link", "--yes", "--force-relink"]
+    elif op == "unlink":
+        argv += ["unlink", "--yes"]
+    elif op == "link-jobs":
+        argv += ["link", "--yes", "--jobs", "4"]
+    else:
+        argv += ["link", "--yes"]
+    # dot's own --stats counters, installed here so main() leaves them be
+    stats = dot._STATS = dot._Stats().install()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        start = time.perf_counter()
+        if op == "resolve":
+            with dot._phase("config"):
+                config = dot.load_config(config_path)
+            base_dir = dot._config_base_dir(config, config_path)
+            with dot._phase("resolve"):
+                dot._resolve_all_links(config["links"], config, base_dir)
+        else:
+            dot.main(argv)
+        wall = time.perf_counter() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = usage.ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+    with open(result_path, "w") as f:
+        json.dump(
+            {
+                "wall_s": wall,
+                "peak_rss_kb": peak,
+                "syscalls": stats.totals(),
+                "memos": stats.memo_totals(),
+                "phases": dict(
+                    (phase, {"wall_s": stats.wall[phase], "calls": stats.counts[phase]})
+                    for phase in set(stats.wall) | set(stats.counts)
+                ),
+            },
+            f,
+        )
+
+
+def _measure(op, config_path, workdir):
+    result_path = os.path.join(workdir, "result.json")
+    env = dict(os.environ, DOTFILES_STATE_DIR=os.path.join(workdir, "state"))
+    subprocess.check_call(
+        [sys.executable, __file__, "_op", op, config_path, result_path], env=env
+    )
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def _bench_shape(shape, entries, workdir, repeat, log):
+    config_path = _generate(shape, entries, workdir)
+    samples = dict((op, []) for op in OPS)
+    for _ in range(repeat):
+        for path in ("home", "state"):
+            shutil.rmtree(os.path.join(workdir, path), ignore_errors=True)
+        os.makedirs(os.path.join(workdir, "home"))
+        for op in OPS:
+            if op == "relink":
+                # dot cannot know links changed behind its back, so the
+                # index has to go too, or this would time the fast path
+                _detach_links(config_path)
+                shutil.rmtree(os.path.join(workdir, "state"))
+            samples[op].append(_measure(op, config_path, workdir))
+    results = []
+    for op in OPS:
+        best = min(samples[op], key=lambda sample: sample["wall_s"])
+        results.append(
+            {
+                "shape": shape,
+                "entries": entries,
+                "op": op,
+                "wall_s": best["wall_s"],
+                "samples_s": [sample["wall_s"] for sample in samples[op]],
+                "peak_rss_kb": max(sample["peak_rss_kb"] for sample in samples[op]),
+                "syscalls": best["syscalls"],
+                "memos": best["memos"],
+                "phases": best["phases"],
+            }
+        )
+        log(
+            "{:<10} {:>8} {:<12} {:>9.3f}s {:>8} KiB {:>9} syscalls".format(
+                shape,
+                entries,
+                op,
+                best["wall_s"],
+                results[-1]["peak_rss_kb"],
+                sum(best["syscalls"].values()),
+            )
+        )
+    return results
+
+
+def _csv(kind):
+    def parse(value):
+        items = [item.strip() for item in value.split(",") if item.strip()]
+        return [kind(item) for item in items]
+
+    return parse
+
+
+def cmd_run(args):
+    for shape in args.shapes:
+        if shape not in SHAPES:
+            sys.exit("unknown shape {!r} (choose from {})".format(shape, SHAPES))
+    scratch = args.workdir or tempfile.mkdtemp(prefix="dot-bench-")
+    results = []
+    try:
+        for entries in args.scales:
+            for shape in args.shapes:
+                workdir = os.path.join(scratch, "{}-{}".format(shape, entries))
+                shutil.rmtree(workdir, ignore_errors=True)
+                os.makedirs(workdir)
+                results.extend(
+                    _bench_shape(
+                        shape,
+                        entries,
+                        workdir,
+                        args.repeat,
+                        lambda line: sys.stderr.write(line + "\n"),
+                    )
+                )
+                if not args.keep:
+                    shutil.rmtree(workdir)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(scratch, ignore_errors=True)
+    report = {
+        "bench_format": 1,
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+
+def cmd_compare(args):
+    reports = []
+    for path in (args.old, args.new):
+        with open(path) as f:
+            reports.append(
+                dict(
+                    ((r["shape"], r["entries"], r["op"]), r)
+                    for r in json.load(f)["results"]
+                )
+            )
+    old, new = reports
+    worst = 0.0
+    print(
+        "{:<10} {:>8} {:<12} {:>9} {:>9} {:>7} {:>10} {:>10} {:>10}".format(
+            "shape",
+            "entries",
+            "op",
+            "old s",
+            "new s",
+            "ratio",
+            "syscalls",
+            "old KiB",
+            "new KiB",
+        )
+    )
+    for key in sorted(set(old) & set(new)):
+        ratio = new[key]["wall_s"] / max(old[key]["wall_s"], 1e-9)
+        worst = max(worst, ratio)
+        delta = sum(new[key]["syscalls"].values()) - sum(old[key]["syscalls"].values())
+        print(
+            "{:<10} {:>8} {:<12} {:>9.3f} {:>9.3f} {:>6.2f}x {:>+10} {:>10} {:>10}".format(
+                key[0],
+                key[1],
+                key[2],
+                old[key]["wall_s"],
+                new[key]["wall_s"],
+                ratio,
+                delta,
+                old[key]["peak_rss_kb"],
+                new[key]["peak_rss_kb"],
+            )
+        )
+    if args.fail_over and worst > args.fail_over:
+        sys.exit("slowest ratio {:.2f}x exceeds {:.2f}x".format(worst, args.fail_over))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["_op"]:
+        return _run_op(*argv[1:])
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    subparsers = parser.add_subparsers(dest="command")
+    run = subparsers.add_parser("run", help="Generate trees and time every op")
+    run.add_argument(
+        "--shapes",
+        type=_csv(str),
+        default=list(SHAPES),
+        help="Comma-separated shapes (default: all of {})".format(",".join(SHAPES)),
+    )
+    run.add_argument(
+        "--scales",
+        type=_csv(int),
+        default=[10000],
+        help="Comma-separated entry counts, e.g. 10000,100000,1000000",
+    )
+    run.add_argument("--repeat", type=int, default=1, help="Keep the fastest of N")
+    run.add_argument("-o", "--output", help="Write the JSON report here")
+    run.add_argument("--workdir", help="Scratch directory (default: a temp dir)")
+    run.add_argument("--keep", action="store_true", help="Keep generated trees")
+    compare = subparsers.add_parser("compare", help="Compare two JSON reports")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.add_argument(
+        "--fail-over",
+        type=float,
+        help="Exit 1 if any op is more than this many times slower",
+    )
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        cmd_run(args)
+    elif args.command == "compare":
+        cmd_compare(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -82,3 +82,12 @@ def existing_dir(home_dir):
     dirpath = os.path.join(home_dir, ".existing_dir")
     os.makedirs(dirpath)
     return dirpath
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    """Keep dot's state index out of the real ~/.dot/state (inherited by
+    the dot.py subprocesses the integration tests spawn)"""
+    path = tmp_path / "dot-state"
+    monkeypatch.setenv("DOTFILES_STATE_DIR", str(path))
+    return path
@@ -3,6 +3,7 @@
 Tests for dot.py - Verifies behavior of zero-dependency refactored version.
 """
 
+import errno
 import json
 import re
 import os
@@ -445,3 +446,1995 @@ class TestReleaseHygiene:
         assert (
             json_links == yaml_links
         ), "dotfiles.json and dotfiles.yaml link maps have drifted"
+
+
+class TestParallelLink:
+    """link --jobs N: thread pool, parent-before-child, same output as serial"""
+
+    def _setup(self, tmp_path, name):
+        repo = tmp_path / name / "repo"
+        (repo / "pkg").mkdir(parents=True)
+        (repo / "pkg" / "inner").write_text("# inner\n")
+        (repo / "extra").write_text("# extra\n")
+        for i in range(8):
+            (repo / "rc{}".format(i)).write_text("# rc\n")
+        home = tmp_path / name / "home"
+        home.mkdir()
+        links = {str(home / ".rc{}".format(i)): "rc{}".format(i) for i in range(8)}
+        links[str(home / ".pkg")] = "pkg"
+        # lands inside the symlinked .pkg dir, so .pkg must be linked first
+        links[str(home / ".pkg" / "extra")] = "extra"
+        links[str(home / ".config" / "deep" / "rc")] = "rc0"
+        config_file = repo / "dotfiles.json"
+        config_file.write_text(json.dumps({"links": links}))
+        return repo, home, config_file
+
+    def test_jobs_matches_serial(self, tmp_path):
+        serial_repo, serial_home, serial_cfg = self._setup(tmp_path, "serial")
+        par_repo, par_home, par_cfg = self._setup(tmp_path, "par")
+
+        serial = _run_dot(serial_cfg, tmp_path)
+        parallel = _run_dot(par_cfg, tmp_path, "--jobs", "4")
+
+        assert serial.returncode == 0, serial.stdout + serial.stderr
+        assert parallel.returncode == 0, parallel.stdout + parallel.stderr
+        assert parallel.stdout.replace(str(tmp_path / "par"), "X") == (
+            serial.stdout.replace(str(tmp_path / "serial"), "X")
+        )
+        assert (par_repo / "pkg" / "extra").is_symlink()
+        assert "Summary: 11 created, 0 unchanged" in parallel.stdout
+
+    def test_link_waves_put_ancestors_first(self):
+        waves = dot._link_waves(["/h/a", "/h/a.txt", "/h/a/b", "/h/a/b/c", "/h/z"])
+
+        assert waves == [["/h/a", "/h/a.txt", "/h/z"], ["/h/a/b"], ["/h/a/b/c"]]
+
+    def test_jobs_regular_file_target_still_aborts(self, tmp_path):
+        repo, home, config_file = self._setup(tmp_path, "par")
+        (home / ".rc3").write_text("# a real file\n")
+
+        result = _run_dot(config_file, tmp_path, "--jobs", "4")
+
+        assert result.returncode == 1
+        assert "already exists and is not a symlink" in result.stderr
+        assert (home / ".rc3").read_text() == "# a real file\n"
+
+    def test_a_wave_is_applied_in_chunks(self, tmp_path, monkeypatch, capsys):
+        repo, home, config_file = self._setup(tmp_path, "par")
+        config = dot.load_config(str(config_file))
+        fs = dot._FsCache()
+        links = dot._resolve_all_links(config["links"], config, str(repo), fs)
+        entries = dot._plan_links(links, fs)
+        args = type(
+            "Args",
+            (),
+            {"no_confirm": True, "yes": True, "force_relink": False, "jobs": 4},
+        )
+        monkeypatch.setattr(dot, "APPLY_CHUNK", 3)
+
+        outcomes = dot._apply_plan(entries, args, fs, strict=False)
+
+        assert outcomes == [dot.LINK_CREATED] * len(entries)
+        created = [
+            line.split(": ", 1)[1].split(" --> ")[0]
+            for line in capsys.readouterr().out.splitlines()
+            if "Created symlink" in line
+        ]
+        assert created == [e.target for e in entries]
+        assert (repo / "pkg" / "extra").is_symlink()
+
+
+class TestFsCache:
+    """One lstat/readlink per path per run, shared by _filetype/link/unlink"""
+
+    def _count_calls(self, monkeypatch, names=("lstat", "stat", "readlink")):
+        calls = []
+        for name in names:
+            real = getattr(os, name)
+
+            def counted(*a, _real=real, _name=name, **kw):
+                calls.append(_name)
+                return _real(*a, **kw)
+
+            monkeypatch.setattr(os, name, counted)
+        return calls
+
+    def test_filetype_regular_file_is_one_lstat(self, existing_file, monkeypatch):
+        fs = dot._FsCache()
+        calls = self._count_calls(monkeypatch)
+
+        assert dot._filetype(existing_file, fs) == ["file"]
+        assert dot._filetype(existing_file, fs) == ["file"]
+        assert calls == ["lstat"]
+
+    def test_correct_link_costs_lstat_and_readlink(
+        self, home_dir, dotfiles_repo, monkeypatch
+    ):
+        source = os.path.join(dotfiles_repo, "test", "testrc")
+        targets = [os.path.join(home_dir, name) for name in (".a", ".b")]
+        for target in targets:
+            os.symlink(source, target)
+        args = type(
+            "Args", (), {"no_confirm": True, "yes": True, "force_relink": False}
+        )
+        fs = dot._FsCache()
+        calls = self._count_calls(monkeypatch, ("lstat", "stat", "readlink", "symlink"))
+
+        for target in targets:
+            outcome = dot._link_one(target, source, args, dot._emit_now, fs)
+            assert outcome == dot.LINK_UNCHANGED
+        # parents are _apply_plan's job: just lstat + readlink per link
+        assert calls == ["lstat", "readlink", "lstat", "readlink"]
+
+    def test_invalidate_drops_cached_subtree(self, tmp_path):
+        fs = dot._FsCache()
+        child = str(tmp_path / "dir" / "child")
+        assert fs.lstat(child) is None
+        (tmp_path / "dir").mkdir()
+        (tmp_path / "dir" / "child").write_text("x")
+
+        assert fs.lstat(child) is None  # still cached
+        fs.invalidate(str(tmp_path / "dir"))
+        assert fs.lstat(child) is not None
+
+
+def _run_dot_cmd(cwd, *argv):
+    """Run dot.py with arbitrary arguments from a given cwd."""
+    dot_path = os.path.join(os.path.dirname(__file__), "..", "dot.py")
+    cmd = [sys.executable, dot_path]
+    cmd.extend(str(a) for a in argv)
+    return subprocess.run(cmd, cwd=str(cwd), capture_output=True, text=True)
+
+
+class TestPlanApply:
+    """dot plan classifies without side effects; dot apply executes a saved plan"""
+
+    def _setup(self, tmp_path):
+        repo = tmp_path / "repo"
+        repo.mkdir()
+        for name in ("new", "ok", "moved", "blocked", "deep"):
+            (repo / name).write_text("# {}\n".format(name))
+        old = tmp_path / "old"
+        old.mkdir()
+        (old / "moved").write_text("# old\n")
+        home = tmp_path / "home"
+        home.mkdir()
+        (home / ".ok").symlink_to(repo / "ok")
+        (home / ".moved").symlink_to(old / "moved")
+        (home / ".blocked").write_text("# a real file\n")
+        links = {
+            str(home / ".new"): "new",
+            str(home / ".ok"): "ok",
+            str(home / ".moved"): "moved",
+            str(home / ".blocked"): "blocked",
+            str(home / ".config" / "deep"): "deep",
+        }
+        config_file = repo / "dotfiles.json"
+        config_file.write_text(json.dumps({"links": links}))
+        return repo, home, config_file
+
+    def test_plan_classifies_every_entry_without_changes(self, tmp_path):
+        repo, home, config_file = self._setup(tmp_path)
+
+        result = _run_dot_cmd(tmp_path, "--config", config_file, "plan")
+
+        assert result.returncode == 0, result.stdout + result.stderr
+        plan = json.loads(result.stdout)
+        actions = {os.path.basename(e["target"]): e["action"] for e in plan["entries"]}
+        assert actions == {
+            ".new": "create",
+            ".ok": "already-correct",
+            ".moved": "repoint",
+            ".blocked": "conflict",
+            "deep": "missing-parent",
+        }
+        assert not (home / ".new").exists()
+        assert not (home / ".config").exists()
+
+    def test_apply_executes_saved_plan(self, tmp_path):
+        repo, home, config_file = self._setup(tmp_path)
+        (home / ".blocked").unlink()
+        plan_file = tmp_path / "plan.json"
+        _run_dot_cmd(tmp_path, "--config", config_file, "plan", "-o", plan_file)
+
+        result = _run_dot_cmd(tmp_path, "apply", plan_file, "--yes", "--force-relink")
+
+        assert result.returncode == 0, result.stdout + result.stderr
+        for name in (".new", ".moved", ".blocked"):
+            assert os.path.realpath(str(home / name)) == str(repo / name[1:])
+        assert os.path.realpath(str(home / ".config" / "deep")) == str(repo / "deep")
+        assert "Summary: 3 created, 1 unchanged, 1 repointed" in result.stdout
+
+    def test_apply_skips_targets_changed_since_plan(self, tmp_path):
+        repo, home, config_file = self._setup(tmp_path)
+        (home / ".blocked").unlink()
+        plan_file = tmp_path / "plan.json"
+        _run_dot_cmd(tmp_path, "--config", config_file, "plan", "-o", plan_file)
+        (home / ".new").write_text("# appeared after planning\n")
+
+        result = _run_dot_cmd(tmp_path, "apply", plan_file, "--yes")
+
+        assert result.returncode == 1
+        assert "changed since the plan was made" in result.stdout
+        assert (home / ".new").read_text() == "# appeared after planning\n"
+        assert os.path.realpath(str(home / ".config" / "deep")) == str(repo / "deep")
+
+    def test_plan_entries_are_compact_records(self, tmp_path):
+        repo, home, config_file = self._setup(tmp_path)
+        links = {
+            str(home / ".ok"): str(repo / "ok"),
+            str(home / ".new"): str(repo / "new"),
+        }
+        fs = dot._FsCache()
+
+        entries = dot._plan_links(links, fs, {str(home / ".ok"): "base"})
+
+        assert not hasattr(entries[0], "__dict__")
+        assert isinstance(fs.lstat(str(home / ".ok")), dot._StatInfo)
+        saved = [e.as_json() for e in entries]
+        assert saved[0]["layer"] == "base" and "layer" not in saved[1]
+        assert saved[0]["state"] == {"type": "link", "link": str(repo / "ok")}
+        loaded = [dot._PlanEntry.from_json(json.loads(json.dumps(e))) for e in saved]
+        assert [e.as_json() for e in loaded] == saved
+
+
+class TestStateIndex:
+    """A converged link run records ~/.dot/state; unchanged reruns skip all work"""
+
+    def _setup(self, tmp_path):
+        repo = tmp_path / "repo"
+        (repo / "tools").mkdir(parents=True)
+        (repo / "tools" / "one.sh").write_text("# one\n")
+        (repo / "bashrc").write_text("# bashrc\n")
+        home = tmp_path / "home"
+        home.mkdir()
+        config_file = repo / "dotfiles.json"
+        config_file.write_text(
+            json.dumps(
+                {
+                    "links": {
+                        str(home / ".bashrc"): "bashrc",
+                        str(home / "tools") + "/": "tools/*",
+                    }
+                }
+            )
+        )
+        return repo, home, config_file
+
+    def test_noop_rerun_does_not_touch_targets(self, tmp_path, state_dir):
+        repo, home, config_file = self._setup(tmp_path)
+        assert _run_dot(config_file, tmp_path).returncode == 0
+        assert len(list(state_dir.glob("link-*.json"))) == 1
+        before = os.lstat(str(home / ".bashrc"))
+
+        result = _run_dot(config_file, tmp_path)
+
+        assert result.returncode == 0, result.stdout + result.stderr
+        assert "nothing changed" in result.stdout
+        assert os.lstat(str(home / ".bashrc")).st_ino == before.st_ino
+
+        result = _run_dot(config_file, tmp_path, "--verify")
+
+        assert "nothing changed" not in result.stdout
+        assert "0 created, 2 unchanged" in result.stdout
+
+    def test_link_removed_by_hand_triggers_full_run(self, tmp_path):
+        repo, home, config_file = self._setup(tmp_path)
+        assert _run_dot(config_file, tmp_path).returncode == 0
+        (home / ".bashrc").unlink()
+        # mtime granularity can be coarse; make the change visible
+        stamp = os.stat(str(home)).st_mtime + 5
+        os.utime(str(home), (stamp, stamp))
+
+        result = _run_dot(config_file, tmp_path)
+
+        assert result.returncode == 0, result.stdout + result.stderr
+        assert "nothing changed" not in result.stdout
+        assert (home / ".bashrc").is_symlink()
+
+    def test_new_file_in_globbed_dir_triggers_full_run(self, tmp_path):
+        repo, home, config_file = self._setup(tmp_path)
+        assert _run_dot(config_file, tmp_path).returncode == 0
+        (repo / "tools" / "two.sh").write_text("# two\n")
+        # mtime granularity can be coarse; make the change visible
+        stamp = os.stat(str(repo / "tools")).st_mtime + 5
+        os.utime(str(repo / "tools"), (stamp, stamp))
+
+        result = _run_dot(config_file, tmp_path)
+
+        assert "nothing changed" not in result.stdout
+        assert (home / "tools" / "two.sh").is_symlink()
+
+    def test_manifest_edit_triggers_full_run(self, tmp_path):
+        repo, home, config_file = self._setup(tmp_path)
+        assert _run_dot(config_file, tmp_path).returncode == 0
+        config = json.loads(config_file.read_text())
+        config["links"][str(home / ".profile")] = "bashrc"
+        config_file.write_text(json.dumps(config))
+
+        result = _run_dot(config_file, tmp_path)
+
+        assert "nothing changed" not in result.stdout
+        assert (home / ".profile").is_symlink()
+
+    def test_run_with_skipped_links_is_not_recorded(self, tmp_path, state_dir):
+        repo, home, config_file = self._setup(tmp_path)
+        (home / ".bashrc").symlink_to(tmp_path)
+
+        _run_dot(config_file, tmp_path)
+
+        assert not list(state_dir.glob("link-*.json"))
+
+
+class TestLayeredManifests:
+    """Several --config files (or --extensions-dir) merge in one process"""
+
+    def _layer(self, root, name, links):
+        layer = root / name
+        (layer / "payload").mkdir(parents=True)
+        for source in set(links.values()):
+            (layer / source).write_text("# {} {}\n".format(name, source))
+        (layer / "dotfiles.json").write_text(json.dumps({"links": links}))
+        return layer
+
+    def test_last_layer_wins_without_creating_the_overridden_link(self, tmp_path):
+        home = tmp_path / "home"
+        home.mkdir()
+        host = self._layer(tmp_path, "host", {str(home / ".rc"): "payload/rc"})
+        ext = self._layer(tmp_path, "ext", {str(home / ".rc"): "payload/rc"})
+
+        result = _run_dot_cmd(
+            tmp_path,
+            "--config",
+            host / "dotfiles.json",
+            "--config",
+            ext / "dotfiles.json",
+            "link",
+            "--yes",
+        )
+
+        assert result.returncode == 0, result.stdout + result.stderr
+        assert os.path.realpath(str(home / ".rc")) == str(ext / "payload" / "rc")
+        assert str(host) not in result.stdout
+        assert "Repointing" not in result.stdout
+
+    def test_failing_layer_does_not_block_the_others(self, tmp_path):
+        home = tmp_path / "home"
+        home.mkdir()
+        (home / ".blocked").write_text("# a real file\n")
+        exts = tmp_path / "extensions"
+        self._layer(exts, "10-bad", {str(home / ".bad"): "payload/missing"})
+        (exts / "10-bad" / "payload" / "missing").unlink()
+        self._layer(exts, "20-good", {str(home / ".good"): "payload/rc"})
+        self._layer(exts, "30-conflict", {str(home / ".blocked"): "payload/rc"})
+
+        result = _run_dot_cmd(
+            tmp_path, "--extensions-dir", exts, "link", "--yes", "--force-relink"
+        )
+
+        assert result.returncode == 1
+        assert (home / ".good").is_symlink()
+        assert not (home / ".bad").exists()
+        assert (home / ".blocked").read_text() == "# a real file\n"
+        assert "failed layer(s): 10-bad 30-conflict" in result.stderr
+
+
+class TestStartup:
+    """dot runs from shell startup: import + dispatch must stay cheap"""
+
+    def test_noop_link_is_fast_and_skips_optional_imports(self, tmp_path):
+        (tmp_path / "rc").write_text("# rc\n")
+        config_file = tmp_path / "dotfiles.json"
+        config_file.write_text(
+            json.dumps({"home": "~", "links": {str(tmp_path / ".rc"): "rc"}})
+        )
+        assert _run_dot(config_file, tmp_path).returncode == 0
+        root = os.path.join(os.path.dirname(__file__), "..")
+        script = "\n".join(
+            [
+                "import json, sys, time",
+                "t0 = time.perf_counter()",
+                "sys.path.insert(0, {!r})".format(root),
+                "import dot",
+                "dot.main(['--config', {!r}, 'link', '--yes'])".format(
+                    str(config_file)
+                ),
+                "elapsed = time.perf_counter() - t0",
+                "print(json.dumps([elapsed, sorted(sys.modules)]))",
+            ]
+        )
+
+        result = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True
+        )
+
+        assert result.returncode == 0, result.stdout + result.stderr
+        assert "nothing changed" in result.stdout
+        elapsed, modules = json.loads(result.stdout.splitlines()[-1])
+        assert not {"yaml", "glob", "concurrent.futures"} & set(modules)
+        # generous bound for slow CI runners; typical is ~10ms
+        assert elapsed < 0.5
+
+    def test_help_still_lists_every_command(self, tmp_path):
+        result = _run_dot_cmd(tmp_path, "--help")
+
+        for command in dot._COMMANDS:
+            assert command in result.stdout
+        result = _run_dot_cmd(tmp_path, "plan", "--help")
+        assert "--output" in result.stdout
+
+
+@pytest.mark.skipif(dot.yaml is None, reason="PyYAML not installed")
+class TestConfigCache:
+    """YAML manifests are compiled once into the state dir"""
+
+    def test_cache_hit_skips_pyyaml(self, sample_yaml_config, monkeypatch):
+        first = dot.load_config(sample_yaml_config)
+        monkeypatch.setattr(dot, "yaml", None)
+
+        assert dot.load_config(sample_yaml_config) == first
+
+    def test_edit_invalidates_cache(self, sample_yaml_config):
+        dot.load_config(sample_yaml_config)
+        with open(sample_yaml_config, "a") as f:
+            f.write("    ~/.extrarc: test/extrarc\n")
+
+        config = dot.load_config(sample_yaml_config)
+
+        assert config["links"]["~/.extrarc"] == "test/extrarc"
+
+    def test_corrupt_cache_is_reparsed(self, sample_yaml_config, state_dir):
+        expected = dot.load_config(sample_yaml_config)
+        for entry in (state_dir / "config-cache").iterdir():
+            entry.write_text("{not json")
+
+        assert dot.load_config(sample_yaml_config) == expected
+
+    def test_invalid_shape_is_rejected(self, temp_dir):
+        config_file = temp_dir / "dotfiles.yaml"
+        config_file.write_text("links:\n  ~/.rc: {a: b}\n")
+
+        with pytest.raises(dot.DotError, match="must be a string"):
+            dot._load_config(str(config_file))
+        assert not os.path.exists(
+            os.path.join(os.environ["DOTFILES_STATE_DIR"], "config-cache")
+        )
+
+    def test_null_target_resolves_the_same_every_run(self, temp_dir):
+        (temp_dir / "tmux").mkdir()
+        (temp_dir / "tmux" / "a.conf").write_text("")
+        home = temp_dir / "home"
+        home.mkdir()
+        config_file = temp_dir / "dotfiles.yaml"
+        config_file.write_text("home: {}\nlinks:\n  ~: tmux/*\n".format(home))
+
+        resolved = []
+        for _ in range(2):
+            config = dot.load_config(str(config_file))
+            resolved.append(
+                dot._resolve_all_links(config["links"], config, str(temp_dir))
+            )
+
+        assert resolved[0] == resolved[1]
+        assert list(resolved[0]) == [str(home / "a.conf")]
+
+
+class TestGlobEngine:
+    """Sources are matched with cached scandir listings, not glob.glob"""
+
+    @pytest.fixture
+    def tree(self, tmp_path):
+        for rel in [
+            "vim/vimrc",
+            "vim/.netrwhist",
+            "vim/vimrc.swp",
+            "vim/colors/dark.vim",
+            "vim/pack/a/start/plug.vim",
+            "vim/.git/config.vim",
+        ]:
+            path = tmp_path / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(rel)
+        return tmp_path
+
+    def test_matches_glob_glob(self, tree):
+        import glob
+
+        for pattern in ["vim/*", "vim/.*", "vim/*/*.vim", "vim/[cp]*", "vim/?imrc"]:
+            expected = sorted(glob.glob(str(tree / pattern)))
+            assert dot._resolve_source(pattern, str(tree)) == expected
+
+    def test_works_without_scandir(self, tree, monkeypatch):
+        patterns = ["vim/*", "vim/**/*.vim", ["vim/*", "!*.swp"]]
+        expected = [dot._resolve_source(p, str(tree)) for p in patterns]
+        os.symlink(str(tree / "vim" / "vimrc"), str(tree / "link"))
+        monkeypatch.delattr(os, "scandir")  # as on Python 2
+        monkeypatch.setattr(dot, "_SCANDIR_FD", False)
+
+        assert [dot._resolve_source(p, str(tree)) for p in patterns] == expected
+        items = [(str(tree / n), str(tree / "vim" / "vimrc")) for n in ("link", "vim")]
+        assert dot._check_parent(str(tree), items) == {
+            str(tree / "vim"): dot.STATUS_BLOCKED
+        }
+
+    def test_plain_path_stays_a_string(self, tree):
+        assert dot._resolve_source("vim/vimrc", str(tree)) == str(tree / "vim/vimrc")
+        assert dot._resolve_source(["vim/vimrc"], str(tree)) == [
+            str(tree / "vim/vimrc")
+        ]
+
+    def test_double_star_recurses_without_hidden_dirs(self, tree):
+        result = dot._resolve_source("vim/**/*.vim", str(tree))
+
+        assert [os.path.basename(p) for p in result] == ["dark.vim", "plug.vim"]
+
+    def test_exclusions(self, tree):
+        result = dot._resolve_source(
+            ["vim/*", "vim/.*", "!*.swp", "!vim/colors"], str(tree)
+        )
+
+        assert [os.path.basename(p) for p in result] == [
+            ".git",
+            ".netrwhist",
+            "pack",
+            "vimrc",
+        ]
+
+    def test_excluded_dir_is_pruned(self, tree, monkeypatch):
+        listed = []
+        scandir = os.scandir
+        monkeypatch.setattr(os, "scandir", lambda p: listed.append(p) or scandir(p))
+
+        dot._resolve_source(["vim/**", "!pack"], str(tree))
+
+        assert str(tree / "vim" / "pack") not in listed
+
+    def test_each_directory_listed_once_per_run(self, tree, monkeypatch):
+        listed = []
+        scandir = os.scandir
+        monkeypatch.setattr(os, "scandir", lambda p: listed.append(p) or scandir(p))
+        fs = dot._FsCache()
+
+        dot._resolve_source("vim/*", str(tree), fs)
+        dot._resolve_source("vim/.*", str(tree), fs)
+
+        assert listed == [str(tree / "vim")]
+        assert str(tree / "vim") in fs.glob_dirs
+
+    def test_basename_clash_is_an_error(self, tree):
+        (tree / "vim" / "colors" / "plug.vim").write_text("clash")
+
+        with pytest.raises(dot.DotError, match="plug.vim"):
+            dot._resolve_source("vim/**/*.vim", str(tree))
+
+
+class TestBenchmarkHarness:
+    """tests/bench_dot.py must keep working as dot.py changes"""
+
+    def test_run_and_compare_at_tiny_scale(self, tmp_path):
+        bench = os.path.join(os.path.dirname(__file__), "bench_dot.py")
+        report = tmp_path / "report.json"
+
+        subprocess.run(
+            [sys.executable, bench, "run", "--scales", "20", "-o", str(report)],
+            check=True,
+            capture_output=True,
+        )
+        compared = subprocess.run(
+            [sys.executable, bench, "compare", str(report), str(report)],
+            capture_output=True,
+            text=True,
+        )
+
+        results = json.loads(report.read_text())["results"]
+        assert {r["op"] for r in results} == {
+            "resolve",
+            "link-cold",
+            "link-warm",
+            "link-verify",
+            "relink",
+            "unlink",
+            "link-jobs",
+        }
+        warm = [r for r in results if r["op"] == "link-warm"]
+        cold = [r for r in results if r["op"] == "link-cold"]
+        assert sum(r["syscalls"]["symlink"] for r in cold) > 0
+        assert all(r["syscalls"]["symlink"] == 0 for r in warm)
+        assert compared.returncode == 0
+        assert "1.00x" in compared.stdout
+
+
+class TestStats:
+    """--stats and --profile explain where a run spends its time"""
+
+    @pytest.fixture
+    def config_file(self, tmp_path):
+        (tmp_path / "rc").write_text("# rc\n")
+        config_file = tmp_path / "dotfiles.json"
+        config_file.write_text(
+            json.dumps({"home": "~", "links": {str(tmp_path / ".rc"): "rc"}})
+        )
+        return config_file
+
+    def test_stats_reports_phases_and_calls(self, config_file, tmp_path):
+        result = _run_dot_cmd(
+            tmp_path, "--config", str(config_file), "--stats", "link", "--yes"
+        )
+
+        assert result.returncode == 0, result.stderr
+        rows = dict(
+            (line.split()[0], line.split()[1:]) for line in result.stderr.splitlines()
+        )
+        header = rows["phase"]
+        # a non-interactive link streams: resolve/plan/apply count as apply
+        for phase in ("config", "apply", "total"):
+            assert phase in rows
+        assert rows["apply"][header.index("symlink")] == "1"
+        assert not result.stdout.startswith("phase")
+        assert "\nphase " not in result.stdout
+
+    def test_stats_restores_os_functions(self, config_file, capsys):
+        lstat = os.lstat
+
+        dot.main(["--config", str(config_file), "--stats", "link", "--yes"])
+
+        assert os.lstat is lstat
+        assert dot._STATS is None
+        assert "symlink" in capsys.readouterr().err
+
+    def test_profile_writes_pstats_and_tracemalloc(self, config_file, tmp_path):
+        import pstats
+
+        profile = tmp_path / "run.prof"
+        result = _run_dot_cmd(
+            tmp_path,
+            "--config",
+            str(config_file),
+            "--profile",
+            str(profile),
+            "link",
+            "--yes",
+        )
+
+        assert result.returncode == 0, result.stderr
+        functions = [f[2] for f in pstats.Stats(str(profile)).stats]
+        assert "cmd_link" in functions
+        assert "peak" in (tmp_path / "run.prof.tracemalloc").read_text()
+
+    def test_stats_and_profile_without_scandir_or_tracemalloc(
+        self, config_file, tmp_path, monkeypatch, capsys
+    ):
+        monkeypatch.delattr(os, "scandir")  # as on Python 2
+        monkeypatch.setattr(dot, "_SCANDIR_FD", False)
+        monkeypatch.setitem(sys.modules, "tracemalloc", None)
+        profile = tmp_path / "run.prof"
+
+        dot.main(
+            [
+                "--config",
+                str(config_file),
+                "--stats",
+                "--profile",
+                str(profile),
+                "link",
+                "--yes",
+            ]
+        )
+
+        assert not hasattr(os, "scandir")
+        assert "symlink" in capsys.readouterr().err
+        assert profile.exists()
+        assert not (tmp_path / "run.prof.tracemalloc").exists()
+
+
+class TestStatus:
+    """`dot status` checks every link read-only; the exit code is the verdict"""
+
+    @pytest.fixture
+    def repo(self, tmp_path):
+        for name in ("a", "b", "c", "d", "e"):
+            (tmp_path / "src" / name).parent.mkdir(exist_ok=True)
+            (tmp_path / "src" / name).write_text(name)
+        home = tmp_path / "home"
+        home.mkdir()
+        config_file = tmp_path / "dotfiles.json"
+        config_file.write_text(
+            json.dumps(
+                {
+                    "home": str(home),
+                    "links": dict((str(home / ("." + n)), "src/" + n) for n in "abcde"),
+                }
+            )
+        )
+        return tmp_path, home, config_file
+
+    def _status(self, tmp_path, config_file, *argv):
+        return _run_dot_cmd(tmp_path, "--config", str(config_file), "status", *argv)
+
+    def test_every_status_and_exit_code(self, repo):
+        tmp_path, home, config_file = repo
+        assert self._status(tmp_path, config_file).returncode == 3
+        assert _run_dot(config_file, tmp_path).returncode == 0
+        assert self._status(tmp_path, config_file).returncode == 0
+
+        (home / ".a").unlink()
+        (home / ".b").unlink()
+        (home / ".b").symlink_to(tmp_path / "src" / "c")
+        (home / ".c").unlink()
+        (home / ".c").symlink_to(tmp_path / "gone")
+        result = self._status(tmp_path, config_file, "--json")
+
+        assert result.returncode == 3
+        statuses = dict(
+            (os.path.basename(e["target"]), e["status"])
+            for e in json.loads(result.stdout)["entries"]
+        )
+        assert statuses == {
+            ".a": "missing",
+            ".b": "wrong-target",
+            ".c": "dangling",
+            ".d": "correct",
+            ".e": "correct",
+        }
+
+        (home / ".d").unlink()
+        (home / ".d").write_text("mine")
+        result = self._status(tmp_path, config_file, "--jobs", "1")
+        assert result.returncode == 4
+        assert "blocked-by-file" in result.stdout
+
+    def test_checks_serially_without_concurrent_futures(self, tmp_path, monkeypatch):
+        (tmp_path / "a").mkdir()
+        (tmp_path / "b").mkdir()
+        (tmp_path / "b" / "rc").write_text("mine")
+        links = {
+            str(tmp_path / "a" / "rc"): str(tmp_path / "src"),
+            str(tmp_path / "b" / "rc"): str(tmp_path / "src"),
+        }
+        monkeypatch.setitem(sys.modules, "concurrent.futures", None)  # as on 2.7
+
+        assert dot._check_links(links, 8) == {
+            str(tmp_path / "a" / "rc"): dot.STATUS_MISSING,
+            str(tmp_path / "b" / "rc"): dot.STATUS_BLOCKED,
+        }
+
+    def test_quick_rechecks_only_changed_directories(self, repo):
+        tmp_path, home, config_file = repo
+        assert _run_dot(config_file, tmp_path).returncode == 0
+        assert "(quick)" in self._status(tmp_path, config_file, "--quick").stdout
+
+        (home / ".e").unlink()
+        result = self._status(tmp_path, config_file, "--quick")
+
+        assert result.returncode == 3
+        assert "missing" in result.stdout and "(quick)" in result.stdout
+
+    def test_quick_without_index_does_a_full_check(self, repo):
+        tmp_path, home, config_file = repo
+
+        result = self._status(tmp_path, config_file, "--quick")
+
+        assert result.returncode == 3
+        assert "5 missing" in result.stdout and "(quick)" not in result.stdout
+
+
+class TestJournal:
+    """unlink works from the journal of what link created"""
+
+    @pytest.fixture
+    def repo(self, tmp_path):
+        (tmp_path / "src").mkdir()
+        for name in ("a", "b"):
+            (tmp_path / "src" / name).write_text(name)
+        home = tmp_path / "home"
+        home.mkdir()
+        config_file = tmp_path / "dotfiles.json"
+        config_file.write_text(
+            json.dumps(
+                {
+                    "home": str(home),
+                    "links": {
+                        str(home / ".config" / "deep" / "a"): "src/a",
+                        str(home / ".b"): "src/b",
+                        str(home / ".all"): "src/*",
+                    },
+                }
+            )
+        )
+        assert _run_dot(config_file, tmp_path).returncode == 0
+        return tmp_path, home, config_file
+
+    def _unlink(self, tmp_path, config_file):
+        return _run_dot_cmd(tmp_path, "--config", str(config_file), "unlink", "--yes")
+
+    def test_each_home_dir_keeps_its_own_journal(self, tmp_path):
+        (tmp_path / "src").mkdir()
+        (tmp_path / "src" / "rc").write_text("rc")
+        config_file = tmp_path / "dotfiles.json"
+        config_file.write_text(json.dumps({"links": {"": "src/*"}}))
+        for home in ("h1", "h2"):
+            (tmp_path / home).mkdir()
+            result = _run_dot_cmd(
+                tmp_path,
+                "--config",
+                config_file,
+                "--home-dir",
+                tmp_path / home,
+                "link",
+                "--yes",
+            )
+            assert result.returncode == 0, result.stderr
+
+        result = _run_dot_cmd(
+            tmp_path,
+            "--config",
+            config_file,
+            "--home-dir",
+            tmp_path / "h2",
+            "unlink",
+            "--yes",
+        )
+
+        assert result.returncode == 0, result.stderr
+        assert not (tmp_path / "h2" / "rc").exists()
+        assert (tmp_path / "h1" / "rc").is_symlink()
+
+    def test_unlink_survives_a_deleted_source(self, repo, state_dir):
+        tmp_path, home, config_file = repo
+        (tmp_path / "src" / "a").unlink()
+
+        result = self._unlink(tmp_path, config_file)
+
+        assert result.returncode == 0, result.stderr
+        assert list(home.iterdir()) == []  # links and the dirs dot made
+        assert not list(state_dir.glob("journal-*"))
+
+    def test_unlink_leaves_links_it_did_not_make(self, repo, state_dir):
+        tmp_path, home, config_file = repo
+        (home / ".b").unlink()
+        (home / ".b").symlink_to(tmp_path / "src" / "a")
+        (home / ".config" / "mine").write_text("keep")
+
+        result = self._unlink(tmp_path, config_file)
+
+        assert "no longer the symlink dot made" in result.stdout
+        assert (home / ".b").is_symlink()
+        assert (home / ".config" / "mine").exists()
+        assert not (home / ".config" / "deep").exists()
+        # the kept directory stays journaled for the next unlink
+        journal = next(state_dir.glob("journal-*")).read_text()
+        assert str(home / ".config") in journal and ".b" not in journal
+
+    def test_link_after_unlink_recreates_everything(self, repo):
+        tmp_path, home, config_file = repo
+        assert self._unlink(tmp_path, config_file).returncode == 0
+
+        result = _run_dot(config_file, tmp_path)
+
+        assert "4 created" in result.stdout
+        assert (home / ".config" / "deep" / "a").is_symlink()
+
+    def test_torn_journal_line_is_ignored(self, repo, state_dir):
+        tmp_path, home, config_file = repo
+        journal = str(next(state_dir.glob("journal-*")))
+        with open(journal, "a") as f:
+            f.write('{"op": "link", "tar')
+        extra = str(home / ".extra")
+        os.symlink(str(tmp_path / "src" / "a"), extra)
+
+        dot._append_journal(journal, [("link", extra, str(tmp_path / "src" / "a"))])
+
+        assert extra in dot._read_journal(journal)[0]
+        assert self._unlink(tmp_path, config_file).returncode == 0
+        assert list(home.iterdir()) == []
+
+    def test_link_inside_a_dir_link_is_removed_first(self, tmp_path):
+        (tmp_path / "src" / "pkg").mkdir(parents=True)
+        (tmp_path / "src" / "a").write_text("a")
+        home = tmp_path / "home"
+        home.mkdir()
+        config_file = tmp_path / "dotfiles.json"
+        links = {
+            str(home / ".pkg"): "src/pkg",
+            str(home / ".pkg" / "inner"): "src/a",
+            str(home / ".z"): "src/a",  # groups ~/.pkg's parent after .pkg/inner
+        }
+        config_file.write_text(json.dumps({"links": links}))
+        assert _run_dot(config_file, tmp_path).returncode == 0
+
+        result = self._unlink(tmp_path, config_file)
+
+        assert result.returncode == 0, result.stderr
+        assert list(home.iterdir()) == []
+        assert not (tmp_path / "src" / "pkg" / "inner").exists()
+
+
+class TestWatch:
+    """`dot watch` relinks only what changed behind a glob"""
+
+    def _watch(self, tmp_path, monkeypatch, changes, *argv):
+        """Run watch in-process; changes[i] runs during the i-th sleep."""
+        import time
+
+        sleeps = []
+
+        def fake_sleep(seconds):
+            if len(sleeps) < len(changes):
+                changes[len(sleeps)]()
+            sleeps.append(seconds)
+
+        monkeypatch.setattr(time, "sleep", fake_sleep)
+        dot.main(["--config", str(tmp_path / "dotfiles.json"), "watch"] + list(argv))
+        return sleeps
+
+    @pytest.fixture
+    def repo(self, tmp_path):
+        (tmp_path / "src").mkdir()
+        (tmp_path / "src" / "a").write_text("a")
+        (tmp_path / "rc").write_text("rc")
+        home = tmp_path / "home"
+        home.mkdir()
+        (tmp_path / "dotfiles.json").write_text(
+            json.dumps(
+                {
+                    "home": str(home),
+                    "links": {str(home / ".g"): "src/*", str(home / ".rc"): "rc"},
+                }
+            )
+        )
+        return tmp_path, home
+
+    def test_new_and_removed_files_are_synced(self, repo, monkeypatch, capsys):
+        tmp_path, home = repo
+        changes = [
+            lambda: (tmp_path / "src" / "b").write_text("b"),
+            lambda: (tmp_path / "src" / "a").unlink(),
+        ]
+
+        self._watch(tmp_path, monkeypatch, changes, "--polls", "3")
+
+        assert sorted(os.listdir(str(home / ".g"))) == ["b"]
+        assert (home / ".rc").is_symlink()
+        out = capsys.readouterr().out
+        assert "Removed symlink: {}".format(home / ".g" / "a") in out
+        assert out.count("Created symlink") == 3  # a, rc, then b
+
+    def test_interval_backs_off_when_idle(self, repo, monkeypatch):
+        tmp_path, home = repo
+        nothing = lambda: None  # noqa: E731
+        changes = [nothing, nothing, nothing, lambda: (tmp_path / "src" / "b").touch()]
+
+        sleeps = self._watch(
+            tmp_path,
+            monkeypatch,
+            changes,
+            "--interval",
+            "2",
+            "--max-interval",
+            "5",
+            "--polls",
+            "6",
+        )
+
+        assert sleeps == [2, 3, 4.5, 5, 2, 3]
+        assert (home / ".g" / "b").is_symlink()
+
+    def test_manifest_edit_reloads(self, repo, monkeypatch):
+        tmp_path, home = repo
+        config_file = tmp_path / "dotfiles.json"
+
+        def drop_glob():
+            config = json.loads(config_file.read_text())
+            del config["links"][str(home / ".g")]
+            config_file.write_text(json.dumps(config))
+            os.utime(str(config_file), (1, 1))
+
+        self._watch(tmp_path, monkeypatch, [drop_glob], "--polls", "1")
+
+        assert not (home / ".g" / "a").exists()
+        assert (home / ".rc").is_symlink()
+
+
+class TestParentPlanner:
+    """Missing parent dirs are created once, up front, with one prompt"""
+
+    def _entries(self, tmp_path, n=50):
+        src = tmp_path / "src"
+        src.mkdir()
+        (src / "rc").write_text("rc")
+        (src / "pkg").mkdir()
+        home = tmp_path / "home"
+        home.mkdir()
+        links = {}
+        for i in range(n):
+            target = home / ".config" / "app{}".format(i % 5) / "f{}".format(i)
+            links[str(target)] = str(src / "rc")
+        # a managed dir link, and a link inside it: .pkg must not be mkdir'd
+        links[str(home / ".pkg")] = str(src / "pkg")
+        links[str(home / ".pkg" / "extra")] = str(src / "rc")
+        fs = dot._FsCache()
+        return dot._plan_links(dict(sorted(links.items())), fs), fs, home
+
+    def test_each_parent_is_statted_and_created_once(self, tmp_path, monkeypatch):
+        entries, fs, home = self._entries(tmp_path)
+        stats, mkdirs = [], []
+        real_stat, real_mkdir = os.stat, os.mkdir
+        # full paths, not names relative to an open parent
+        monkeypatch.setattr(dot, "_DIR_FD_SUPPORTED", False)
+        monkeypatch.setattr(
+            os, "stat", lambda p, *a, **k: stats.append(p) or real_stat(p, *a, **k)
+        )
+        monkeypatch.setattr(
+            os, "mkdir", lambda p, *a: mkdirs.append(p) or real_mkdir(p, *a)
+        )
+        args = type(
+            "Args", (), {"no_confirm": True, "yes": True, "force_relink": False}
+        )
+
+        outcomes = dot._apply_plan(entries, args, fs, strict=False)
+
+        assert outcomes.count(dot.LINK_CREATED) == 52
+        assert len(stats) == len(set(stats))
+        assert mkdirs == [str(home / ".config")] + [
+            str(home / ".config" / "app{}".format(i)) for i in range(5)
+        ]
+        assert ("mkdir", str(home / ".config")) in fs.journal
+
+    def test_one_batched_prompt_and_decline_skips(self, tmp_path, monkeypatch):
+        entries, fs, home = self._entries(tmp_path, n=10)
+        prompts = []
+
+        def fake_confirm(prompt, default=False):
+            prompts.append(prompt)
+            return "parent dir" not in prompt
+
+        monkeypatch.setattr(dot, "confirm", fake_confirm)
+        args = type(
+            "Args", (), {"no_confirm": False, "yes": False, "force_relink": False}
+        )
+
+        outcomes = dot._apply_plan(entries, args, fs, strict=False)
+
+        assert sum("parent dir" in p for p in prompts) == 1
+        assert "6 missing parent dir(s)" in prompts[0]
+        assert outcomes.count(dot.LINK_SKIPPED) == 10
+        assert outcomes[-1] == dot.LINK_CREATED  # in entry order: .pkg/extra
+        assert outcomes.count(dot.LINK_CREATED) == 2  # .pkg and .pkg/extra
+        assert not (home / ".config").exists()
+
+
+class TestStreamingLink:
+    """A non-interactive link applies entries as they resolve"""
+
+    @pytest.fixture
+    def manifest(self, tmp_path):
+        for d in ("one", "two", "three"):
+            (tmp_path / "src" / d).mkdir(parents=True)
+            (tmp_path / "src" / d / "f").write_text(d)
+        home = tmp_path / "home"
+        home.mkdir()
+        links = dict(
+            (str(home / ("." + d)), "src/{}/*".format(d))
+            for d in ("one", "two", "three")
+        )
+        # a managed dir link with a link created inside it
+        (tmp_path / "src" / "pkg").mkdir()
+        links[str(home / ".dir")] = "src/pkg"
+        links[str(home / ".dir" / "inner")] = "src/two/f"
+        return tmp_path, home, links
+
+    def test_entries_resolve_lazily_in_parent_first_order(self, manifest, monkeypatch):
+        tmp_path, home, links = manifest
+        resolved = []
+        resolve_source = dot._resolve_source
+        monkeypatch.setattr(
+            dot,
+            "_resolve_source",
+            lambda source, *a: resolved.append(source) or resolve_source(source, *a),
+        )
+
+        links_iter = dot._iter_links(links, {"home": str(home)}, str(tmp_path))
+        first = next(links_iter)
+
+        assert first == (str(home / ".dir"), str(tmp_path / "src" / "pkg"))
+        assert resolved == ["src/pkg"]
+        rest = [target for target, _ in links_iter]
+        assert rest.index(str(home / ".dir" / "inner")) == 0
+
+    def test_first_link_is_created_before_last_source_resolves(
+        self, manifest, monkeypatch
+    ):
+        tmp_path, home, links = manifest
+        config_file = tmp_path / "dotfiles.json"
+        config_file.write_text(json.dumps({"home": str(home), "links": links}))
+        events = []
+        resolve_source, symlink = dot._resolve_source, os.symlink
+        monkeypatch.setattr(
+            dot,
+            "_resolve_source",
+            lambda *a: events.append("resolve") or resolve_source(*a),
+        )
+        monkeypatch.setattr(
+            os, "symlink", lambda *a, **k: events.append("symlink") or symlink(*a, **k)
+        )
+
+        dot.main(["--config", str(config_file), "link", "--yes"])
+
+        assert events.index("symlink") < len(events) - 1 - events[::-1].index("resolve")
+        assert (home / ".dir" / "inner").is_symlink()
+        assert (tmp_path / "src" / "pkg" / "inner").is_symlink()  # via the dir link
+        assert events.count("symlink") == 5
+
+
+class TestTargetTrie:
+    """Resolved targets are ordered, de-duplicated and checked by path component"""
+
+    @pytest.fixture
+    def repo(self, tmp_path):
+        for rel in ("config/nvim", "config/git", "other/nvim", "alt/git"):
+            (tmp_path / "src" / rel).mkdir(parents=True)
+        home = tmp_path / "home"
+        home.mkdir()
+        return tmp_path, home
+
+    def test_glob_match_colliding_with_explicit_target_names_both(self, repo):
+        tmp_path, home = repo
+        links = {
+            str(home / ".config"): "src/config/*",
+            str(home / ".config" / "nvim"): "src/other/nvim",
+        }
+
+        with pytest.raises(dot.DotError) as e:
+            dot._resolve_all_links(links, {"home": str(home)}, str(tmp_path))
+
+        message = str(e.value)
+        assert str(home / ".config" / "nvim") in message
+        assert str(tmp_path / "src" / "config" / "nvim") in message
+        assert str(tmp_path / "src" / "other" / "nvim") in message
+
+    def test_two_globs_colliding_in_one_dir_name_both(self, repo):
+        tmp_path, home = repo
+        links = {
+            str(home / ".config"): "src/config/*",
+            str(home / ".config") + "/": "src/alt/*",
+        }
+
+        with pytest.raises(dot.DotError, match="claimed by both"):
+            dot._resolve_all_links(links, {"home": str(home)}, str(tmp_path))
+
+    def test_same_target_and_source_twice_is_one_link(self, repo, monkeypatch):
+        tmp_path, home = repo
+        monkeypatch.setenv("HOME", str(home))
+        links = {
+            str(home / ".nvim"): "src/config/nvim",
+            "~/.nvim": "src/config/nvim",
+        }
+
+        resolved = dot._resolve_all_links(links, {"home": str(home)}, str(tmp_path))
+
+        assert list(resolved.items()) == [
+            (str(home / ".nvim"), str(tmp_path / "src" / "config" / "nvim"))
+        ]
+
+    def test_glob_matches_and_explicit_children_share_one_sorted_pass(self, repo):
+        tmp_path, home = repo
+        links = {
+            str(home / ".config" / "git" / "extra"): "src/alt/git",
+            str(home / ".config"): "src/config/*",
+            str(home / ".config" / "a"): "src/other/nvim",
+        }
+
+        resolved = dot._resolve_all_links(links, {"home": str(home)}, str(tmp_path))
+
+        assert [os.path.relpath(t, str(home)) for t in resolved] == [
+            ".config/a",
+            ".config/git",
+            ".config/git/extra",
+            ".config/nvim",
+        ]
+
+    def test_plan_marks_links_inside_managed_dir_links(self, repo):
+        tmp_path, home = repo
+        config_file = tmp_path / "dotfiles.json"
+        links = {
+            str(home / ".config"): "src/config",
+            str(home / ".config" / "deep" / "x"): "src/alt/git",
+            str(home / ".alt"): "src/alt/git",
+        }
+        config_file.write_text(json.dumps({"links": links}))
+
+        result = _run_dot_cmd(tmp_path, "--config", config_file, "plan")
+
+        assert result.returncode == 0, result.stdout + result.stderr
+        inside = dict(
+            (e["target"], e.get("inside")) for e in json.loads(result.stdout)["entries"]
+        )
+        assert inside == {
+            str(home / ".alt"): None,
+            str(home / ".config"): None,
+            str(home / ".config" / "deep" / "x"): str(home / ".config"),
+        }
+
+
+class TestMemo:
+    """Expanded paths, realpaths and globs are memoized per run, bounded"""
+
+    def test_memo_drops_oldest_entries_beyond_its_size(self):
+        memo = dot._Memo("test", size=2)
+        for key in "abc":
+            memo[key] = key.upper()
+
+        assert len(memo) == 2
+        with pytest.raises(KeyError):
+            memo["a"]
+        assert memo["c"] == "C"
+        assert (memo.hits, memo.misses) == (1, 1)
+
+    def test_realpath_matches_os_through_symlinked_parents(self, tmp_path):
+        (tmp_path / "real" / "sub").mkdir(parents=True)
+        (tmp_path / "alias").symlink_to(tmp_path / "real")
+        (tmp_path / "real" / "sub" / "link").symlink_to("../sub")
+        fs = dot._FsCache()
+
+        for rel in ("alias/sub/file", "alias/sub/link/x", "alias", "missing/x"):
+            path = str(tmp_path / rel)
+            assert fs.realpath(path) == os.path.realpath(path)
+
+    def test_glob_memo_is_dropped_when_dot_changes_a_dir_below(self, tmp_path):
+        (tmp_path / "src" / "a").mkdir(parents=True)
+        pattern = str(tmp_path / "src" / "*" / "*")
+        fs = dot._FsCache()
+        assert fs.glob(pattern) == []
+
+        (tmp_path / "src" / "a" / "new").write_text("")
+        assert fs.glob(pattern) == []  # memoized
+        fs.invalidate(str(tmp_path / "src" / "a" / "new"))
+
+        assert fs.glob(pattern) == [str(tmp_path / "src" / "a" / "new")]
+
+    def test_stats_reports_memo_hit_rates(self, tmp_path):
+        (tmp_path / "vimrc").write_text("")
+        config_file = tmp_path / "dotfiles.json"
+        links = {str(tmp_path / ".vimrc"): "vimrc", str(tmp_path / "init.vim"): "vimrc"}
+        config_file.write_text(json.dumps({"links": links}))
+
+        result = _run_dot_cmd(tmp_path, "--config", config_file, "--stats", "plan")
+
+        assert result.returncode == 0, result.stderr
+        assert "memo expand: 1/2 hits (50.0%)" in result.stderr
+        assert "memo realpath:" in result.stderr
+
+
+class TestFleet:
+    """One resolution linked into many homes"""
+
+    @pytest.fixture
+    def repo(self, tmp_path):
+        (tmp_path / "src" / "conf").mkdir(parents=True)
+        (tmp_path / "src" / "rc").write_text("rc")
+        (tmp_path / "src" / "conf" / "x").write_text("x")
+        config_file = tmp_path / "dotfiles.json"
+        config_file.write_text(
+            json.dumps({"links": {"~/.rc": "src/rc", "~/.config/conf/": "src/conf/*"}})
+        )
+        homes = [tmp_path / "homes" / name for name in ("a", "b", "c")]
+        for home in homes:
+            home.mkdir(parents=True)
+        return tmp_path, config_file, homes
+
+    def _fleet(self, tmp_path, config_file, homes, *argv):
+        home_args = []
+        for home in homes:
+            home_args += ["--home-dir", home]
+        return _run_dot_cmd(
+            tmp_path, "--config", config_file, *(home_args + ["link"] + list(argv))
+        )
+
+    def test_links_every_home_in_worker_processes(self, repo):
+        tmp_path, config_file, homes = repo
+
+        result = self._fleet(tmp_path, config_file, homes, "--yes", "--workers", "2")
+
+        assert result.returncode == 0, result.stdout + result.stderr
+        for home in homes:
+            assert os.readlink(str(home / ".rc")) == str(tmp_path / "src" / "rc")
+            assert (home / ".config" / "conf" / "x").is_symlink()
+            assert "{}: Summary: 2 created".format(home) in result.stdout
+        assert "Fleet: 3 home(s) linked, 0 failed" in result.stdout
+
+    def test_a_failing_home_does_not_stop_the_others(self, repo):
+        tmp_path, config_file, homes = repo
+        (homes[1] / ".rc").write_text("a real file")
+
+        result = self._fleet(tmp_path, config_file, homes, "--yes")
+
+        assert result.returncode == 1
+        assert "already exists and is not a symlink" in result.stderr + result.stdout
+        assert "failed home(s): {}".format(homes[1]) in result.stderr
+        assert (homes[0] / ".rc").is_symlink() and (homes[2] / ".rc").is_symlink()
+        assert (homes[1] / ".config" / "conf" / "x").is_symlink()
+
+    def test_a_symlinked_home_is_not_outside_itself(self, repo, monkeypatch):
+        tmp_path, config_file, homes = repo
+        (tmp_path / "real-home").mkdir()
+        (tmp_path / "home").symlink_to(tmp_path / "real-home")
+        monkeypatch.setenv("HOME", str(tmp_path / "home"))
+
+        result = self._fleet(tmp_path, config_file, homes, "--yes", "--workers", "1")
+
+        assert result.returncode == 0, result.stdout + result.stderr
+        for home in homes:
+            assert os.readlink(str(home / ".rc")) == str(tmp_path / "src" / "rc")
+        assert not os.listdir(str(tmp_path / "real-home"))
+
+    def test_homes_from_a_file(self, repo):
+        tmp_path, config_file, homes = repo
+        listing = tmp_path / "homes.txt"
+        listing.write_text("# build users\n{}\n\n{}\n".format(homes[0], homes[2]))
+
+        result = _run_dot_cmd(
+            tmp_path,
+            "--config",
+            config_file,
+            "--homes-from",
+            listing,
+            "link",
+            "--no-confirm",
+        )
+
+        assert result.returncode == 0, result.stdout + result.stderr
+        assert (homes[2] / ".rc").is_symlink()
+        assert not (homes[1] / ".rc").exists()
+
+    def test_links_outside_the_home_are_refused(self, repo):
+        tmp_path, config_file, homes = repo
+        config_file.write_text(
+            json.dumps({"links": {str(tmp_path / "etc" / "rc"): "src/rc"}})
+        )
+
+        result = self._fleet(tmp_path, config_file, homes, "--yes")
+
+        assert result.returncode == 1
+        assert "cannot be applied per home" in result.stderr
+        assert not any((home / ".rc").exists() for home in homes)
+
+    def test_only_link_takes_several_homes(self, repo):
+        tmp_path, config_file, homes = repo
+
+        result = _run_dot_cmd(
+            tmp_path,
+            "--config",
+            config_file,
+            "--home-dir",
+            homes[0],
+            "--home-dir",
+            homes[1],
+            "status",
+        )
+
+        assert result.returncode == 1
+        assert "Only `dot link` accepts several homes" in result.stderr
+
+
+class TestExport:
+    """`dot export` streams the resolved links as a reproducible tar"""
+
+    @pytest.fixture
+    def repo(self, tmp_path):
+        (tmp_path / "src" / "pkg" / "sub").mkdir(parents=True)
+        (tmp_path / "src" / "rc").write_text("rc\n")
+        (tmp_path / "src" / "run.sh").write_text("#!/bin/sh\n")
+        (tmp_path / "src" / "run.sh").chmod(0o755)
+        (tmp_path / "src" / "pkg" / "sub" / "f").write_text("f\n")
+        (tmp_path / "src" / "pkg" / "alias").symlink_to("sub/f")
+        home = tmp_path / "home"
+        config_file = tmp_path / "dotfiles.json"
+        links = {
+            str(home / ".rc"): "src/rc",
+            str(home / ".local" / "bin" / "run"): "src/run.sh",
+            str(home / ".pkg"): "src/pkg",
+        }
+        config_file.write_text(json.dumps({"home": str(home), "links": links}))
+        return tmp_path, home, config_file
+
+    def _members(self, data):
+        import io
+        import tarfile
+
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            return [(m.name, m.type, m.linkname, m.mode) for m in tar]
+
+    def _export(self, tmp_path, config_file, *argv):
+        dot_path = os.path.join(os.path.dirname(__file__), "..", "dot.py")
+        cmd = [sys.executable, dot_path, "--config", str(config_file), "export"]
+        return subprocess.run(
+            cmd + list(argv), cwd=str(tmp_path), capture_output=True, check=True
+        ).stdout
+
+    def test_symlink_members_under_the_home_prefix(self, repo):
+        import tarfile
+
+        tmp_path, home, config_file = repo
+
+        members = self._members(
+            self._export(tmp_path, config_file, "--home-prefix", "home/u")
+        )
+
+        assert members == [
+            ("home/u/.local", tarfile.DIRTYPE, "", 0o755),
+            ("home/u/.local/bin", tarfile.DIRTYPE, "", 0o755),
+            (
+                "home/u/.local/bin/run",
+                tarfile.SYMTYPE,
+                str(tmp_path / "src" / "run.sh"),
+                0o777,
+            ),
+            ("home/u/.pkg", tarfile.SYMTYPE, str(tmp_path / "src" / "pkg"), 0o777),
+            ("home/u/.rc", tarfile.SYMTYPE, str(tmp_path / "src" / "rc"), 0o777),
+        ]
+        assert not home.exists()
+
+    def test_dereference_copies_files_and_directories(self, repo):
+        import io
+        import tarfile
+
+        tmp_path, home, config_file = repo
+
+        data = self._export(tmp_path, config_file, "--dereference", "--home-prefix", "")
+
+        assert [(name, mode) for name, _, _, mode in self._members(data)] == [
+            (".local", 0o755),
+            (".local/bin", 0o755),
+            (".local/bin/run", 0o755),
+            (".pkg", 0o755),
+            (".pkg/alias", 0o777),
+            (".pkg/sub", 0o755),
+            (".pkg/sub/f", 0o644),
+            (".rc", 0o644),
+        ]
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            assert tar.extractfile(".pkg/sub/f").read() == b"f\n"
+            assert tar.getmember(".pkg/alias").linkname == "sub/f"
+
+    def test_layers_ignore_local_targets_and_fail_if_one_is_broken(self, repo):
+        import tarfile
+
+        tmp_path, home, config_file = repo
+        home.mkdir()
+        (home / ".all").write_text("a local file, not in the image")
+        work = tmp_path / "work.json"
+        work.write_text(json.dumps({"links": {str(home / ".all"): "src/pkg/sub/*"}}))
+        broken = tmp_path / "broken.json"
+        broken.write_text("{not json")
+        dot_path = os.path.join(os.path.dirname(__file__), "..", "dot.py")
+        out = tmp_path / "out.tar"
+
+        result = subprocess.run(
+            [sys.executable, dot_path]
+            + ["--config", str(config_file), "--config", str(work)]
+            + ["--config", str(broken), "export", "-o", str(out)],
+            cwd=str(tmp_path),
+            capture_output=True,
+            text=True,
+        )
+
+        assert result.returncode == 1
+        assert "failed layer(s): {}".format(broken) in result.stderr
+        with tarfile.open(str(out)) as tar:
+            names = tar.getnames()
+        assert home.relative_to("/").joinpath(".all", "f").as_posix() in names
+
+    def test_output_is_byte_for_byte_reproducible(self, repo):
+        tmp_path, home, config_file = repo
+        first = self._export(tmp_path, config_file, "--dereference")
+
+        os.utime(str(tmp_path / "src" / "rc"), (1, 1))
+        (tmp_path / "src" / "pkg" / "sub").chmod(0o700)
+
+        assert self._export(tmp_path, config_file, "--dereference") == first
+
+
+class TestMaterialize:
+    """`link --materialize` places copies and only recopies what changed"""
+
+    @pytest.fixture
+    def repo(self, tmp_path):
+        (tmp_path / "src" / "pkg" / "sub").mkdir(parents=True)
+        (tmp_path / "src" / "rc").write_text("rc\n")
+        (tmp_path / "src" / "pkg" / "sub" / "run").write_text("#!/bin/sh\n")
+        (tmp_path / "src" / "pkg" / "sub" / "run").chmod(0o755)
+        home = tmp_path / "home"
+        home.mkdir()
+        config_file = tmp_path / "dotfiles.json"
+        links = {str(home / ".rc"): "src/rc", str(home / ".pkg"): "src/pkg"}
+        config_file.write_text(json.dumps({"home": str(home), "links": links}))
+        return tmp_path, home, config_file
+
+    def _materialize(self, tmp_path, config_file, *argv):
+        return _run_dot(config_file, tmp_path, "--materialize", *argv)
+
+    def test_copies_files_and_directory_trees(self, repo):
+        tmp_path, home, config_file = repo
+
+        result = self._materialize(tmp_path, config_file)
+
+        assert result.returncode == 0, result.stdout + result.stderr
+        assert "2 created" in result.stdout
+        run = home / ".pkg" / "sub" / "run"
+        assert not run.is_symlink() and not (home / ".pkg").is_symlink()
+        assert run.read_text() == "#!/bin/sh\n" and os.access(str(run), os.X_OK)
+        assert (home / ".rc").read_text() == "rc\n"
+
+    def test_second_run_copies_only_changed_sources(self, repo):
+        tmp_path, home, config_file = repo
+        self._materialize(tmp_path, config_file)
+        (tmp_path / "src" / "rc").write_text("rc, edited\n")
+
+        result = self._materialize(tmp_path, config_file)
+
+        assert "Summary: 0 created, 1 unchanged, 0 repointed, 0 skipped, 1 updated" in (
+            result.stdout
+        )
+        assert "Copied" in result.stdout and "sub/run" not in result.stdout
+        assert (home / ".rc").read_text() == "rc, edited\n"
+
+    def test_checksum_skips_a_touched_but_unchanged_source(self, repo):
+        tmp_path, home, config_file = repo
+        self._materialize(tmp_path, config_file, "--checksum")
+        os.utime(str(tmp_path / "src" / "rc"), (1, 1))
+
+        result = self._materialize(tmp_path, config_file, "--checksum")
+
+        assert "2 unchanged" in result.stdout and "Copied" not in result.stdout
+        assert os.stat(str(home / ".rc")).st_mtime == 1
+
+    def test_an_edited_copy_is_kept_unless_forced(self, repo):
+        tmp_path, home, config_file = repo
+        self._materialize(tmp_path, config_file)
+        (home / ".rc").write_text("mine\n")
+        (tmp_path / "src" / "rc").write_text("theirs\n")
+
+        result = self._materialize(tmp_path, config_file)
+        assert "changed since dot copied it" in result.stdout
+        assert (home / ".rc").read_text() == "mine\n"
+
+        self._materialize(tmp_path, config_file, "--force-relink")
+        assert (home / ".rc").read_text() == "theirs\n"
+
+    def test_links_become_copies_and_unlink_removes_them(self, repo):
+        tmp_path, home, config_file = repo
+        assert _run_dot(config_file, tmp_path).returncode == 0
+        assert self._materialize(tmp_path, config_file).returncode == 0
+        assert not (tmp_path / "src" / "pkg" / "pkg").exists()
+        assert not (home / ".rc").is_symlink()
+
+        result = _run_dot_cmd(tmp_path, "--config", config_file, "unlink", "--yes")
+
+        assert result.returncode == 0, result.stderr
+        assert "WARNING" not in result.stdout
+        assert list(home.iterdir()) == []
+        assert (tmp_path / "src" / "rc").read_text() == "rc\n"
+
+    def test_declining_keeps_the_directory_link(self, repo):
+        tmp_path, home, config_file = repo
+        assert _run_dot(config_file, tmp_path).returncode == 0
+        dot_path = os.path.join(os.path.dirname(__file__), "..", "dot.py")
+        cmd = [sys.executable, dot_path, "--config", str(config_file), "link"]
+
+        result = subprocess.run(
+            cmd + ["--materialize"],
+            cwd=str(tmp_path),
+            input="n\n" * 5,
+            capture_output=True,
+            text=True,
+        )
+
+        assert result.returncode == 0, result.stderr
+        assert "Replacing symlink" not in result.stdout
+        assert os.readlink(str(home / ".pkg")) == str(tmp_path / "src" / "pkg")
+        assert os.readlink(str(home / ".rc")) == str(tmp_path / "src" / "rc")
+
+    def test_confirming_replaces_the_directory_link_once(self, repo):
+        tmp_path, home, config_file = repo
+        assert _run_dot(config_file, tmp_path).returncode == 0
+        dot_path = os.path.join(os.path.dirname(__file__), "..", "dot.py")
+        cmd = [sys.executable, dot_path, "--config", str(config_file), "link"]
+
+        result = subprocess.run(
+            cmd + ["--materialize"],
+            cwd=str(tmp_path),
+            input="y\nn\n",  # replace ~/.pkg; keep the ~/.rc link
+            capture_output=True,
+            text=True,
+        )
+
+        assert result.returncode == 0, result.stderr
+        run = home / ".pkg" / "sub" / "run"
+        assert not (home / ".pkg").is_symlink() and run.read_text() == "#!/bin/sh\n"
+        assert (home / ".rc").is_symlink()
+
+    def test_link_after_materialize_does_not_trust_the_state_index(self, repo):
+        tmp_path, home, config_file = repo
+        assert _run_dot(config_file, tmp_path).returncode == 0
+        assert self._materialize(tmp_path, config_file).returncode == 0
+
+        result = _run_dot(config_file, tmp_path)
+
+        assert "nothing changed" not in result.stdout
+        assert "already exists and is not a symlink" in result.stderr
+
+    def test_unsupported_copy_methods_fall_back_once(self, tmp_path, monkeypatch):
+        calls = []
+
+        def unsupported(name, code):
+            def method(src_fd, dst_fd):
+                calls.append(name)
+                raise OSError(code, name)
+
+            return method
+
+        monkeypatch.setattr(
+            dot,
+            "_COPY_METHODS",
+            {
+                "reflink": unsupported("reflink", errno.EOPNOTSUPP),
+                "copy_file_range": unsupported("copy_file_range", errno.EXDEV),
+                "sendfile": unsupported("sendfile", errno.ENOSYS),
+            },
+        )
+        monkeypatch.setattr(dot, "_COPY_SKIP", {})
+        for name in ("a", "b"):
+            (tmp_path / name).write_bytes(b"x" * 100)
+            info = os.stat(str(tmp_path / name))
+            method = dot._copy_file(
+                str(tmp_path / name), str(tmp_path / (name + "2")), info
+            )
+
+            assert method == "buffered"
+            assert (tmp_path / (name + "2")).read_bytes() == b"x" * 100
+        assert calls == ["reflink", "copy_file_range", "sendfile"]
+
+
+class TestAdopt:
+    """`dot adopt` moves files that block links into the repo and links them"""
+
+    @pytest.fixture
+    def machine(self, tmp_path):
+        (tmp_path / "src").mkdir()
+        (tmp_path / "src" / "rc").write_text("rc\n")
+        (tmp_path / "src" / "same").write_text("same\n")
+        (tmp_path / "src" / "other").write_text("repo\n")
+        home = tmp_path / "home"
+        (home / ".vim" / "colors").mkdir(parents=True)
+        (home / ".vim" / "colors" / "dark.vim").write_text("hi\n")
+        (home / ".vim" / "colors" / "current.vim").symlink_to("dark.vim")
+        (home / ".gitconfig").write_text("[user]\n")
+        (home / ".same").write_text("same\n")
+        (home / ".other").write_text("local\n")
+        config_file = tmp_path / "dotfiles.json"
+        links = {
+            str(home / ".rc"): "src/rc",
+            str(home / ".vim"): "src/vim",
+            str(home / ".gitconfig"): "src/git/config",
+            str(home / ".same"): "src/same",
+            str(home / ".other"): "src/other",
+        }
+        config_file.write_text(json.dumps({"home": str(home), "links": links}))
+        return tmp_path, home, config_file
+
+    def _adopt(self, tmp_path, config_file, *argv):
+        return _run_dot_cmd(tmp_path, "--config", config_file, "adopt", "--yes", *argv)
+
+    def test_moves_blocking_targets_into_the_repo_and_links_them(self, machine):
+        tmp_path, home, config_file = machine
+
+        result = self._adopt(tmp_path, config_file)
+
+        assert result.returncode == 0, result.stdout + result.stderr
+        src = tmp_path / "src"
+        assert os.readlink(str(home / ".vim")) == str(src / "vim")
+        assert (src / "vim" / "colors" / "dark.vim").read_text() == "hi\n"
+        assert os.readlink(str(src / "vim" / "colors" / "current.vim")) == "dark.vim"
+        assert os.readlink(str(home / ".gitconfig")) == str(src / "git" / "config")
+        assert (src / "git" / "config").read_text() == "[user]\n"
+        assert os.readlink(str(home / ".same")) == str(src / "same")
+        assert os.readlink(str(home / ".rc")) == str(src / "rc")
+        assert "Adopted 3." in result.stdout
+
+    def test_a_target_that_differs_from_an_existing_source_is_left(self, machine):
+        tmp_path, home, config_file = machine
+
+        result = self._adopt(tmp_path, config_file)
+
+        assert "both exist and differ" in result.stdout
+        assert (home / ".other").read_text() == "local\n"
+        assert (tmp_path / "src" / "other").read_text() == "repo\n"
+
+    def test_dry_run_changes_nothing(self, machine):
+        tmp_path, home, config_file = machine
+
+        result = self._adopt(tmp_path, config_file, "--dry-run")
+
+        assert result.returncode == 0, result.stderr
+        assert "Would move {} -->".format(home / ".vim") in result.stdout
+        assert "(same contents)" in result.stdout
+        assert "3 to adopt" in result.stdout
+        assert not (tmp_path / "src" / "vim").exists()
+        assert not (home / ".rc").exists() and not (home / ".same").is_symlink()
+
+    def test_undo_moves_adopted_files_back(self, machine):
+        tmp_path, home, config_file = machine
+        assert self._adopt(tmp_path, config_file).returncode == 0
+
+        result = self._adopt(tmp_path, config_file, "--undo")
+
+        assert result.returncode == 0, result.stderr
+        assert not (home / ".vim").is_symlink()
+        assert (home / ".vim" / "colors" / "dark.vim").read_text() == "hi\n"
+        assert (home / ".gitconfig").read_text() == "[user]\n"
+        assert (home / ".same").read_text() == "same\n"
+        assert (tmp_path / "src" / "same").read_text() == "same\n"
+        assert not (tmp_path / "src" / "vim").exists()
+        assert "Nothing to undo" in self._adopt(tmp_path, config_file, "--undo").stdout
+
+    def test_moves_across_filesystems_by_copying(self, tmp_path, monkeypatch):
+        tree = tmp_path / "tree"
+        (tree / "sub").mkdir(parents=True)
+        (tree / "sub" / "run").write_text("#!/bin/sh\n")
+        (tree / "sub" / "run").chmod(0o755)
+        (tree / "link").symlink_to("sub/run")
+
+        rename = os.rename
+
+        def cross_device(src, dst):
+            if src == str(tree):  # _copy_file's own temp-file rename still works
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            rename(src, dst)
+
+        monkeypatch.setattr(dot.os, "rename", cross_device)
+        method = dot._move(str(tree), str(tmp_path / "moved"))
+
+        assert method != "rename"
+        assert not tree.exists()
+        run = tmp_path / "moved" / "sub" / "run"
+        assert run.read_text() == "#!/bin/sh\n" and os.access(str(run), os.X_OK)
+        assert os.readlink(str(tmp_path / "moved" / "link")) == "sub/run"
+
+
+class TestKeepGoing:
+    """`link --keep-going` links what it can and reports every bad entry"""
+
+    @pytest.fixture
+    def manifest(self, tmp_path):
+        for name in ("a", "b", "c"):
+            (tmp_path / "src" / name).parent.mkdir(exist_ok=True)
+            (tmp_path / "src" / name).write_text(name)
+        home = tmp_path / "home"
+        home.mkdir()
+        (home / ".file").write_text("mine\n")
+        links = {
+            str(home / ".a"): "src/a",
+            str(home / ".missing"): "src/nope",
+            str(home / ".glob"): "src/zz*",
+            str(home / ".file"): "src/b",
+            str(home / ".nosrc"): "",
+            str(home / ".all"): "src/*",
+        }
+        config_file = tmp_path / "dotfiles.json"
+        config_file.write_text(json.dumps({"home": str(home), "links": links}))
+        return tmp_path, home, config_file
+
+    @pytest.mark.parametrize("jobs", ["1", "2"])
+    def test_links_healthy_entries_and_reports_each_bad_key(self, manifest, jobs):
+        tmp_path, home, config_file = manifest
+
+        result = _run_dot(config_file, tmp_path, "--keep-going", "--jobs", jobs)
+
+        assert result.returncode == 1
+        assert os.readlink(str(home / ".a")) == str(tmp_path / "src" / "a")
+        assert os.readlink(str(home / ".all" / "c")) == str(tmp_path / "src" / "c")
+        assert (home / ".file").read_text() == "mine\n"
+        for key in (".missing", ".glob", ".file", ".nosrc"):
+            assert '"{}": '.format(home / key) in result.stderr
+        assert "4 manifest entries failed." in result.stderr
+
+    def test_every_problem_is_found_before_anything_changes(self, manifest):
+        tmp_path, home, config_file = manifest
+
+        result = _run_dot(config_file, tmp_path, "--keep-going")
+
+        warning = result.stdout.index("4 manifest entries cannot be linked")
+        assert warning < result.stdout.index("Created symlink")
+
+    def test_without_keep_going_the_first_bad_entry_still_aborts(self, manifest):
+        tmp_path, home, config_file = manifest
+
+        result = _run_dot(config_file, tmp_path)
+
+        assert result.returncode == 1
+        assert "failed." not in result.stderr
+        assert list(home.iterdir()) == [home / ".file"]
+
+    def test_resolution_records_errors_by_manifest_key(self, tmp_path):
+        (tmp_path / "src").mkdir()
+        (tmp_path / "src" / "rc").write_text("")
+        links = {"~/.rc": "src/rc", "~/.gone": "src/gone", "~/.dir": "src/*"}
+        config = {"home": str(tmp_path)}
+        failures = dot._Failures()
+
+        resolved = dot._resolve_all_links(links, config, str(tmp_path), errors=failures)
+
+        assert sorted(resolved) == [
+            os.path.expanduser("~/.dir/rc"),
+            os.path.expanduser("~/.rc"),
+        ]
+        assert [key for key, _ in failures.items] == ["~/.gone"]
+        assert failures.key_of(os.path.expanduser("~/.dir/rc")) == "~/.dir"
+        with pytest.raises(dot.SourceError):
+            dot._resolve_all_links(links, config, str(tmp_path))
+
+
+class TestLibraryAPI:
+    """dot.Manifest plans and applies in-process without printing or exiting"""
+
+    @pytest.fixture
+    def manifest(self, tmp_path):
+        (tmp_path / "src").mkdir()
+        (tmp_path / "src" / "rc").write_text("rc")
+        home = tmp_path / "home"
+        home.mkdir()
+        config_file = tmp_path / "dotfiles.json"
+        links = {str(home / ".rc"): "src/rc", str(home / ".config" / "rc"): "src/rc"}
+        config_file.write_text(json.dumps({"home": str(home), "links": links}))
+        return dot.Manifest.load(str(config_file)), home
+
+    def test_apply_returns_results_and_prints_nothing(self, manifest, capsys):
+        manifest, home = manifest
+
+        results = manifest.apply()
+        again = manifest.apply()
+
+        assert [(r.target, r.outcome) for r in results] == [
+            (str(home / ".config" / "rc"), dot.LINK_CREATED),
+            (str(home / ".rc"), dot.LINK_CREATED),
+        ]
+        assert results[0].messages[0][0] == "success"
+        assert [r.outcome for r in again] == [dot.LINK_UNCHANGED] * 2
+        assert capsys.readouterr() == ("", "")
+
+    def test_plan_changes_nothing(self, manifest):
+        manifest, home = manifest
+
+        entries = manifest.plan()
+
+        assert [e["action"] for e in entries] == ["missing-parent", "create"]
+        assert list(home.iterdir()) == []
+
+    def test_conflict_raises_or_is_reported_with_keep_going(self, manifest):
+        manifest, home = manifest
+        (home / ".rc").write_text("a real file")
+
+        with pytest.raises(dot.ConflictError):
+            manifest.apply()
+        results = manifest.apply(keep_going=True)
+
+        assert [r.outcome for r in results] == [dot.LINK_UNCHANGED, dot.LINK_FAILED]
+        assert results[1].messages[0][0] == "error"
+
+    def test_a_parent_blocked_by_a_file_is_a_typed_error(self, tmp_path):
+        (tmp_path / "src").mkdir()
+        (tmp_path / "src" / "a").write_text("a")
+        home = tmp_path / "home"
+        home.mkdir()
+        (home / "blocker").write_text("a real file")
+        links = {str(home / "blocker" / "sub" / "a"): "src/a", str(home / "b"): "src/a"}
+        manifest = dot.Manifest({"home": str(home), "links": links}, str(tmp_path))
+
+        with pytest.raises(dot.FilesystemError):
+            manifest.apply()
+        results = manifest.apply(keep_going=True)
+
+        assert [(r.target, r.outcome) for r in results] == [
+            (str(home / "b"), dot.LINK_CREATED),
+            (str(home / "blocker" / "sub" / "a"), dot.LINK_FAILED),
+        ]
+        level, text = results[1].messages[0]
+        assert level == "error" and "Cannot create parent dir" in text
+
+    def test_errors_are_typed_dot_errors(self, tmp_path):
+        config_file = tmp_path / "dotfiles.json"
+        config_file.write_text(json.dumps({"links": ["not", "a", "mapping"]}))
+        with pytest.raises(dot.ManifestError):
+            dot.Manifest.load(str(config_file))
+
+        missing = dot.Manifest(
+            {"links": {str(tmp_path / ".x"): "nope/*"}}, str(tmp_path)
+        )
+        with pytest.raises(dot.SourceError) as e:
+            missing.resolve()
+        assert isinstance(e.value, dot.DotError)
+
+    def test_cli_unlink_removes_what_the_api_linked(self, manifest, tmp_path):
+        manifest, home = manifest
+        manifest.apply()
+
+        result = _run_dot_cmd(
+            tmp_path, "--config", tmp_path / "dotfiles.json", "unlink", "--yes"
+        )
+
+        assert result.returncode == 0, result.stderr
+        assert list(home.iterdir()) == []
+
+
+@pytest.mark.skipif(not dot._DIR_FD_SUPPORTED, reason="no dir_fd on this platform")
+class TestDirFds:
+    """Apply works relative to each open target directory, with a path fallback"""
+
+    @pytest.fixture
+    def repo(self, tmp_path, state_dir):
+        src = tmp_path / "src"
+        (src / "pkg").mkdir(parents=True)
+        (src / "other").mkdir()
+        for name in ("a", "b", "c", "extra"):
+            (src / name).write_text(name)
+        home = tmp_path / "home"
+        home.mkdir()
+        links = {str(home / ".config" / "app" / n): str(src / n) for n in "abc"}
+        links[str(home / ".pkg")] = str(src / "pkg")
+        links[str(home / ".pkg" / "extra")] = str(src / "extra")
+        config_file = tmp_path / "dotfiles.json"
+        config_file.write_text(json.dumps({"home": str(home), "links": links}))
+        return src, home, config_file
+
+    def _opened_dirs(self, monkeypatch):
+        opened = []
+        real_open = os.open
+
+        def counted(path, flags, *a, **k):
+            if flags & os.O_DIRECTORY:
+                opened.append(path)
+            return real_open(path, flags, *a, **k)
+
+        monkeypatch.setattr(os, "open", counted)
+        return opened
+
+    def test_each_target_dir_is_opened_once_and_closed(self, repo, monkeypatch):
+        src, home, config_file = repo
+        opened = self._opened_dirs(monkeypatch)
+        fds_before = len(os.listdir("/proc/self/fd"))
+
+        dot.main(["--config", str(config_file), "link", "--yes"])
+        dot.main(["--config", str(config_file), "unlink", "--yes"])
+
+        assert opened.count(str(home / ".config" / "app")) == 2  # link, unlink
+        assert (src / "pkg" / "extra").exists() is False  # removed via the dir link
+        assert list(home.iterdir()) == []
+        assert len(os.listdir("/proc/self/fd")) == fds_before
+
+    def test_replaced_dir_link_is_reopened(self, tmp_path):
+        for name in ("a", "b"):
+            (tmp_path / name).mkdir()
+        link = str(tmp_path / "link")
+        os.symlink(str(tmp_path / "a"), link)
+
+        with dot._DirFds() as fds:
+            fds.symlink("x", os.path.join(link, "one"))
+            fds.unlink(link)
+            fds.symlink(str(tmp_path / "b"), link)
+            fds.symlink("x", os.path.join(link, "two"))
+
+        assert os.listdir(str(tmp_path / "a")) == ["one"]
+        assert os.listdir(str(tmp_path / "b")) == ["two"]
+
+    def test_paths_are_used_without_dir_fd(self, repo, monkeypatch):
+        src, home, config_file = repo
+        (home / ".pkg").symlink_to(src / "other")
+        monkeypatch.setattr(dot, "_DIR_FD_SUPPORTED", False)
+        opened = self._opened_dirs(monkeypatch)
+
+        dot.main(["--config", str(config_file), "link", "--yes", "--force-relink"])
+
+        assert opened == []
+        assert os.readlink(str(home / ".pkg")) == str(src / "pkg")
+        assert (src / "pkg" / "extra").is_symlink()
+        assert not (src / "other" / "extra").exists()